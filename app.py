@@ -8,10 +8,14 @@
 - models/: 数据模型
 - utils/: 工具函数
 """
+import uuid
+
 import streamlit as st
 
+from src.config import TEMPLATE_CACHE_WARMUP
 from src.pages import render_template_page, render_data_page, render_generate_page
 from src.components import render_sidebar
+from src.services.template_cache import template_cache
 
 
 # ==================== 页面配置 ====================
@@ -32,18 +36,41 @@ def init_session_state():
         "template_name": "",
         "description": "",
         "doc_elements": [],
+        "doc_element_index": {},
+        "element_page": 1,
+        "candidate_index": {"by_element": {}, "by_type": {}},
         "location_mapping": {},
+        "repeat_rows": [],
+        "jinja_variables": [],
+        "jinja_error": "",
+        "placeholder_count": 0,
         "selected_element_id": None,
         "uploaded_df": None,
+        "uploaded_df_key": None,
+        "column_stats": [],
+        "preview_page": 1,
         "selected_template": None,
-        "generated_files": [],
+        "selected_bundle": None,
+        "image_dir": "",
+        "generated_archives": [],
+        "generation_result": None,
         "column_mapping": {},
+        "detail_config": {},
+        "detail_frames": {},
+        "scheduler_user": uuid.uuid4().hex[:8],  # 任务调度按会话区分用户
     }
     for key, value in defaults.items():
         if key not in st.session_state:
             st.session_state[key] = value
 
 
+# ==================== 模板缓存预热 ====================
+@st.cache_resource
+def warm_up_template_cache():
+    """进程启动时在后台预热常用模板（每个进程只执行一次）"""
+    return template_cache.warm_up_async(TEMPLATE_CACHE_WARMUP)
+
+
 # ==================== 路由控制 ====================
 def route_to_page(step: str):
     """根据步骤路由到对应页面"""
@@ -63,6 +90,7 @@ def main():
     """主函数"""
     # 初始化
     init_session_state()
+    warm_up_template_cache()
     
     # 页面标题
     st.title("📝 合同自动填写工具")
@@ -22,8 +22,7 @@ def render_sidebar(current_step: str) -> str:
             return step_key
     
     st.sidebar.divider()
-    templates = template_service.list_templates()
-    st.sidebar.info(f"📚 已保存: {len(templates)} 个模板")
+    st.sidebar.info(f"📚 已保存: {template_service.count_templates()} 个模板")
     
     return current_step
 
@@ -12,9 +12,13 @@ STORAGE_DIR = BASE_DIR / "src" / "storage"
 TEMPLATES_DIR = STORAGE_DIR / "templates"
 CONFIGS_DIR = STORAGE_DIR / "configs"
 OUTPUTS_DIR = STORAGE_DIR / "outputs"
+ARTIFACTS_DIR = STORAGE_DIR / "compiled"   # 预编译模板
+BLOBS_DIR = STORAGE_DIR / "blobs"          # 按内容哈希存放的模板文件
+BUNDLES_DIR = STORAGE_DIR / "bundles"      # 模板组合配置
+JOBS_DIR = OUTPUTS_DIR / "jobs"            # 生成任务的进度日志与未完成的压缩包
 
 # 确保目录存在
-for dir_path in [TEMPLATES_DIR, CONFIGS_DIR, OUTPUTS_DIR]:
+for dir_path in [TEMPLATES_DIR, CONFIGS_DIR, OUTPUTS_DIR, ARTIFACTS_DIR, BLOBS_DIR, BUNDLES_DIR, JOBS_DIR]:
     dir_path.mkdir(parents=True, exist_ok=True)
 
 # 占位符模式
@@ -23,3 +27,84 @@ PLACEHOLDER_TEMPLATE = "【{}】"    # 生成【变量名】格式
 
 # 模板变量格式（docxtpl使用）
 VAR_TEMPLATE = "{{{{ {} }}}}"     # 生成 {{变量名}} 格式
+
+# 数据预览
+PREVIEW_PAGE_SIZES = [20, 50, 100, 200]  # 每页行数选项
+PREVIEW_SAMPLE_ROWS = 100                # 抽样预览行数
+
+# 模板编辑器
+ELEMENT_PAGE_SIZE = 30  # 段落列表每页显示数量
+
+# 模板注册表：目录修改时间距今小于该秒数时不信任缓存（文件系统时间戳精度）
+REGISTRY_MTIME_SLACK = 2
+
+# 模板存储后端："json"（默认，每个模板一个JSON文件）或 "sqlite"
+TEMPLATE_STORE_BACKEND = os.environ.get("TEMPLATE_STORE_BACKEND", "json")
+TEMPLATE_DB_PATH = STORAGE_DIR / "templates.db"
+SQLITE_BUSY_TIMEOUT_MS = 5000
+
+# 预编译模板缓存
+COMPILED_CACHE_MAX_MB = 256   # 缓存内存上限
+TEMPLATE_CACHE_WARMUP = 5     # 启动时预热使用最多的模板数量
+
+# 流式编译：正文XML超过此大小时逐块编译并直接写入磁盘，不加载完整文档
+STREAMING_COMPILE_MIN_MB = 8
+
+# 循环行：行数据中存放明细记录的保留键 {循环行名称: [明细记录, ...]}
+DETAIL_DATA_KEY = "__details__"
+
+# 模板组合：压缩包内的目录结构
+BUNDLE_LAYOUTS = {
+    "person": "按人员分文件夹（张三/劳动合同.docx）",
+    "template": "按模板分文件夹（劳动合同/张三.docx）",
+}
+
+# 图片变量：未指定宽度时的默认宽度（厘米，高度按比例），并行读取图片的线程数，
+# 已读取图片的缓存上限（按最近使用淘汰，计入任务内存预算；每人一张照片时内存不随行数增长）
+IMAGE_DEFAULT_WIDTH_CM = 3.0
+IMAGE_PREFETCH_WORKERS = 8
+IMAGE_CACHE_MB = int(os.environ.get("IMAGE_CACHE_MB", 32))
+
+# 批量生成流水线：渲染线程数，阶段之间队列的最大长度（内存占用与此相关，与数据行数无关）
+PIPELINE_RENDERERS = min(8, os.cpu_count() or 1)
+PIPELINE_QUEUE_DEPTH = 64
+
+# 任务调度：所有会话的生成任务共用的工作槽位数（同时渲染的行数），
+# 行数不超过 SCHEDULER_INTERACTIVE_ROWS 的任务按交互任务优先
+SCHEDULER_WORKERS = int(os.environ.get("SCHEDULER_WORKERS", PIPELINE_RENDERERS))
+SCHEDULER_INTERACTIVE_ROWS = 20
+JOB_PRIORITIES = {
+    "interactive": "交互（单份/少量）",
+    "bulk": "批量",
+}
+
+# 分布式生成：各机器挂载的共享目录（队列数据库与任务文件），每个数据块的行数，
+# 租约时长（worker 宕机后多久由其他 worker 接手），数据块最多尝试次数，空闲时查询队列的间隔
+CLUSTER_DIR = Path(os.environ.get("CLUSTER_DIR", STORAGE_DIR / "cluster"))
+CLUSTER_CHUNK_ROWS = 500
+CLUSTER_LEASE_SECONDS = 60
+CLUSTER_MAX_ATTEMPTS = 3
+CLUSTER_POLL_SECONDS = 2
+
+# 监视目录（无人值守生成）：根目录下为 inbox / outbox / processed / failed；
+# 扫描间隔，文件状态保持不变多久后处理（跳过仍在复制中的文件），同时处理的文件数
+HOT_FOLDER_DIR = Path(os.environ.get("HOT_FOLDER_DIR", STORAGE_DIR / "hotfolder"))
+WATCH_POLL_SECONDS = 5
+WATCH_SETTLE_SECONDS = 3
+WATCH_WORKERS = 2
+
+# 内存预算：单个任务暂存数据（队列中的行、待归档的文档）的上限，超出时等待归档；
+# 进程常驻内存超出全局上限时，待归档的文档先写入临时文件
+JOB_MEMORY_BUDGET_MB = int(os.environ.get("JOB_MEMORY_BUDGET_MB", 256))
+GLOBAL_MEMORY_BUDGET_MB = int(os.environ.get("GLOBAL_MEMORY_BUDGET_MB", 2048))
+MEMORY_SAMPLE_SECONDS = 0.5
+
+# 压缩包格式：docx 本身已是压缩文件，默认不再压缩
+ARCHIVE_MODES = {
+    "stored": "ZIP 不压缩（最快，docx本身已压缩）",
+    "deflate": "ZIP 压缩",
+    "tar": "tar.gz 流",
+}
+ARCHIVE_DEFAULT_MODE = "stored"
+ARCHIVE_DEFLATE_LEVEL = 6
+ARCHIVE_VOLUME_MB = 0   # 分卷大小，0 表示不分卷
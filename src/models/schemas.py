@@ -1,19 +1,101 @@
 """
 数据模型定义
-支持两种映射格式：
-1. location_mapping: 精确位置映射
+支持三种映射格式：
+1. location_mapping: 精确位置映射（可配置循环行）
 2. text_mapping: 简单文本映射
+3. jinja_variables: docxtpl {{ 变量 }} 语法模板（支持条件、循环）
 """
 from dataclasses import dataclass, field
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple, Union
 from datetime import datetime
 import json
 
+from ..config import VAR_TEMPLATE
+
+
+def iter_locations(location: Union[Dict, List[Dict]]) -> List[Dict]:
+    """
+    统一位置映射的取值：单个位置或同一变量的多处位置列表
+    """
+    if isinstance(location, list):
+        return location
+    return [location]
+
+
+def group_locations(location_mapping: Dict) -> Dict[str, List[Tuple[str, Dict]]]:
+    """
+    按元素分组展开位置映射：{元素ID: [(变量名, 位置), ...]}
+    
+    元素内按偏移从后往前排列：先替换靠后的位置，前面位置的偏移不受替换长度变化影响，
+    同一变量在一个元素中多次出现时一次遍历即可全部替换
+    """
+    groups: Dict[str, List[Tuple[str, Dict]]] = {}
+    for var_name, location in location_mapping.items():
+        for loc in iter_locations(location):
+            groups.setdefault(loc.get("element_id"), []).append((var_name, loc))
+    for items in groups.values():
+        items.sort(key=lambda item: item[1].get("start", 0), reverse=True)
+    return groups
+
+
+def add_location(location_mapping: Dict, var_name: str, location: Dict) -> None:
+    """为变量添加一处位置；变量已映射时追加为多处位置（同一位置不重复添加）"""
+    if var_name not in location_mapping:
+        location_mapping[var_name] = location
+        return
+    
+    locs = iter_locations(location_mapping[var_name])
+    position = (location.get("element_id"), location.get("start"))
+    if any((loc.get("element_id"), loc.get("start")) == position for loc in locs):
+        return
+    location_mapping[var_name] = locs + [location]
+
+
+def image_variables(location_mapping: Dict) -> List[str]:
+    """
+    图片变量：位置带有 "kind": "image"，生成时单元格中的图片路径替换为图片
+    （可选 "width_cm" 指定宽度，高度按比例）
+    """
+    return [
+        var_name for var_name, location in location_mapping.items()
+        if isinstance(location, (dict, list))
+        and any(loc.get("kind") == "image" for loc in iter_locations(location))
+    ]
+
+
+def repeat_row_prefix(repeat_row: Dict) -> str:
+    """循环行内单元格的元素ID前缀"""
+    return f"cell_{repeat_row['table_index']}_{repeat_row['row_index']}_"
+
+
+def split_repeat_variables(location_mapping: Dict, repeat_rows: List[Dict]) -> Dict[str, List[str]]:
+    """
+    按循环行划分变量
+    
+    Returns:
+        {循环行名称: 位于该行的变量名}，不在任何循环行中的变量归入 ""（主表变量）
+    """
+    if not repeat_rows:
+        return {"": list(location_mapping)}
+    
+    groups: Dict[str, List[str]] = {"": []}
+    prefixes = [(row["name"], repeat_row_prefix(row)) for row in repeat_rows]
+    for row in repeat_rows:
+        groups[row["name"]] = []
+    
+    for var_name, location in location_mapping.items():
+        element_id = iter_locations(location)[0].get("element_id", "")
+        group = next((name for name, prefix in prefixes if element_id.startswith(prefix)), "")
+        groups[group].append(var_name)
+    return groups
+
 
 @dataclass
 class TemplateConfig:
     """
     模板配置
+    
+    location_mapping 的值可以是单个位置，也可以是同一变量多处出现的位置列表
     """
     template_id: str
     template_name: str
@@ -29,6 +111,19 @@ class TemplateConfig:
     created_at: str = field(default_factory=lambda: datetime.now().isoformat())
     updated_at: str = field(default_factory=lambda: datetime.now().isoformat())
     description: str = ""
+    usage_count: int = 0
+    
+    # 模板文件内容哈希（内容寻址存储；为空表示旧模板，文件在 templates 目录）
+    content_hash: str = ""
+    
+    # 上传的原始文件哈希（保存时经过优化或书签绑定，存储的文件与原始文件不同）
+    source_hash: str = ""
+    
+    # 循环行：[{"name": 名称, "table_index": 表格, "row_index": 行}]，按明细记录重复
+    repeat_rows: List[Dict] = field(default_factory=list)
+    
+    # Jinja模板：模板中需要从数据提供的变量（模板本身即映射，无需配置位置）
+    jinja_variables: List[str] = field(default_factory=list)
     
     def to_dict(self) -> dict:
         return {
@@ -40,7 +135,12 @@ class TemplateConfig:
             "text_mapping": self.text_mapping,
             "created_at": self.created_at,
             "updated_at": self.updated_at,
-            "description": self.description
+            "description": self.description,
+            "usage_count": self.usage_count,
+            "content_hash": self.content_hash,
+            "source_hash": self.source_hash,
+            "repeat_rows": self.repeat_rows,
+            "jinja_variables": self.jinja_variables
         }
     
     @classmethod
@@ -54,15 +154,24 @@ class TemplateConfig:
             text_mapping=data.get("text_mapping", {}),
             created_at=data.get("created_at", ""),
             updated_at=data.get("updated_at", ""),
-            description=data.get("description", "")
+            description=data.get("description", ""),
+            usage_count=data.get("usage_count", 0),
+            content_hash=data.get("content_hash", ""),
+            source_hash=data.get("source_hash", ""),
+            repeat_rows=data.get("repeat_rows", []),
+            jinja_variables=data.get("jinja_variables", [])
         )
     
     def get_mapping(self) -> Dict:
         """获取有效的映射（优先使用location_mapping）"""
         if self.location_mapping:
+            if self.repeat_rows:
+                return {"type": "location", "data": self.location_mapping, "repeats": self.repeat_rows}
             return {"type": "location", "data": self.location_mapping}
         elif self.text_mapping:
             return {"type": "text", "data": self.text_mapping}
+        elif self.jinja_variables:
+            return {"type": "jinja", "data": {v: VAR_TEMPLATE.format(v) for v in self.jinja_variables}}
         return {"type": "none", "data": {}}
     
     def get_excel_columns(self) -> List[str]:
@@ -71,9 +180,45 @@ class TemplateConfig:
             return list(self.location_mapping.keys())
         elif self.text_mapping:
             return list(self.text_mapping.keys())
+        elif self.jinja_variables:
+            return list(self.jinja_variables)
         return []
 
 
+@dataclass
+class BundleConfig:
+    """
+    模板组合：多个已保存模板共用一份列映射和数据，每行数据一次生成全部文档
+    """
+    bundle_id: str
+    bundle_name: str
+    template_ids: List[str] = field(default_factory=list)
+    created_at: str = field(default_factory=lambda: datetime.now().isoformat())
+    updated_at: str = field(default_factory=lambda: datetime.now().isoformat())
+    description: str = ""
+    
+    def to_dict(self) -> dict:
+        return {
+            "bundle_id": self.bundle_id,
+            "bundle_name": self.bundle_name,
+            "template_ids": self.template_ids,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            "description": self.description
+        }
+    
+    @classmethod
+    def from_dict(cls, data: dict) -> "BundleConfig":
+        return cls(
+            bundle_id=data["bundle_id"],
+            bundle_name=data["bundle_name"],
+            template_ids=data.get("template_ids", []),
+            created_at=data.get("created_at", ""),
+            updated_at=data.get("updated_at", ""),
+            description=data.get("description", "")
+        )
+
+
 @dataclass
 class GenerationTask:
     """生成任务"""
@@ -1,10 +1,14 @@
 """
 数据导入页面
 """
+import hashlib
 import streamlit as st
 import pandas as pd
 from datetime import datetime
 
+from src.config import PREVIEW_PAGE_SIZES, PREVIEW_SAMPLE_ROWS
+from src.models.schemas import image_variables, iter_locations, split_repeat_variables
+from src.services.bundle_service import bundle_service
 from src.services.template_service import template_service
 from src.services.excel_service import excel_service
 from src.utils import generate_excel_template
@@ -25,10 +29,15 @@ def render_template_selector():
     return template_options[selected_key]
 
 
-def render_column_mapping(var_names: list, excel_columns: list):
+def render_column_mapping(
+    var_names: list,
+    excel_columns: list,
+    title: str = "🔗 变量列映射配置",
+    key_prefix: str = "col_map_"
+):
     """渲染列映射配置"""
     st.divider()
-    st.subheader("🔗 变量列映射配置")
+    st.subheader(title)
     st.caption("将模板变量映射到Excel列名")
     
     column_mapping = {}
@@ -39,17 +48,14 @@ def render_column_mapping(var_names: list, excel_columns: list):
         for j, var_name in enumerate(var_names[i:i+cols_per_row]):
             with cols[j]:
                 # 尝试自动匹配
-                default_idx = 0
-                for idx, col in enumerate(excel_columns):
-                    if col == var_name or var_name in col or col in var_name:
-                        default_idx = idx + 1
-                        break
+                matched = excel_service.match_column(var_name, excel_columns)
+                default_idx = excel_columns.index(matched) + 1 if matched else 0
                 
                 selected_col = st.selectbox(
                     f"**{var_name}**",
                     options=["-- 不映射 --"] + excel_columns,
                     index=default_idx,
-                    key=f"col_map_{var_name}"
+                    key=f"{key_prefix}{var_name}"
                 )
                 
                 if selected_col != "-- 不映射 --":
@@ -58,34 +64,227 @@ def render_column_mapping(var_names: list, excel_columns: list):
     return column_mapping
 
 
+def load_uploaded_excel(excel_file):
+    """
+    读取上传的Excel，按文件内容缓存
+    
+    同一文件在页面重跑时不再重复解析和统计
+    
+    Returns:
+        (DataFrame, 错误信息)
+    """
+    file_bytes = excel_file.getvalue()
+    file_key = hashlib.md5(file_bytes).hexdigest()
+    
+    if st.session_state.uploaded_df_key != file_key:
+        df, error = excel_service.read_excel(file_bytes, excel_file.name)
+        if error:
+            return None, error
+        st.session_state.uploaded_df = df
+        st.session_state.uploaded_df_key = file_key
+        st.session_state.column_stats = excel_service.compute_column_stats(df)
+        st.session_state.preview_page = 1
+    
+    return st.session_state.uploaded_df, None
+
+
+def load_detail_sheet(excel_file, sheet_name: str):
+    """读取明细工作表，按文件内容和表名缓存"""
+    frame_key = (st.session_state.uploaded_df_key, sheet_name)
+    if frame_key not in st.session_state.detail_frames:
+        df, error = excel_service.read_excel(excel_file.getvalue(), excel_file.name, sheet_name=sheet_name)
+        if error:
+            return None, error
+        # 换了文件后丢弃旧文件的明细表
+        frames = {k: v for k, v in st.session_state.detail_frames.items() if k[0] == frame_key[0]}
+        frames[frame_key] = df
+        st.session_state.detail_frames = frames
+    return st.session_state.detail_frames[frame_key], None
+
+
+def render_detail_config(repeat_row: dict, detail_vars: list, excel_file, master_columns: list):
+    """
+    配置循环行的明细数据来源：明细工作表、主表与明细表的关联列、明细列映射
+    
+    生成时明细表整表分组一次后按关联值挂到每条主记录
+    """
+    name = repeat_row["name"]
+    st.divider()
+    st.subheader(f"🔁 循环行「{name}」明细数据")
+    
+    sheets = excel_service.list_sheets(excel_file.getvalue())
+    c1, c2, c3 = st.columns(3)
+    with c1:
+        sheet = st.selectbox(
+            "明细工作表",
+            options=sheets,
+            index=min(1, len(sheets) - 1),
+            key=f"detail_sheet_{name}"
+        )
+    
+    detail_df, error = load_detail_sheet(excel_file, sheet)
+    if error:
+        show_error(f"读取明细失败: {error}")
+        return
+    detail_columns = detail_df.columns.tolist()
+    
+    with c2:
+        master_key = st.selectbox("主表关联列", options=master_columns, key=f"detail_master_key_{name}")
+    with c3:
+        default_key = detail_columns.index(master_key) if master_key in detail_columns else 0
+        detail_key = st.selectbox(
+            "明细表关联列", options=detail_columns, index=default_key, key=f"detail_key_{name}"
+        )
+    
+    column_mapping = render_column_mapping(
+        detail_vars, detail_columns,
+        title=f"🔗 「{name}」明细列映射",
+        key_prefix=f"detail_map_{name}_"
+    )
+    show_info(f"明细 {len(detail_df)} 条")
+    
+    st.session_state.detail_config[name] = {
+        "sheet": sheet,
+        "master_key": master_key,
+        "detail_key": detail_key,
+        "column_mapping": column_mapping,
+    }
+
+
+def render_data_preview(df: pd.DataFrame):
+    """渲染分页/抽样数据预览，只向浏览器发送当前页"""
+    c1, c2, c3 = st.columns([2, 2, 3])
+    with c1:
+        mode = st.radio("预览方式", ["分页", "抽样"], horizontal=True, key="preview_mode")
+    
+    if mode == "抽样":
+        st.dataframe(excel_service.sample_rows(df, PREVIEW_SAMPLE_ROWS), use_container_width=True)
+        st.caption(f"随机抽样 {min(len(df), PREVIEW_SAMPLE_ROWS)} 条")
+    else:
+        with c2:
+            page_size = st.selectbox("每页行数", PREVIEW_PAGE_SIZES, key="preview_page_size")
+        total_pages = excel_service.count_pages(df, page_size)
+        with c3:
+            page = st.number_input(
+                f"页码（共 {total_pages} 页）",
+                min_value=1,
+                max_value=total_pages,
+                value=min(st.session_state.preview_page, total_pages),
+                step=1
+            )
+        st.session_state.preview_page = page
+        st.dataframe(excel_service.get_page(df, page, page_size), use_container_width=True)
+    
+    with st.expander("📈 列统计", expanded=False):
+        st.dataframe(pd.DataFrame(st.session_state.column_stats), use_container_width=True)
+
+
+def excel_example_map(config) -> dict:
+    """Excel模板的列名及示例值来源"""
+    mapping_info = config.get_mapping()
+    if mapping_info['type'] in ('text', 'jinja'):
+        return mapping_info['data']
+    return {
+        k: iter_locations(v)[0].get("original_text", "")
+        for k, v in mapping_info['data'].items()
+    }
+
+
+def render_bundle_selector():
+    """
+    渲染模板组合选择器
+    
+    Returns:
+        (组合, 组合中的模板)；组合中的模板都已删除时模板为空列表
+    """
+    bundles = {b.bundle_name: b for b in bundle_service.list_bundles()}
+    st.subheader("📦 选择模板组合")
+    bundle = bundles[st.selectbox("选择组合", options=list(bundles.keys()))]
+    templates = bundle_service.get_templates(bundle)
+    if not templates:
+        show_warning("⚠️ 组合中的模板都已删除")
+    elif len(templates) < len(bundle.template_ids):
+        show_warning("⚠️ 组合中部分模板已删除，只生成剩余模板")
+    return bundle, templates
+
+
+def template_image_variables(templates) -> list:
+    """模板（或组合中各模板）的图片变量"""
+    names = {}
+    for config in templates:
+        mapping_info = config.get_mapping()
+        if mapping_info["type"] == "location":
+            names.update(dict.fromkeys(image_variables(mapping_info["data"])))
+    return list(names)
+
+
+def render_image_dir(image_vars: list):
+    """图片变量的图片目录：Excel中填写相对路径时按此目录查找"""
+    st.subheader("🖼️ 图片")
+    st.session_state.image_dir = st.text_input(
+        "图片目录",
+        value=st.session_state.image_dir,
+        help=f"图片变量（{'、'.join(image_vars)}）对应的列填写图片路径；相对路径按此目录查找，找不到的图片留空"
+    ).strip()
+
+
 def render_data_page():
     """渲染数据导入页面"""
     st.header("📊 步骤2: 数据导入")
     
-    # 选择模板
-    selected = render_template_selector()
-    if not selected:
-        return
+    # 选择模板或模板组合
+    use_bundle = False
+    if bundle_service.list_bundles():
+        use_bundle = st.radio("生成方式", ["单个模板", "模板组合"], horizontal=True) == "模板组合"
     
-    st.session_state.selected_template = selected
-    
-    # 获取映射信息
-    mapping_info = selected.get_mapping()
-    var_names = list(mapping_info['data'].keys())
+    if use_bundle:
+        bundle, templates = render_bundle_selector()
+        if not templates:
+            return
+        
+        # 各模板的同名变量共用一列
+        merged = bundle_service.merge_variables(templates)
+        st.session_state.selected_bundle = bundle
+        st.session_state.selected_template = None
+        
+        source_name = bundle.bundle_name
+        var_names = merged["variables"]
+        repeat_rows = merged["repeats"]
+        var_groups = {"": var_names, **merged["details"]}
+        example_map = {}
+        for config in templates:
+            for k, v in excel_example_map(config).items():
+                example_map.setdefault(k, v)
+        example_map = {k: example_map[k] for k in var_names}
+        image_vars = template_image_variables(templates)
+    else:
+        selected = render_template_selector()
+        if not selected:
+            return
+        
+        st.session_state.selected_template = selected
+        st.session_state.selected_bundle = None
+        
+        # 获取映射信息
+        mapping_info = selected.get_mapping()
+        source_name = selected.template_name
+        var_names = list(mapping_info['data'].keys())
+        
+        # 循环行中的变量由明细表提供，主表只映射其余变量
+        repeat_rows = mapping_info.get("repeats", [])
+        var_groups = split_repeat_variables(mapping_info['data'], repeat_rows)
+        example_map = excel_example_map(selected)
+        image_vars = template_image_variables([selected])
     
     show_info(f"**模板变量:** {', '.join(var_names)}")
     
     # 下载Excel模板
     if st.button("📥 下载Excel模板"):
-        if mapping_info['type'] == 'text':
-            excel_bytes = generate_excel_template(mapping_info['data'])
-        else:
-            simple_map = {k: v.get("original_text", "") for k, v in mapping_info['data'].items()}
-            excel_bytes = generate_excel_template(simple_map)
+        excel_bytes = generate_excel_template(example_map)
         st.download_button(
             label="📥 下载",
             data=excel_bytes,
-            file_name=f"{selected.template_name}_模板.xlsx",
+            file_name=f"{source_name}_模板.xlsx",
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
         )
     
@@ -96,21 +295,28 @@ def render_data_page():
     excel_file = st.file_uploader("选择Excel文件", type=["xlsx", "xls"])
     
     if excel_file:
-        df, error = excel_service.read_excel(excel_file.getvalue(), excel_file.name)
+        df, error = load_uploaded_excel(excel_file)
         if error:
             show_error(f"读取失败: {error}")
             return
         
-        st.session_state.uploaded_df = df
-        st.dataframe(df, use_container_width=True)
+        render_data_preview(df)
         show_info(f"共 {len(df)} 条记录")
         
         # 列映射配置
         excel_columns = df.columns.tolist()
-        column_mapping = render_column_mapping(var_names, excel_columns)
+        master_vars = var_groups[""] if repeat_rows else var_names
+        column_mapping = render_column_mapping(master_vars, excel_columns)
         
         st.session_state.column_mapping = column_mapping
         
+        st.session_state.detail_config = {}
+        for repeat_row in repeat_rows:
+            render_detail_config(repeat_row, var_groups[repeat_row["name"]], excel_file, excel_columns)
+        
+        if image_vars:
+            render_image_dir(image_vars)
+        
         if column_mapping:
             show_success(f"已配置 {len(column_mapping)} 个映射")
         else:
@@ -1,17 +1,37 @@
 """
 批量生成页面
 """
+import uuid
+
 import streamlit as st
 import pandas as pd
-import zipfile
-from io import BytesIO
 from datetime import datetime
+from functools import partial
+from pathlib import Path
 
+from src.config import (
+    ARCHIVE_DEFAULT_MODE, ARCHIVE_DEFLATE_LEVEL, ARCHIVE_MODES, ARCHIVE_VOLUME_MB, BUNDLE_LAYOUTS, CLUSTER_DIR,
+    JOB_PRIORITIES, OUTPUTS_DIR
+)
+from src.services.bundle_service import bundle_service
+from src.services.archive_writer import ARCHIVE_EXTENSIONS
+from src.services.excel_service import excel_service
+from src.services.generation_pipeline import GenerationPipeline
+from src.services.image_loader import ImageLoader
+from src.services.job_journal import JobJournal, JobLocked, job_fingerprint
+from src.services.job_scheduler import job_scheduler
+from src.services.memory_budget import memory_budget
 from src.services.template_service import template_service
+from src.services.template_cache import template_cache
 from src.services.word_service import word_service
+from src.services.work_queue import WorkQueue
 from src.components import show_success, show_error, show_warning
 
 
+MB = 1024 * 1024
+STAGE_LABELS = {"reader": "读取数据", "renderer": "生成文档", "archiver": "写入压缩包"}
+
+
 def render_column_mapping_display(column_mapping: dict):
     """显示列映射配置"""
     if column_mapping:
@@ -20,24 +40,250 @@ def render_column_mapping_display(column_mapping: dict):
                 st.write(f"**{var_name}** ← `{col_name}`")
 
 
-def transform_data(df: pd.DataFrame, column_mapping: dict) -> list:
-    """根据列映射转换数据"""
-    transformed_data = []
+def detail_groups(df: pd.DataFrame, repeat_rows: list) -> list:
+    """
+    循环行的明细记录分组
     
-    for _, row in df.iterrows():
-        new_row = {}
-        for var_name, col_name in column_mapping.items():
-            if col_name in df.columns:
-                value = row[col_name]
-                if pd.isna(value):
-                    new_row[var_name] = ""
-                elif isinstance(value, (pd.Timestamp, datetime)):
-                    new_row[var_name] = value.strftime("%Y-%m-%d")
-                else:
-                    new_row[var_name] = str(value)
-        transformed_data.append(new_row)
+    每个明细表只分组一次，按关联值直接取出，不为每条主记录重新筛选
+    
+    Returns:
+        [(循环行名称, 主表每行的关联值, {关联值: [明细记录]})]
+    """
+    groups = []
+    for repeat_row in repeat_rows:
+        config = st.session_state.detail_config.get(repeat_row["name"])
+        if not config or not config["column_mapping"]:
+            continue
+        detail_df = st.session_state.detail_frames.get(
+            (st.session_state.uploaded_df_key, config["sheet"])
+        )
+        if detail_df is None:
+            continue
+        
+        groups.append((
+            repeat_row["name"],
+            excel_service.format_keys(df, config["master_key"]).tolist(),
+            excel_service.group_details(detail_df, config["detail_key"], config["column_mapping"]),
+        ))
+    return groups
+
+
+def iter_rows(df: pd.DataFrame, column_mapping: dict, details: list, chunk_rows: int = 1000):
+    """
+    按列映射逐块转换数据并挂上明细记录
+    
+    每块整列格式化一次，流水线按需取行，不一次生成全部行数据
+    """
+    for start in range(0, len(df), chunk_rows):
+        rows = excel_service.format_columns(df.iloc[start:start + chunk_rows], column_mapping).to_dict("records")
+        for name, master_keys, groups in details:
+            excel_service.attach_details(rows, master_keys[start:start + chunk_rows], name, groups)
+        yield from rows
+
+
+def render_pipeline_stats(result):
+    """显示流水线各阶段计数"""
+    with st.expander("⚙️ 生成统计", expanded=False):
+        memory = result.memory
+        st.caption(
+            f"{result.rows} 行 → {result.documents} 份文档，耗时 {result.elapsed:.1f} 秒，"
+            f"瓶颈阶段: {STAGE_LABELS[result.bottleneck]}"
+        )
+        st.caption(
+            f"进程峰值内存 {memory['peak_rss'] / MB:.0f} MB（全局预算 {memory_budget.limit / MB:.0f} MB），"
+            f"任务暂存峰值 {memory['peak_total'] / MB:.1f} MB（预算 {memory['limit'] / MB:.0f} MB），"
+            f"限流等待 {memory['throttled']:.1f} 秒，写入临时文件 {memory['spilled']} 份"
+        )
+        if "images" in memory["stages"]:
+            st.caption(f"图片缓存峰值 {memory['stages']['images'] / MB:.1f} MB")
+        scheduling = result.scheduling
+        if scheduling:
+            st.caption(
+                f"调度优先级: {JOB_PRIORITIES[scheduling['priority']]}，等待工作槽位共 {scheduling['waited']:.1f} 秒"
+                f"（每行平均 {scheduling['avg_wait'] * 1000:.0f} 毫秒，最长 {scheduling['max_wait']:.2f} 秒）"
+            )
+        st.dataframe(
+            pd.DataFrame([
+                {
+                    "阶段": STAGE_LABELS[name],
+                    "处理数": stage["items"],
+                    "失败": stage["failed"],
+                    "每秒": round(stage["per_second"], 1),
+                    "忙碌占比": f"{stage['utilization']:.0%}",
+                    "等待上游(秒)": stage["starved"],
+                    "等待下游(秒)": stage["blocked"],
+                    "暂存峰值(MB)": round(memory["stages"].get(name, 0) / MB, 2),
+                }
+                for name, stage in result.stages.items()
+            ]),
+            hide_index=True,
+            use_container_width=True
+        )
+
+
+def render_archive_options() -> dict:
+    """压缩包格式、压缩级别、分卷大小"""
+    with st.expander("📦 压缩包设置", expanded=False):
+        mode = st.radio(
+            "格式",
+            options=list(ARCHIVE_MODES.keys()),
+            index=list(ARCHIVE_MODES).index(ARCHIVE_DEFAULT_MODE),
+            format_func=ARCHIVE_MODES.get,
+            horizontal=True
+        )
+        level = ARCHIVE_DEFLATE_LEVEL
+        if mode != "stored":
+            level = st.slider("压缩级别", min_value=1, max_value=9, value=ARCHIVE_DEFLATE_LEVEL)
+        volume_mb = st.number_input(
+            "分卷大小 (MB)", min_value=0, value=ARCHIVE_VOLUME_MB, step=100,
+            help="超过该大小时拆分为多个独立的压缩包，0 表示不分卷"
+        )
+    return {"archive_mode": mode, "deflate_level": level, "volume_mb": volume_mb}
+
+
+def generation_journal(templates: list, column_mapping: dict, layout: str, archive_options: dict) -> JobJournal:
+    """本次生成的任务日志：模板、数据和生成设置都相同时续跑上次中断的任务"""
+    return JobJournal(job_fingerprint({
+        "templates": [template_cache.cache_key(t) for t in templates],
+        "data": st.session_state.uploaded_df_key,
+        "column_mapping": column_mapping,
+        "detail_config": st.session_state.detail_config,
+        "layout": layout,
+        "archive": archive_options,
+        "image_dir": st.session_state.image_dir,
+    }))
+
+
+def render_unfinished_job(journal: JobJournal, total: int) -> int:
+    """
+    显示上次中断的任务，可选择放弃重新开始
+    
+    Returns:
+        已完成的行数（没有未完成的任务时为0）
+    """
+    if not journal.exists():
+        return 0
+    done = len(journal.completed_rows())
+    if journal.running():
+        st.info(f"相同的任务正在另一个会话中生成（已完成 {done}/{total} 行），完成后可在该会话中下载")
+        return done
+    c1, c2 = st.columns([4, 1])
+    c1.info(f"上次生成（{journal.meta().get('created', '')}）未完成：已完成 {done}/{total} 行，继续生成将跳过这些行")
+    if c2.button("重新开始", use_container_width=True):
+        try:
+            journal.remove()
+        except JobLocked as e:
+            show_warning(str(e))
+            return done
+        st.rerun()
+    return done
+
+
+def render_scheduler_stats():
+    """显示所有会话共用的任务队列"""
+    stats = job_scheduler.stats()
+    with st.expander("🧮 任务队列", expanded=False):
+        c1, c2, c3 = st.columns(3)
+        c1.metric("工作槽位", stats["workers"])
+        c2.metric("渲染中", stats["running"])
+        c3.metric("排队行数", stats["queued"])
+        if stats["users"]:
+            st.dataframe(
+                pd.DataFrame([
+                    {
+                        "用户": "当前会话" if user["user"] == st.session_state.scheduler_user else user["user"],
+                        "任务数": user["jobs"],
+                        "渲染中": user["running"],
+                        "排队": user["queued"],
+                        "最早排队(秒)": user["oldest_wait"],
+                    }
+                    for user in stats["users"]
+                ]),
+                hide_index=True,
+                use_container_width=True
+            )
+
+
+@st.cache_resource
+def get_work_queue() -> WorkQueue:
+    """共享工作队列（进程内一个实例，首次使用时创建队列数据库）"""
+    return WorkQueue()
+
+
+def submit_distributed(templates: list, compiled_templates: list, rows, layout, archive_options: dict):
+    """提交到共享工作队列，由各机器上的 worker.py 生成"""
+    job_id = get_work_queue().submit(
+        f"合同_{datetime.now():%Y%m%d_%H%M%S}",
+        [(t.template_id, name, compiled) for t, (name, compiled) in zip(templates, compiled_templates)],
+        rows,
+        {
+            "layout": layout,
+            "archive_mode": archive_options["archive_mode"],
+            "deflate_level": archive_options["deflate_level"],
+            "image_dir": st.session_state.image_dir,
+        }
+    )
+    for template in templates:
+        template_service.record_usage(template.template_id)
+    show_success(f"已提交分布式任务 {job_id}，等待 worker 领取生成")
+
+
+def render_cluster_jobs():
+    """显示分布式任务的进度、在线的 worker，完成后按数据块下载"""
+    if not (CLUSTER_DIR / "queue.db").exists():
+        return
+    queue = get_work_queue()
+    jobs = queue.jobs()
+    if not jobs:
+        return
     
-    return transformed_data
+    with st.expander("🖧 分布式任务", expanded=False):
+        workers = queue.workers()
+        st.caption(f"在线 worker {len(workers)} 个：" + "，".join(
+            f"{w['worker']}（{'生成中' if w['task'] else '空闲'}）" for w in workers
+        ) if workers else "没有在线的 worker，请在各机器上运行 python worker.py")
+        if st.button("刷新", key="refresh_cluster_jobs"):
+            st.rerun()
+        
+        for job in jobs:
+            status = {"running": "进行中", "done": "已完成", "failed": "失败", "cancelled": "已取消"}[job["status"]]
+            st.progress(
+                min((job["rows_done"] or 0) / max(job["total_rows"], 1), 1.0),
+                text=f"{job['name']}｜{status}｜{job['rows_done'] or 0}/{job['total_rows']} 行，"
+                     f"数据块 {job['chunks_done']}/{job['chunks']}，生成中 {job['leased']} 块"
+            )
+            if job["status"] == "failed" and job["error"]:
+                show_error(f"{job['name']}: {job['error']}")
+            if job["status"] == "running" and st.button("取消", key=f"cancel_{job['job_id']}"):
+                queue.cancel(job["job_id"])
+                st.rerun()
+            
+            outputs = [path for path in queue.outputs(job["job_id"]) if path.exists()]
+            if job["status"] == "done" and outputs:
+                part = st.selectbox(
+                    f"{job['name']} 共 {len(outputs)} 个压缩包（{job['documents']} 份文档）",
+                    options=outputs,
+                    format_func=lambda path: path.name,
+                    key=f"part_{job['job_id']}"
+                )
+                with open(part, "rb") as f:
+                    st.download_button(
+                        label=f"下载 {part.name}",
+                        data=f,
+                        file_name=f"{job['name']}_{part.name}",
+                        key=f"download_{job['job_id']}_{part.name}"
+                    )
+
+
+def render_cache_stats():
+    """显示预编译模板缓存统计"""
+    stats = template_cache.stats()
+    with st.expander("⚙️ 模板缓存", expanded=False):
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric("命中", stats["hits"])
+        c2.metric("未命中", stats["misses"])
+        c3.metric("缓存模板", stats["entries"])
+        c4.metric("占用", f"{stats['bytes'] / 1024 / 1024:.1f} MB")
 
 
 def render_generate_page():
@@ -45,7 +291,14 @@ def render_generate_page():
     st.header("🚀 步骤3: 批量生成")
     
     # 检查前置条件
-    if not st.session_state.selected_template:
+    bundle = st.session_state.selected_bundle
+    if bundle:
+        templates = bundle_service.get_templates(bundle)
+        source_name = f"{bundle.bundle_name}（{len(templates)} 个模板）"
+    elif st.session_state.selected_template:
+        templates = [st.session_state.selected_template]
+        source_name = templates[0].template_name
+    else:
         show_warning("⚠️ 请先选择模板")
         return
     
@@ -53,68 +306,138 @@ def render_generate_page():
         show_warning("⚠️ 请先上传数据")
         return
     
-    template = st.session_state.selected_template
     df = st.session_state.uploaded_df
     column_mapping = st.session_state.get("column_mapping", {})
     
     # 显示状态
     c1, c2 = st.columns(2)
-    c1.info(f"**模板:** {template.template_name}")
+    c1.info(f"**模板:** {source_name}")
     c2.info(f"**数据:** {len(df)} 条")
     
     # 显示列映射
     render_column_mapping_display(column_mapping)
     
+    layout = "person"
+    if bundle:
+        layout = st.radio(
+            "压缩包目录结构",
+            options=list(BUNDLE_LAYOUTS.keys()),
+            format_func=BUNDLE_LAYOUTS.get,
+            horizontal=True
+        )
+    
+    archive_options = render_archive_options()
+    distributed = st.checkbox(
+        "提交到分布式队列",
+        help="按行切分为数据块写入共享目录，由各机器上运行的 worker.py 生成，适合数万行的大批量"
+    )
+    journal = generation_journal(templates, column_mapping, layout, archive_options)
+    resumed = render_unfinished_job(journal, len(df))
+    
     # 生成按钮
-    if st.button("开始生成", type="primary", use_container_width=True):
+    if st.button("继续生成" if resumed else "开始生成", type="primary", use_container_width=True):
         if not column_mapping:
             show_error("请先在「数据导入」页面配置列映射")
             return
         
         with st.spinner("生成中..."):
             try:
-                template_bytes = template_service.get_template_bytes(template.template_id)
-                if not template_bytes:
-                    show_error("模板不存在")
+                if not templates or any(t.get_mapping()['type'] == 'none' for t in templates):
+                    show_error("模板没有配置映射")
                     return
                 
-                # 转换数据
-                transformed_data = transform_data(df, column_mapping)
+                # 预编译模板（跨会话缓存，同一模板只编译一次）
+                compiled_templates = []
+                for template in templates:
+                    compiled = template_cache.get_compiled(template)
+                    if compiled is None:
+                        show_error(f"模板不存在: {template.template_name}")
+                        return
+                    compiled_templates.append((template.template_name, compiled))
                 
-                # 获取映射信息
-                mapping_info = template.get_mapping()
+                # 逐块转换数据（组合中的模板共用同一份数据），经流水线直接写入磁盘上的压缩包，
+                # 或写入共享目录由各机器上的 worker 生成
+                repeat_rows = {r["name"]: r for t in templates for r in t.repeat_rows}
+                rows = iter_rows(df, column_mapping, detail_groups(df, list(repeat_rows.values())))
                 
-                # 生成文档
-                if mapping_info['type'] == 'location':
-                    files = word_service.batch_generate_by_location(
-                        template_bytes, transformed_data, mapping_info['data']
+                if distributed:
+                    submit_distributed(templates, compiled_templates, rows, layout if bundle else None, archive_options)
+                else:
+                    extension = ARCHIVE_EXTENSIONS[archive_options["archive_mode"]]
+                    # 所有会话共用输出目录，文件名加随机后缀，同一秒内完成的任务不会互相覆盖或删除
+                    output_name = journal.meta().get("output_name") or (
+                        f"合同_{datetime.now():%Y%m%d_%H%M%S}_{uuid.uuid4().hex[:8]}{extension}"
                     )
-                elif mapping_info['type'] == 'text':
-                    files = word_service.batch_generate_by_text(
-                        template_bytes, transformed_data, mapping_info['data']
+                    output_path = OUTPUTS_DIR / output_name
+                    # 同一任务正在另一个会话中生成时抛出 JobLocked，不影响本会话上次的压缩包
+                    journal.start(output_name, len(df))
+                    discard_archive()
+                    
+                    image_vars = [v for _, c in compiled_templates for v in getattr(c, "image_variables", [])]
+                    loader = ImageLoader(st.session_state.image_dir, variables=image_vars) if image_vars else None
+                    render = partial(
+                        word_service.render_row_files, compiled_templates,
+                        layout=layout if bundle else None, images=loader
                     )
-                else:
-                    show_error("模板没有配置映射")
-                    return
-                
-                st.session_state.generated_files = files
-                show_success(f"成功生成 {len(files)} 份合同！")
-                
+                    progress = st.progress(0.0, text="生成中...")
+                    
+                    def on_progress(snapshot):
+                        done = resumed + snapshot["stages"]["renderer"]["items"]
+                        progress.progress(min(done / max(len(df), 1), 1.0), text=f"已生成 {done}/{len(df)}")
+                    
+                    try:
+                        ticket = job_scheduler.job(st.session_state.scheduler_user, rows=len(df) - resumed)
+                        result = GenerationPipeline(
+                            render, journal=journal, ticket=ticket, images=loader, **archive_options
+                        ).run(rows, output_path, on_progress=on_progress)
+                    finally:
+                        journal.close()
+                        if loader:
+                            loader.close()
+                    progress.empty()
+                    
+                    for template in templates:
+                        template_service.record_usage(template.template_id)
+                    
+                    st.session_state.generated_archives = [str(path) for path in result.output_paths]
+                    st.session_state.generation_result = result
+                    show_success(f"成功生成 {result.documents} 份合同！")
+                    if result.resumed:
+                        show_success(f"续跑上次中断的任务，跳过已完成的 {result.resumed} 行")
+                    if result.failed:
+                        show_warning(f"{result.failed} 行生成失败，已跳过")
+            
+            except JobLocked as e:
+                show_warning(str(e))
             except Exception as e:
                 show_error(f"失败: {e}")
+                if journal.exists():
+                    show_warning("已完成的部分已保存，再次生成将从中断处继续")
     
-    # 下载
-    if st.session_state.generated_files:
-        zip_buf = BytesIO()
-        with zipfile.ZipFile(zip_buf, 'w', zipfile.ZIP_DEFLATED) as z:
-            for fn, fb in st.session_state.generated_files:
-                z.writestr(fn, fb)
-        zip_buf.seek(0)
-        
-        st.download_button(
-            label="下载全部合同",
-            data=zip_buf,
-            file_name=f"合同_{datetime.now():%Y%m%d_%H%M%S}.zip",
-            mime="application/zip",
-            use_container_width=True
-        )
+    render_cluster_jobs()
+    render_scheduler_stats()
+    render_cache_stats()
+    
+    if st.session_state.generation_result:
+        render_pipeline_stats(st.session_state.generation_result)
+    
+    # 下载（分卷时每卷一个按钮）
+    archives = [Path(path) for path in st.session_state.generated_archives if Path(path).exists()]
+    for i, archive in enumerate(archives):
+        with open(archive, "rb") as f:
+            st.download_button(
+                label="下载全部合同" if len(archives) == 1 else f"下载第 {i + 1}/{len(archives)} 卷",
+                data=f,
+                file_name=archive.name,
+                mime="application/gzip" if archive.name.endswith(".gz") else "application/zip",
+                use_container_width=True,
+                key=f"download_{archive.name}"
+            )
+
+
+def discard_archive():
+    """重新生成前删除本会话上次生成的压缩包"""
+    for path in st.session_state.generated_archives:
+        Path(path).unlink(missing_ok=True)
+    st.session_state.generated_archives = []
+    st.session_state.generation_result = None
@@ -6,9 +6,18 @@ from pathlib import Path
 from io import BytesIO
 from docx import Document
 from typing import Dict, List
+from jinja2 import TemplateSyntaxError
 
+from src.config import ELEMENT_PAGE_SIZE, IMAGE_DEFAULT_WIDTH_CM
+from src.models.schemas import add_location, iter_locations, split_repeat_variables
+from src.services.blob_store import content_hash_of
+from src.services.bundle_service import bundle_service
 from src.services.template_service import template_service
-from src.utils import extract_candidates, generate_excel_template
+from src.services.word_service import word_service
+from src.utils import (
+    build_candidate_index, build_element_var_index, generate_excel_template,
+    suggest_location_mapping
+)
 from src.components import show_success, show_error, show_warning, show_info
 
 
@@ -35,41 +44,52 @@ PAGE_STYLE = """
 
 
 def parse_doc_elements(file_bytes: bytes) -> List[Dict]:
-    """解析Word文档，返回元素列表"""
+    """解析Word文档，返回元素列表（正文段落、表格单元格、页眉页脚）"""
     doc = Document(BytesIO(file_bytes))
     elements = []
     
-    for para_idx, para in enumerate(doc.paragraphs):
-        if para.text.strip():
+    for elem_id, elem_type, element in word_service.iter_elements(doc, include_aliases=False):
+        text = element.text
+        if text.strip():
             elements.append({
-                "type": "paragraph",
-                "index": para_idx,
-                "element_id": f"para_{para_idx}",
-                "text": para.text,
+                "type": elem_type,
+                "index": elem_id.split("_", 1)[1],
+                "element_id": elem_id,
+                "text": text,
             })
     
-    for table_idx, table in enumerate(doc.tables):
-        for row_idx, row in enumerate(table.rows):
-            for cell_idx, cell in enumerate(row.cells):
-                if cell.text.strip():
-                    elements.append({
-                        "type": "table_cell",
-                        "index": f"t{table_idx}_r{row_idx}_c{cell_idx}",
-                        "element_id": f"cell_{table_idx}_{row_idx}_{cell_idx}",
-                        "text": cell.text,
-                    })
-    
     return elements
 
 
+def scan_jinja(file_bytes: bytes):
+    """
+    识别Jinja模板语法
+    
+    Returns:
+        (变量名列表, 语法错误信息)
+    """
+    try:
+        return word_service.scan_jinja_variables(file_bytes) or [], ""
+    except TemplateSyntaxError as e:
+        return [], f"第{e.lineno}段附近 {e.message}"
+
+
 def render_saved_templates():
     """渲染已保存模板列表"""
     with st.expander("📚 已保存模板", expanded=False):
         templates = template_service.list_templates()
         if templates:
+            # 同一模板文件的不同映射版本数量
+            version_counts = {}
+            for tpl in templates:
+                if tpl.content_hash:
+                    version_counts[tpl.content_hash] = version_counts.get(tpl.content_hash, 0) + 1
+            
             for tpl in templates:
                 c1, c2, c3 = st.columns([3, 2, 1])
-                c1.write(f"**{tpl.template_name}**")
+                versions = version_counts.get(tpl.content_hash, 1)
+                badge = f" · 共享文件 {versions} 个版本" if versions > 1 else ""
+                c1.write(f"**{tpl.template_name}**{badge}")
                 mapping_info = tpl.get_mapping()
                 c2.write(f"{len(mapping_info['data'])} 个变量")
                 if c3.button("🗑️", key=f"del_{tpl.template_id}"):
@@ -79,17 +99,133 @@ def render_saved_templates():
             show_info("暂无保存的模板")
 
 
+def render_bundles():
+    """渲染模板组合管理：多个模板共用一份数据，一次生成全部文档"""
+    with st.expander("📦 模板组合", expanded=False):
+        for bundle in bundle_service.list_bundles():
+            templates = bundle_service.get_templates(bundle)
+            c1, c2 = st.columns([5, 1])
+            c1.write(f"**{bundle.bundle_name}**：{' + '.join(t.template_name for t in templates)}")
+            if c2.button("🗑️", key=f"del_bundle_{bundle.bundle_id}"):
+                bundle_service.delete_bundle(bundle.bundle_id)
+                st.rerun()
+        
+        templates = template_service.list_templates()
+        if len(templates) < 2:
+            show_info("保存两个以上模板后可创建组合")
+            return
+        
+        options = {f"{t.template_name}（{t.template_id}）": t.template_id for t in templates}
+        c1, c2 = st.columns([2, 3])
+        with c1:
+            bundle_name = st.text_input("组合名称", key="bundle_name", placeholder="如：入职文件")
+        with c2:
+            selected = st.multiselect("包含模板", options=list(options.keys()), key="bundle_templates")
+        
+        if st.button("➕ 创建组合", use_container_width=True):
+            if not bundle_name:
+                show_error("请输入组合名称")
+                return
+            try:
+                bundle_service.create_bundle(bundle_name, [options[k] for k in selected])
+                st.rerun()
+            except ValueError as e:
+                show_error(str(e))
+
+
+def _reset_element_page():
+    """搜索条件变化时回到第一页"""
+    st.session_state.element_page = 1
+
+
+def _jump_to_element(elements: List[Dict]):
+    """跳转到指定编号的段落并选中"""
+    number = st.session_state.element_jump
+    if 1 <= number <= len(elements):
+        st.session_state.selected_element_id = elements[number - 1]["element_id"]
+        st.session_state.element_search = ""
+        st.session_state.element_page = (number - 1) // ELEMENT_PAGE_SIZE + 1
+
+
+def render_version_loader(file_bytes: bytes):
+    """同一文件已保存过时，可载入已有版本的映射继续修改"""
+    versions = template_service.find_versions(content_hash_of(file_bytes))
+    if not versions:
+        return
+    
+    options = {f"{v.template_name}（{v.updated_at[:16]}）": v for v in versions}
+    c1, c2 = st.columns([3, 1])
+    with c1:
+        selected = st.selectbox(
+            f"📚 该文件已有 {len(versions)} 个模板版本，可载入其映射",
+            options=list(options.keys()),
+            key="version_to_load"
+        )
+    with c2:
+        st.write("")
+        if st.button("载入映射", use_container_width=True):
+            version = options[selected]
+            st.session_state.location_mapping = dict(version.location_mapping)
+            st.session_state.repeat_rows = list(version.repeat_rows)
+            st.session_state.template_name = version.template_name
+            st.session_state.description = version.description
+            st.rerun()
+
+
 def render_element_selector(elements: List[Dict], location_mapping: Dict, selected_id: str):
-    """渲染段落选择器"""
-    for i, elem in enumerate(elements):
+    """
+    渲染段落选择器
+    
+    分页显示，只为当前页的段落创建控件；变量标记通过预先构建的索引查找
+    """
+    elem_vars = build_element_var_index(location_mapping)
+    
+    c1, c2 = st.columns([3, 1])
+    with c1:
+        keyword = st.text_input(
+            "🔎 搜索段落",
+            key="element_search",
+            placeholder="输入关键字过滤",
+            on_change=_reset_element_page
+        )
+    with c2:
+        st.number_input(
+            "跳转编号",
+            min_value=0,
+            max_value=len(elements),
+            step=1,
+            key="element_jump",
+            on_change=_jump_to_element,
+            args=(elements,)
+        )
+    
+    # 保留全局编号，过滤后编号不变
+    numbered = [
+        (i, elem) for i, elem in enumerate(elements)
+        if not keyword or keyword in elem["text"]
+    ]
+    if not numbered:
+        show_info("没有匹配的段落")
+        return
+    
+    total_pages = max(1, -(-len(numbered) // ELEMENT_PAGE_SIZE))
+    page = min(max(st.session_state.element_page, 1), total_pages)
+    
+    c1, c2, c3 = st.columns([1, 2, 1])
+    if c1.button("◀ 上一页", disabled=page <= 1, use_container_width=True):
+        st.session_state.element_page = page - 1
+        st.rerun()
+    c2.caption(f"第 {page}/{total_pages} 页 · 共 {len(numbered)} 个段落")
+    if c3.button("下一页 ▶", disabled=page >= total_pages, use_container_width=True):
+        st.session_state.element_page = page + 1
+        st.rerun()
+    
+    start = (page - 1) * ELEMENT_PAGE_SIZE
+    for i, elem in numbered[start:start + ELEMENT_PAGE_SIZE]:
         elem_id = elem["element_id"]
         text = elem["text"]
         is_selected = selected_id == elem_id
-        
-        mapped_vars = [
-            k for k, v in location_mapping.items() 
-            if v.get("element_id") == elem_id
-        ]
+        mapped_vars = elem_vars.get(elem_id, [])
         
         c1, c2 = st.columns([0.5, 9.5])
         
@@ -112,6 +248,23 @@ def render_element_selector(elements: List[Dict], location_mapping: Dict, select
         st.divider()
 
 
+def find_occurrences(elements: List[Dict], text: str) -> List[Dict]:
+    """查找文本在各元素中的所有（不重叠）出现位置"""
+    locations = []
+    for elem in elements:
+        pos = elem["text"].find(text)
+        while pos >= 0:
+            locations.append({
+                "element_id": elem["element_id"],
+                "start": pos,
+                "end": pos + len(text),
+                "length": len(text),
+                "original_text": text
+            })
+            pos = elem["text"].find(text, pos + len(text))
+    return locations
+
+
 def render_mapping_config(elem: Dict, elem_id: str, location_mapping: Dict):
     """渲染映射配置面板"""
     st.markdown(f"**选中段落:**")
@@ -127,19 +280,23 @@ def render_mapping_config(elem: Dict, elem_id: str, location_mapping: Dict):
     with c2:
         custom_var = st.text_input("变量名", key="custom_var", placeholder="如：姓名")
     
+    all_occurrences = st.checkbox(
+        "映射全文所有出现位置",
+        key="custom_all",
+        help="同一内容在页眉、正文、签字栏等多处出现时，映射为同一个变量，一列数据填写全部位置"
+    )
+    
     if st.button("➕ 添加自定义映射", type="primary", use_container_width=True):
         if custom_text and custom_var:
-            pos = elem["text"].find(custom_text)
-            if pos >= 0:
-                location_mapping[custom_var] = {
-                    "element_id": elem_id,
-                    "start": pos,
-                    "end": pos + len(custom_text),
-                    "length": len(custom_text),
-                    "original_text": custom_text
-                }
+            if all_occurrences:
+                locations = find_occurrences(st.session_state.doc_elements, custom_text)
+            else:
+                locations = find_occurrences([elem], custom_text)[:1]
+            if locations:
+                for loc in locations:
+                    add_location(location_mapping, custom_var, loc)
                 st.session_state.location_mapping = location_mapping
-                show_success(f"已添加: {custom_var} = {custom_text}")
+                show_success(f"已添加: {custom_var} = {custom_text}（{len(locations)} 处）")
                 st.rerun()
             else:
                 show_error(f"未找到文本: {custom_text}")
@@ -150,7 +307,7 @@ def render_mapping_config(elem: Dict, elem_id: str, location_mapping: Dict):
     st.markdown("#### 🔍 智能检测")
     st.caption("自动识别可替换内容")
     
-    candidates = extract_candidates(elem["text"])
+    candidates = st.session_state.candidate_index["by_element"].get(elem_id, [])
     
     if candidates:
         for cand in candidates:
@@ -167,17 +324,100 @@ def render_mapping_config(elem: Dict, elem_id: str, location_mapping: Dict):
             with c3:
                 if st.button("使用", key=f"det_add_{cand['start']}"):
                     if var_input:
-                        location_mapping[var_input] = {
+                        add_location(location_mapping, var_input, {
                             "element_id": elem_id,
                             "start": cand["start"],
                             "end": cand["end"],
                             "length": cand["end"] - cand["start"],
                             "original_text": cand["text"]
-                        }
+                        })
                         st.session_state.location_mapping = location_mapping
                         st.rerun()
     else:
         show_info("未检测到可替换内容")
+    
+    if elem["type"] == "table_cell":
+        render_repeat_row_config(elem_id)
+
+
+def render_repeat_row_config(elem_id: str):
+    """把选中单元格所在的表格行设为循环行（按明细表逐条重复）"""
+    st.divider()
+    st.markdown("#### 🔁 循环行")
+    st.caption("该行中映射的变量将从明细表取值，每条明细生成一行")
+    
+    table_index, row_index = (int(part) for part in elem_id.split("_")[1:3])
+    repeat_rows = st.session_state.repeat_rows
+    current = next(
+        (r for r in repeat_rows if r["table_index"] == table_index and r["row_index"] == row_index),
+        None
+    )
+    
+    if current:
+        show_info(f"表格{table_index + 1} 第{row_index + 1}行 已设为循环行「{current['name']}」")
+        if st.button("取消循环行", key="repeat_remove"):
+            repeat_rows.remove(current)
+            st.rerun()
+        return
+    
+    c1, c2 = st.columns([2, 1])
+    with c1:
+        name = st.text_input(
+            "循环行名称",
+            value=f"明细{len(repeat_rows) + 1}",
+            key="repeat_name",
+            label_visibility="collapsed"
+        )
+    with c2:
+        if st.button("设为循环行", key="repeat_add", use_container_width=True):
+            if not name or any(r["name"] == name for r in repeat_rows):
+                show_error("请输入不重复的名称")
+            else:
+                repeat_rows.append({"name": name, "table_index": table_index, "row_index": row_index})
+                st.rerun()
+
+
+def render_bulk_suggestions(location_mapping: Dict):
+    """渲染全文档批量建议（基于上传时构建的候选索引）"""
+    by_type = st.session_state.candidate_index["by_type"]
+    if not by_type:
+        return
+    
+    with st.expander("🧠 全文批量建议", expanded=False):
+        st.caption("按类型汇总全文识别结果，一键生成映射")
+        for ctype, items in by_type.items():
+            st.markdown(f"**{ctype}** · {len(items)} 处：" + " ".join(f"`{c['text']}`" for c in items[:8]))
+        
+        selected_types = st.multiselect("选择要添加的类型", options=list(by_type.keys()), key="bulk_types")
+        if st.button("⚡ 一键添加建议映射", disabled=not selected_types, use_container_width=True):
+            candidates = [c for t in selected_types for c in by_type[t]]
+            suggestions = suggest_location_mapping(candidates, location_mapping)
+            location_mapping.update(suggestions)
+            st.session_state.location_mapping = location_mapping
+            show_success(f"已添加 {len(suggestions)} 个映射")
+            st.rerun()
+
+
+def render_image_option(var_name: str, locs: List[Dict]):
+    """图片变量设置：勾选后Excel中该列填图片路径，生成时在映射位置插入图片"""
+    is_image = st.checkbox(
+        "🖼️ 图片", value=locs[0].get("kind") == "image", key=f"img_{var_name}",
+        help="Excel中该列填写图片路径，生成时替换为图片"
+    )
+    width_cm = None
+    if is_image:
+        width_cm = st.number_input(
+            "宽度(厘米)", min_value=0.5, max_value=20.0, step=0.5,
+            value=float(locs[0].get("width_cm") or IMAGE_DEFAULT_WIDTH_CM),
+            key=f"img_width_{var_name}", label_visibility="collapsed"
+        )
+    
+    for loc in locs:
+        loc.pop("kind", None)
+        loc.pop("width_cm", None)
+        if is_image:
+            loc["kind"] = "image"
+            loc["width_cm"] = width_cm
 
 
 def render_mapping_list(location_mapping: Dict):
@@ -187,15 +427,28 @@ def render_mapping_list(location_mapping: Dict):
     
     if location_mapping:
         for var_name, loc in location_mapping.items():
-            c1, c2 = st.columns([4, 1])
+            c1, c2, c3 = st.columns([4, 2, 1])
+            locs = iter_locations(loc)
             with c1:
-                st.write(f"**{var_name}** = `{loc['original_text']}`")
+                suffix = f" ×{len(locs)}" if len(locs) > 1 else ""
+                st.write(f"**{var_name}** = `{locs[0]['original_text']}`{suffix}")
             with c2:
+                render_image_option(var_name, locs)
+            with c3:
                 if st.button("🗑️", key=f"del_map_{var_name}"):
                     del st.session_state.location_mapping[var_name]
                     st.rerun()
     else:
         show_info("暂无映射配置")
+    
+    if st.session_state.repeat_rows:
+        groups = split_repeat_variables(location_mapping, st.session_state.repeat_rows)
+        for repeat_row in st.session_state.repeat_rows:
+            fields = "、".join(groups[repeat_row["name"]]) or "尚无变量"
+            st.write(
+                f"🔁 **{repeat_row['name']}**：表格{repeat_row['table_index'] + 1} "
+                f"第{repeat_row['row_index'] + 1}行（{fields}）"
+            )
 
 
 def render_template_page():
@@ -204,6 +457,7 @@ def render_template_page():
     
     # 已保存模板
     render_saved_templates()
+    render_bundles()
     
     st.divider()
     
@@ -216,12 +470,32 @@ def render_template_page():
         if st.session_state.uploaded_template_bytes != file_bytes:
             st.session_state.uploaded_template_bytes = file_bytes
             st.session_state.doc_elements = parse_doc_elements(file_bytes)
-            st.session_state.location_mapping = {}
+            st.session_state.doc_element_index = {
+                e["element_id"]: e for e in st.session_state.doc_elements
+            }
+            st.session_state.element_page = 1
+            st.session_state.candidate_index = build_candidate_index(st.session_state.doc_elements)
+            st.session_state.location_mapping = word_service.scan_placeholders(file_bytes)
+            st.session_state.placeholder_count = len(st.session_state.location_mapping)
+            st.session_state.repeat_rows = []
+            st.session_state.jinja_variables, st.session_state.jinja_error = scan_jinja(file_bytes)
             st.session_state.template_name = Path(uploaded_file.name).stem
             st.session_state.selected_element_id = None
         
         st.markdown(PAGE_STYLE, unsafe_allow_html=True)
         
+        render_version_loader(file_bytes)
+        
+        if st.session_state.placeholder_count:
+            show_info(f"已自动识别 {st.session_state.placeholder_count} 个【】占位符变量")
+        if st.session_state.jinja_error:
+            show_warning(f"模板中的 {{{{ }}}} 语法有误: {st.session_state.jinja_error}")
+        elif st.session_state.jinja_variables:
+            show_info(
+                f"已识别 Jinja 模板语法，变量: {', '.join(st.session_state.jinja_variables)}"
+                "（可直接按Jinja模板保存，无需配置映射）"
+            )
+        
         # 双列布局
         col_preview, col_config = st.columns([3, 2])
         
@@ -241,13 +515,14 @@ def render_template_page():
             
             if st.session_state.selected_element_id:
                 elem_id = st.session_state.selected_element_id
-                elem = next((e for e in st.session_state.doc_elements if e["element_id"] == elem_id), None)
+                elem = st.session_state.doc_element_index.get(elem_id)
                 
                 if elem:
                     render_mapping_config(elem, elem_id, st.session_state.location_mapping)
             else:
                 show_info("👈 请在左侧点击段落编号选择")
             
+            render_bulk_suggestions(st.session_state.location_mapping)
             render_mapping_list(st.session_state.location_mapping)
         
         # 保存模板
@@ -260,9 +535,42 @@ def render_template_page():
         with c2:
             st.session_state.description = st.text_input("描述", value=st.session_state.description)
         
+        as_jinja = False
+        if st.session_state.jinja_variables:
+            as_jinja = st.checkbox(
+                "🧩 按Jinja模板保存（{{ 变量 }}、{% if %}、{% for %}）",
+                value=True,
+                help="模板中的Jinja语法即为映射，生成时按变量名取Excel列的值"
+            )
+        
+        o1, o2 = st.columns(2)
+        with o1:
+            optimize = st.checkbox(
+                "🧹 优化模板（合并碎片格式片段，生成更快、文件更小）",
+                value=True,
+                help="合并格式相同的相邻文字片段，去除Word编辑痕迹和拼写检查标记，不改变文字和格式"
+            )
+        with o2:
+            bind = st.checkbox(
+                "🔖 书签绑定变量位置",
+                value=True,
+                help="在模板中用隐藏书签标记每个变量，生成时直接定位，模板文字改动后映射仍然有效"
+            )
+        
         if st.button("💾 保存模板", type="primary", use_container_width=True):
             if not st.session_state.template_name:
                 show_error("请输入模板名称")
+            elif as_jinja:
+                try:
+                    config = template_service.create_jinja_template(
+                        template_name=st.session_state.template_name,
+                        original_filename=uploaded_file.name,
+                        docx_bytes=file_bytes,
+                        description=st.session_state.description
+                    )
+                    show_success(f"保存成功！ID: {config.template_id}")
+                except Exception as e:
+                    show_error(f"保存失败: {e}")
             elif not st.session_state.location_mapping:
                 show_error("请至少添加一个映射")
             else:
@@ -272,7 +580,10 @@ def render_template_page():
                         original_filename=uploaded_file.name,
                         docx_bytes=file_bytes,
                         location_mapping=st.session_state.location_mapping,
-                        description=st.session_state.description
+                        description=st.session_state.description,
+                        optimize=optimize,
+                        bind=bind,
+                        repeat_rows=st.session_state.repeat_rows
                     )
                     show_success(f"保存成功！ID: {config.template_id}")
                 except Exception as e:
@@ -0,0 +1,351 @@
+"""
+压缩包写入
+成员在渲染线程中预先压缩（并计算CRC），归档线程只按顺序追加字节，压缩可多线程并行；
+支持 ZIP（不压缩 / deflate）与 tar.gz 流（每个成员一个独立的 gzip 段），ZIP64，按大小分卷
+"""
+import gzip
+import hashlib
+import struct
+import tarfile
+import time
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+from ..config import ARCHIVE_DEFLATE_LEVEL
+
+
+# 压缩包格式 → 扩展名
+ARCHIVE_EXTENSIONS = {
+    "stored": ".zip",
+    "deflate": ".zip",
+    "tar": ".tar.gz",
+}
+
+ZIP64_LIMIT = 0xFFFFFFFF
+_ZIP_COUNT_LIMIT = 0xFFFF
+_UTF8_FLAG = 0x800
+_STORED, _DEFLATED = 0, 8
+
+# 分卷时估算每个成员的头部开销（本地头 + 中央目录 + ZIP64扩展）
+_MEMBER_OVERHEAD = 160
+
+# tar 结束标记：两个全零块
+_TAR_END = gzip.compress(b"\0" * (2 * tarfile.BLOCKSIZE), mtime=0)
+
+
+@dataclass
+class ArchiveMember:
+    """
+    预先压缩好的成员
+    
+    data: ZIP 为压缩后的数据，tar 为该成员的完整 gzip 段（tar头 + 数据 + 补齐）；
+          内存超出预算时写入临时文件，data 为空，path 为文件路径
+    digest: data 的 SHA-256，续跑时校验已写入的内容
+    """
+    name: str
+    data: bytes
+    size: int
+    crc: int = 0
+    method: int = _STORED
+    path: Optional[Path] = None
+    payload_size: int = 0
+    digest: str = ""
+    
+    def __post_init__(self):
+        if not self.payload_size:
+            self.payload_size = len(self.data)
+        if not self.digest:
+            self.digest = hashlib.sha256(self.data).hexdigest()
+    
+    def read(self) -> bytes:
+        return self.path.read_bytes() if self.path else self.data
+
+
+def prepare_member(name: str, content: bytes, mode: str, level: int = ARCHIVE_DEFLATE_LEVEL) -> ArchiveMember:
+    """
+    按压缩包格式预先压缩一个成员（在渲染线程中调用；zlib 压缩、CRC和哈希计算时释放GIL，可并行）
+    """
+    if mode == "tar":
+        info = tarfile.TarInfo(name)
+        info.size = len(content)
+        info.mtime = int(time.time())
+        info.mode = 0o644
+        block = info.tobuf(format=tarfile.PAX_FORMAT, encoding="utf-8") + content
+        padding = -len(content) % tarfile.BLOCKSIZE
+        data = gzip.compress(block + b"\0" * padding, compresslevel=level, mtime=0)
+        return ArchiveMember(name=name, data=data, size=len(content))
+    
+    crc = zlib.crc32(content)
+    if mode == "deflate":
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        data = compressor.compress(content) + compressor.flush()
+        return ArchiveMember(name=name, data=data, size=len(content), crc=crc, method=_DEFLATED)
+    return ArchiveMember(name=name, data=content, size=len(content), crc=crc, method=_STORED)
+
+
+def _dos_datetime(timestamp: float):
+    t = time.localtime(timestamp)
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dos_date = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return dos_time, dos_date
+
+
+class ZipVolume:
+    """
+    单个ZIP文件：成员大小和CRC预先已知，直接写本地头和数据，最后写中央目录
+    
+    大小、偏移或成员数超出32位格式上限时使用ZIP64扩展
+    """
+    
+    def __init__(self, fileobj: BinaryIO, zip64_limit: int = ZIP64_LIMIT):
+        self.fp = fileobj
+        self.zip64_limit = zip64_limit
+        self.offset = 0
+        self.entries: List[Tuple[str, int, int, int, int, int]] = []  # (名称, CRC, 原始大小, 压缩大小, 方法, 偏移)
+        self.dos_time, self.dos_date = _dos_datetime(time.time())
+    
+    def write(self, member: ArchiveMember) -> None:
+        name = member.name.encode("utf-8")
+        payload = member.read()
+        large = member.size >= self.zip64_limit or len(payload) >= self.zip64_limit
+        version = 45 if large or self.offset >= self.zip64_limit else 20
+        
+        extra = struct.pack("<HHQQ", 0x0001, 16, member.size, len(payload)) if large else b""
+        sizes = (ZIP64_LIMIT, ZIP64_LIMIT) if large else (len(payload), member.size)
+        header = struct.pack(
+            "<IHHHHHIIIHH", 0x04034B50, version, _UTF8_FLAG, member.method,
+            self.dos_time, self.dos_date, member.crc, sizes[0], sizes[1], len(name), len(extra)
+        )
+        
+        self.entries.append((member.name, member.crc, member.size, len(payload), member.method, self.offset))
+        self.fp.write(header + name + extra)
+        self.fp.write(payload)
+        self.offset += len(header) + len(name) + len(extra) + len(payload)
+    
+    def restore(self, entries: List[Tuple[str, int, int, int, int, int]], offset: int) -> None:
+        """续写已有的ZIP文件（文件已截断到 offset，中央目录在关闭时按 entries 重新生成）"""
+        self.entries = list(entries)
+        self.offset = offset
+        self.fp.seek(offset)
+        self.fp.truncate()
+    
+    def _central_record(self, name: str, crc: int, size: int, csize: int, method: int, offset: int) -> bytes:
+        """中央目录记录；ZIP64扩展只包含溢出的字段（顺序：原始大小、压缩大小、偏移）"""
+        name_bytes = name.encode("utf-8")
+        large = size >= self.zip64_limit or csize >= self.zip64_limit
+        far = offset >= self.zip64_limit
+        version = 45 if large or far else 20
+        
+        fields = (size, csize) if large else ()
+        if far:
+            fields += (offset,)
+        extra = struct.pack(f"<HH{len(fields)}Q", 0x0001, 8 * len(fields), *fields) if fields else b""
+        sizes = (ZIP64_LIMIT, ZIP64_LIMIT) if large else (csize, size)
+        return struct.pack(
+            "<IHHHHHHIIIHHHHHII", 0x02014B50, (3 << 8) | version, version, _UTF8_FLAG, method,
+            self.dos_time, self.dos_date, crc, sizes[0], sizes[1], len(name_bytes), len(extra),
+            0, 0, 0, 0o644 << 16, ZIP64_LIMIT if far else offset
+        ) + name_bytes + extra
+    
+    def close(self) -> None:
+        """写入中央目录和结束记录"""
+        cd_offset = self.offset
+        cd_data = b"".join(self._central_record(*entry) for entry in self.entries)
+        count = len(self.entries)
+        self.fp.write(cd_data)
+        
+        if count >= min(_ZIP_COUNT_LIMIT, self.zip64_limit) or max(cd_offset, len(cd_data)) >= self.zip64_limit:
+            zip64_end = cd_offset + len(cd_data)
+            self.fp.write(struct.pack(
+                "<IQHHIIQQQQ", 0x06064B50, 44, 45, 45, 0, 0, count, count, len(cd_data), cd_offset
+            ))
+            self.fp.write(struct.pack("<IIQI", 0x07064B50, 0, zip64_end, 1))
+            count = min(count, _ZIP_COUNT_LIMIT)
+            cd_offset = min(cd_offset, ZIP64_LIMIT)
+        
+        self.fp.write(struct.pack(
+            "<IHHHHIIH", 0x06054B50, 0, 0, count, count, min(len(cd_data), ZIP64_LIMIT), cd_offset, 0
+        ))
+
+
+class TarVolume:
+    """tar.gz 流：依次追加各成员的 gzip 段（多段 gzip 可被 tar / gzip 直接解压）"""
+    
+    def __init__(self, fileobj: BinaryIO):
+        self.fp = fileobj
+        self.offset = 0
+    
+    def write(self, member: ArchiveMember) -> None:
+        payload = member.read()
+        self.fp.write(payload)
+        self.offset += len(payload)
+    
+    def restore(self, entries, offset: int) -> None:
+        """续写已有的 tar.gz 流（截断到 offset）"""
+        self.offset = offset
+        self.fp.seek(offset)
+        self.fp.truncate()
+    
+    def close(self) -> None:
+        self.fp.write(_TAR_END)
+
+
+class ArchiveWriter:
+    """
+    按大小分卷写入压缩包
+    
+    各卷都是独立完整的压缩包（不是跨卷的分段ZIP），单独下载即可解压；
+    只有一卷时文件名为 output_path，多卷时为 名称.part1.zip、名称.part2.zip……
+    
+    写入过程中各卷为临时文件；每个成员的位置（add 的返回值）记入任务日志后，
+    中断的写入可用 restore 从最后记录的位置续写
+    """
+    
+    def __init__(self, output_path: Path, mode: str = "stored", volume_bytes: int = 0,
+                 zip64_limit: int = ZIP64_LIMIT, work_dir: Optional[Path] = None):
+        """
+        Args:
+            output_path: 输出文件路径（扩展名与格式一致，见 ARCHIVE_EXTENSIONS）
+            volume_bytes: 每卷大小上限，0 表示不分卷（单个成员超过上限时单独成卷）
+            work_dir: 临时文件目录（续跑时按卷序找回），默认与输出文件相同
+        """
+        self.output_path = Path(output_path)
+        self.mode = mode
+        self.volume_bytes = volume_bytes
+        self.zip64_limit = zip64_limit
+        self.work_dir = Path(work_dir) if work_dir else None
+        self.tmp_paths: List[Path] = []
+        self._file: Optional[BinaryIO] = None
+        self._volume = None
+        self._count = 0
+    
+    def add(self, member: ArchiveMember) -> Dict:
+        """
+        写入一个成员
+        
+        Returns:
+            成员位置 {"path", "volume", "offset", "end", "size", "csize", "crc", "method", "digest"}
+        """
+        if self._volume is not None and self.volume_bytes and self._count:
+            projected = self._volume.offset + member.payload_size + _MEMBER_OVERHEAD * (self._count + 1)
+            if projected > self.volume_bytes:
+                self._close_volume()
+        if self._volume is None:
+            self._open_volume()
+        
+        offset = self._volume.offset
+        self._volume.write(member)
+        self._count += 1
+        return {
+            "path": member.name,
+            "volume": len(self.tmp_paths) - 1,
+            "offset": offset,
+            "end": self._volume.offset,
+            "size": member.size,
+            "csize": member.payload_size,
+            "crc": member.crc,
+            "method": member.method,
+            "digest": member.digest,
+        }
+    
+    def flush(self) -> None:
+        """把已写入的数据交给操作系统（记入任务日志之前调用）"""
+        if self._file is not None:
+            self._file.flush()
+    
+    def verify(self, location: Dict) -> bool:
+        """已写入的成员数据是否完整（按 SHA-256 校验）"""
+        path = self._tmp_path(location["volume"])
+        try:
+            with open(path, "rb") as f:
+                f.seek(location["end"] - location["csize"])
+                data = f.read(location["csize"])
+        except OSError:
+            return False
+        return len(data) == location["csize"] and hashlib.sha256(data).hexdigest() == location["digest"]
+    
+    def restore(self, locations: List[Dict]) -> None:
+        """
+        从已校验的成员位置（按写入顺序）续写
+        
+        各卷截断到最后一个成员的结尾，中央目录按记录重新生成；之后的卷删除
+        """
+        volumes: Dict[int, List[Dict]] = {}
+        for location in locations:
+            volumes.setdefault(location["volume"], []).append(location)
+        
+        last = max(volumes) if volumes else -1
+        stale = last + 1
+        while self._tmp_path(stale).exists():
+            self._tmp_path(stale).unlink()
+            stale += 1
+        
+        for index in range(last + 1):
+            items = volumes.get(index, [])
+            self.tmp_paths.append(self._tmp_path(index))
+            self._file = open(self._tmp_path(index), "r+b")
+            self._volume = self._new_volume()
+            self._volume.restore(
+                [(l["path"], l["crc"], l["size"], l["csize"], l["method"], l["offset"]) for l in items],
+                items[-1]["end"] if items else 0
+            )
+            self._count = len(items)
+            if index < last:
+                self._close_volume()
+    
+    def close(self) -> List[Path]:
+        """完成写入并把临时文件改为最终文件名"""
+        if self._volume is None:
+            self._open_volume()  # 没有成员时也生成一个空压缩包
+        self._close_volume()
+        
+        paths = self.volume_paths(len(self.tmp_paths))
+        for tmp_path, path in zip(self.tmp_paths, paths):
+            tmp_path.replace(path)
+        return paths
+    
+    def abort(self, keep: bool = False) -> None:
+        """
+        中止写入并删除临时文件
+        
+        Args:
+            keep: 保留临时文件（已写入的成员记在任务日志中，之后用 restore 续写）
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if keep:
+            return
+        for tmp_path in self.tmp_paths:
+            tmp_path.unlink(missing_ok=True)
+    
+    def volume_paths(self, count: int) -> List[Path]:
+        if count == 1:
+            return [self.output_path]
+        ext = ARCHIVE_EXTENSIONS[self.mode]
+        name = self.output_path.name
+        stem = name[:-len(ext)] if name.endswith(ext) else self.output_path.stem
+        return [self.output_path.with_name(f"{stem}.part{i}{ext}") for i in range(1, count + 1)]
+    
+    def _tmp_path(self, index: int) -> Path:
+        if self.work_dir:
+            return self.work_dir / f"volume_{index + 1}.tmp"
+        return self.output_path.with_name(f".{self.output_path.name}.{index + 1}.tmp")
+    
+    def _new_volume(self):
+        return TarVolume(self._file) if self.mode == "tar" else ZipVolume(self._file, self.zip64_limit)
+    
+    def _open_volume(self) -> None:
+        tmp_path = self._tmp_path(len(self.tmp_paths))
+        self.tmp_paths.append(tmp_path)
+        self._file = open(tmp_path, "wb")
+        self._volume = self._new_volume()
+        self._count = 0
+    
+    def _close_volume(self) -> None:
+        self._volume.close()
+        self._file.close()
+        self._file = None
+        self._volume = None
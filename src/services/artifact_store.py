@@ -0,0 +1,209 @@
+"""
+预编译模板持久化
+模板保存时把预编译结果写入磁盘，进程重启或新进程通过 mmap 毫秒级加载
+
+文件格式（小端）：
+    头部    magic(4) | 版本(u16) | 保留(u16) | 键摘要(32) | 索引偏移(u64) | 索引长度(u32)
+    数据区  所有静态片段依次排列
+    索引    紧凑JSON：{"key", "slots", "members": [[成员名, "s", [偏移, 长度]] 或 [成员名, "g", [片段...]]]}
+            "s" 为静态成员，"g" 为片段列表；片段为 [偏移, 长度]（静态字节）、整数（槽位编号）
+            或 {"r": 循环行名称, "g": [片段...]}（循环区段）
+            含图片变量时另有 "images": {图片槽位编号: [宽度EMU, 关系槽位编号]}
+
+文件名包含键摘要，模板文件或映射变化后键不同，自动失效并在需要时重新生成
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from ..config import ARTIFACTS_DIR
+from .compiled_template import CompiledTemplate, RepeatSection, Segment
+
+
+ARTIFACT_MAGIC = b"TPLC"
+ARTIFACT_VERSION = 2
+HEADER_FORMAT = "<4sHH32sQI"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+
+def make_compiled_key(template_id: str, content_hash: str, mapping_info: Dict) -> str:
+    """预编译结果的键：模板ID + 模板文件哈希 + 映射哈希"""
+    mapping = json.dumps(mapping_info, ensure_ascii=False, sort_keys=True)
+    mapping_hash = hashlib.sha256(mapping.encode("utf-8")).hexdigest()[:16]
+    return f"{template_id}:{content_hash[:16]}:{mapping_hash}"
+
+
+class ArtifactStore:
+    """预编译模板磁盘存储"""
+    
+    def __init__(self, artifacts_dir: Path = ARTIFACTS_DIR):
+        self.artifacts_dir = artifacts_dir
+    
+    def save(self, template_id: str, compiled: CompiledTemplate) -> Path:
+        """写入预编译文件"""
+        return self.write(template_id, compiled.key, compiled.members, compiled.slots, compiled.images)
+    
+    def write(
+        self,
+        template_id: str,
+        key: str,
+        members: Iterable[Tuple[str, Union[bytes, memoryview, Iterable[Segment]]]],
+        slots: List[Tuple[str, str]],
+        images: Optional[Dict[int, Tuple[int, int]]] = None
+    ) -> Path:
+        """
+        逐个成员写入预编译文件（先写临时文件再原子替换），并清理该模板的旧版本
+        
+        片段列表可以是生成器（流式编译），连续的静态片段在数据区中合并为一段；
+        slots 在成员全部写完后才写入索引，可由生成器边编译边填充
+        """
+        digest = self._digest(key)
+        path = self._path(template_id, digest)
+        tmp_path = path.with_suffix(".tmp")
+        
+        with open(tmp_path, "wb") as f:
+            f.write(b"\0" * HEADER_SIZE)
+            offset = HEADER_SIZE
+            
+            def write_blob(data) -> List[int]:
+                nonlocal offset
+                f.write(data)
+                span = [offset, len(data)]
+                offset += len(data)
+                return span
+            
+            def write_segments(segments) -> list:
+                spans = []
+                for seg in segments:
+                    if isinstance(seg, int):
+                        spans.append(seg)
+                    elif isinstance(seg, RepeatSection):
+                        spans.append({"r": seg.name, "g": write_segments(seg.segments)})
+                    elif spans and isinstance(spans[-1], list):
+                        spans[-1][1] += write_blob(seg)[1]
+                    else:
+                        spans.append(write_blob(seg))
+                return spans
+            
+            index_members = []
+            for name, content in members:
+                if isinstance(content, (bytes, memoryview)):
+                    index_members.append([name, "s", write_blob(content)])
+                    continue
+                
+                index_members.append([name, "g", write_segments(content)])
+            
+            index = {"key": key, "slots": slots, "members": index_members}
+            if images:
+                index["images"] = {str(slot_id): list(image) for slot_id, image in images.items()}
+            index = json.dumps(
+                index,
+                ensure_ascii=False,
+                separators=(",", ":")
+            ).encode("utf-8")
+            f.write(index)
+            
+            f.seek(0)
+            f.write(struct.pack(
+                HEADER_FORMAT, ARTIFACT_MAGIC, ARTIFACT_VERSION, 0, digest, offset, len(index)
+            ))
+        
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            # 同名文件正被映射（Windows下无法替换），内容相同，保留现有文件
+            tmp_path.unlink(missing_ok=True)
+        
+        self._remove_stale(template_id, keep=path)
+        return path
+    
+    def load(self, template_id: str, key: str) -> Optional[CompiledTemplate]:
+        """通过 mmap 加载预编译文件，不存在、版本不符或已失效时返回None"""
+        digest = self._digest(key)
+        path = self._path(template_id, digest)
+        if not path.exists():
+            return None
+        
+        try:
+            with open(path, "rb") as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        
+        # 文件可能被截断或损坏（共享目录上尤其如此）：解析失败时按失效处理，由调用方重新编译
+        try:
+            magic, version, _, file_digest, index_offset, index_len = struct.unpack_from(
+                HEADER_FORMAT, buffer, 0
+            )
+            if magic != ARTIFACT_MAGIC or version != ARTIFACT_VERSION or file_digest != digest:
+                buffer.close()
+                return None
+            
+            index = json.loads(buffer[index_offset:index_offset + index_len].decode("utf-8"))
+            if index["key"] != key:
+                buffer.close()
+                return None
+        except (struct.error, ValueError, KeyError, TypeError):
+            buffer.close()
+            return None
+        
+        view = memoryview(buffer)
+        
+        def load_segments(spans) -> list:
+            segments = []
+            for seg in spans:
+                if isinstance(seg, int):
+                    segments.append(seg)
+                elif isinstance(seg, dict):
+                    segments.append(RepeatSection(seg["r"], load_segments(seg["g"])))
+                else:
+                    segments.append(view[seg[0]:seg[0] + seg[1]])
+            return segments
+        
+        try:
+            members = []
+            for name, kind, content in index["members"]:
+                if kind == "s":
+                    start, length = content
+                    members.append((name, view[start:start + length]))
+                else:
+                    members.append((name, load_segments(content)))
+            slots = [tuple(slot) for slot in index["slots"]]
+            images = {int(slot_id): tuple(image) for slot_id, image in index.get("images", {}).items()}
+        except (KeyError, TypeError, ValueError, IndexError):
+            members = None
+            view.release()
+            try:
+                buffer.close()
+            except BufferError:
+                pass  # 已切出的片段仍引用映射，随垃圾回收释放
+            return None
+        
+        return CompiledTemplate(members=members, slots=slots, key=key, images=images)
+    
+    def remove(self, template_id: str) -> None:
+        """删除模板的所有预编译文件"""
+        self._remove_stale(template_id, keep=None)
+    
+    def _remove_stale(self, template_id: str, keep: Optional[Path]) -> None:
+        """删除旧版本（正被映射的文件删除失败时忽略，下次再清理）"""
+        for path in self.artifacts_dir.glob(f"{template_id}.*.tplc"):
+            if path != keep:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+    
+    def _path(self, template_id: str, digest: bytes) -> Path:
+        return self.artifacts_dir / f"{template_id}.{digest.hex()[:16]}.tplc"
+    
+    def _digest(self, key: str) -> bytes:
+        return hashlib.sha256(key.encode("utf-8")).digest()
+
+
+# 单例
+artifact_store = ArtifactStore()
@@ -0,0 +1,56 @@
+"""
+内容寻址的模板文件存储
+文件按SHA-256存放，相同内容只保存一份，多个模板（版本）共享
+"""
+import hashlib
+import os
+from pathlib import Path
+from typing import Optional
+
+from ..config import BLOBS_DIR
+
+
+def content_hash_of(data: bytes) -> str:
+    """计算内容哈希"""
+    return hashlib.sha256(data).hexdigest()
+
+
+class FileBlobStore:
+    """文件系统blob存储：blobs/{哈希前2位}/{哈希}.docx"""
+    
+    def __init__(self, blobs_dir: Path = BLOBS_DIR):
+        self.blobs_dir = blobs_dir
+    
+    def put(self, data: bytes, content_hash: Optional[str] = None) -> str:
+        """写入内容（已存在则跳过），返回哈希"""
+        content_hash = content_hash or content_hash_of(data)
+        path = self.path(content_hash)
+        if path.exists():
+            return content_hash
+        
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return content_hash
+    
+    def get(self, content_hash: str) -> Optional[bytes]:
+        """读取内容"""
+        path = self.path(content_hash)
+        if not path.exists():
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+    
+    def exists(self, content_hash: str) -> bool:
+        return self.path(content_hash).exists()
+    
+    def delete(self, content_hash: str) -> None:
+        """删除内容（调用方负责确认已无引用）"""
+        path = self.path(content_hash)
+        if path.exists():
+            path.unlink()
+    
+    def path(self, content_hash: str) -> Path:
+        return self.blobs_dir / content_hash[:2] / f"{content_hash}.docx"
@@ -0,0 +1,119 @@
+"""
+模板组合服务
+多个模板共用一份列映射，每行数据一次生成全部文档（如劳动合同 + 保密协议 + 入职登记表）
+"""
+import json
+import os
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from ..config import BUNDLES_DIR
+from ..models.schemas import BundleConfig, TemplateConfig, split_repeat_variables
+from .template_service import template_service
+
+
+class BundleService:
+    """模板组合服务（每个组合一个JSON配置）"""
+    
+    def __init__(self, bundles_dir: Path = BUNDLES_DIR, templates=None):
+        self.bundles_dir = bundles_dir
+        self.templates = templates or template_service
+    
+    def create_bundle(self, bundle_name: str, template_ids: List[str], description: str = "") -> BundleConfig:
+        """
+        创建模板组合
+        
+        Raises:
+            ValueError: 少于两个模板
+        """
+        template_ids = list(dict.fromkeys(template_ids))
+        if len(template_ids) < 2:
+            raise ValueError("模板组合至少需要两个模板")
+        
+        bundle = BundleConfig(
+            bundle_id=str(uuid.uuid4())[:8],
+            bundle_name=bundle_name,
+            template_ids=template_ids,
+            description=description
+        )
+        self.save_bundle(bundle)
+        return bundle
+    
+    def save_bundle(self, bundle: BundleConfig) -> None:
+        """保存组合配置（先写临时文件再原子替换）"""
+        bundle.updated_at = datetime.now().isoformat()
+        path = self.bundles_dir / f"{bundle.bundle_id}.json"
+        tmp_path = self.bundles_dir / f".{bundle.bundle_id}.json.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(bundle.to_dict(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+    
+    def load_bundle(self, bundle_id: str) -> Optional[BundleConfig]:
+        path = self.bundles_dir / f"{bundle_id}.json"
+        if not path.exists():
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return BundleConfig.from_dict(json.load(f))
+    
+    def list_bundles(self) -> List[BundleConfig]:
+        """列出所有组合（按更新时间倒序）"""
+        bundles = []
+        for path in self.bundles_dir.glob("*.json"):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    bundles.append(BundleConfig.from_dict(json.load(f)))
+            except Exception as e:
+                print(f"Error loading bundle {path}: {e}")
+        return sorted(bundles, key=lambda b: b.updated_at, reverse=True)
+    
+    def delete_bundle(self, bundle_id: str) -> bool:
+        """删除组合（不删除其中的模板）"""
+        path = self.bundles_dir / f"{bundle_id}.json"
+        if not path.exists():
+            return False
+        path.unlink()
+        return True
+    
+    def get_templates(self, bundle: BundleConfig) -> List[TemplateConfig]:
+        """组合中仍然存在的模板（按组合顺序）"""
+        templates = []
+        for template_id in bundle.template_ids:
+            config = self.templates.load_config(template_id)
+            if config:
+                templates.append(config)
+        return templates
+    
+    def merge_variables(self, templates: List[TemplateConfig]) -> Dict:
+        """
+        合并组合中各模板的变量
+        
+        同名变量共用一列；位于循环行中的变量由明细表提供，不计入主表变量
+        
+        Returns:
+            {"variables": 主表变量, "repeats": 循环行（同名只保留一个）, "details": {循环行名称: 变量}}
+        """
+        variables: Dict[str, None] = {}
+        repeats: Dict[str, Dict] = {}
+        details: Dict[str, Dict[str, None]] = {}
+        
+        for config in templates:
+            mapping_info = config.get_mapping()
+            template_repeats = mapping_info.get("repeats", [])
+            groups = split_repeat_variables(mapping_info["data"], template_repeats)
+            variables.update(dict.fromkeys(groups.pop("")))
+            for repeat_row in template_repeats:
+                repeats.setdefault(repeat_row["name"], repeat_row)
+            for name, names in groups.items():
+                details.setdefault(name, {}).update(dict.fromkeys(names))
+        
+        return {
+            "variables": list(variables),
+            "repeats": list(repeats.values()),
+            "details": {name: list(names) for name, names in details.items()},
+        }
+
+
+# 单例
+bundle_service = BundleService()
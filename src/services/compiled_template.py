@@ -0,0 +1,303 @@
+"""
+预编译模板
+把模板拆分为静态XML片段和变量槽位，逐行生成时只需拼接字节，无需重新解析文档
+"""
+import re
+import zipfile
+from dataclasses import dataclass, field
+from io import BytesIO
+from typing import BinaryIO, Dict, Iterator, List, Sequence, Tuple, Union
+from xml.sax.saxutils import escape
+
+from ..config import DETAIL_DATA_KEY
+
+
+# 槽位标记：使用Unicode私有区字符，正文中不会出现
+# 格式：SLOT_OPEN + 编号（私有区数字）+ SLOT_CLOSE
+SLOT_OPEN = "\ue000"
+SLOT_CLOSE = "\ue001"
+_SLOT_DIGIT_BASE = 0xE010
+SLOT_RE = re.compile("\ue000([\ue010-\ue019]+)\ue001")
+
+# 循环区段标记：编译时以XML注释包围循环行（注释内容如下），拆分后成为嵌套区段
+REPEAT_OPEN = "tplv-repeat:{}"
+REPEAT_CLOSE = "tplv-end:{}"
+REPEAT_MARK = b"<!--tplv-repeat:"
+REPEAT_RE = re.compile(r"<!--tplv-repeat:(\d+)-->(.*?)<!--tplv-end:\1-->", re.S)
+
+# 图片：关系类型、部件内的关系ID与 docPr 编号（按槽位编号生成，不与文档原有编号冲突）
+IMAGE_REL_TYPE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/image"
+IMAGE_REL_ID = "rIdTplvImg{}"
+IMAGE_DOC_PR_BASE = 90000
+_EMU_PER_CM = 360000
+
+_DRAWING = (
+    '</w:t><w:drawing><wp:inline distT="0" distB="0" distL="0" distR="0" '
+    'xmlns:wp="http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing">'
+    '<wp:extent cx="{cx}" cy="{cy}"/><wp:docPr id="{doc_pr}" name="Picture {doc_pr}"/>'
+    '<wp:cNvGraphicFramePr><a:graphicFrameLocks '
+    'xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" noChangeAspect="1"/>'
+    '</wp:cNvGraphicFramePr>'
+    '<a:graphic xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main">'
+    '<a:graphicData uri="http://schemas.openxmlformats.org/drawingml/2006/picture">'
+    '<pic:pic xmlns:pic="http://schemas.openxmlformats.org/drawingml/2006/picture">'
+    '<pic:nvPicPr><pic:cNvPr id="0" name="{name}"/><pic:cNvPicPr/></pic:nvPicPr>'
+    '<pic:blipFill><a:blip r:embed="{rel_id}" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"/>'
+    '<a:stretch><a:fillRect/></a:stretch></pic:blipFill>'
+    '<pic:spPr><a:xfrm><a:off x="0" y="0"/><a:ext cx="{cx}" cy="{cy}"/></a:xfrm>'
+    '<a:prstGeom prst="rect"><a:avLst/></a:prstGeom></pic:spPr>'
+    '</pic:pic></a:graphicData></a:graphic></wp:inline></w:drawing><w:t xml:space="preserve">'
+)
+_IMAGE_REL = '<Relationship Id="{rel_id}" Type="' + IMAGE_REL_TYPE + '" Target="{target}"/>'
+
+# XML 1.0 不允许的控制字符
+_INVALID_XML_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+_LINE_BREAK = '</w:t><w:br/><w:t xml:space="preserve">'
+_TAB = '</w:t><w:tab/><w:t xml:space="preserve">'
+
+# 片段：静态字节（bytes 或 mmap 上的 memoryview）、槽位编号 或 循环区段
+Segment = Union[bytes, memoryview, int, "RepeatSection"]
+
+
+@dataclass
+class RepeatSection:
+    """
+    循环区段（如明细表的一行）
+    
+    按行数据中该区段的明细记录逐条重复输出；区段内的槽位优先取明细记录的值
+    """
+    name: str
+    segments: List[Segment]
+    
+    @property
+    def slot_ids(self) -> List[int]:
+        return [seg for seg in self.segments if isinstance(seg, int)]
+
+
+def segments_size(segments: List[Segment]) -> int:
+    """片段列表中静态字节的总大小"""
+    return sum(
+        segments_size(seg.segments) if isinstance(seg, RepeatSection) else len(seg)
+        for seg in segments
+        if not isinstance(seg, int)
+    )
+
+
+def make_slot_marker(index: int) -> str:
+    """生成槽位标记文本"""
+    digits = "".join(chr(_SLOT_DIGIT_BASE + int(d)) for d in str(index))
+    return f"{SLOT_OPEN}{digits}{SLOT_CLOSE}"
+
+
+def split_segments(xml_text: str, repeat_names: Sequence[str] = ()) -> List[Segment]:
+    """按循环区段标记和槽位标记拆分XML文本为片段列表"""
+    if not repeat_names:
+        return _split_slots(xml_text)
+    
+    segments: List[Segment] = []
+    pos = 0
+    for m in REPEAT_RE.finditer(xml_text):
+        segments.extend(_split_slots(xml_text[pos:m.start()]))
+        segments.append(RepeatSection(repeat_names[int(m.group(1))], _split_slots(m.group(2))))
+        pos = m.end()
+    segments.extend(_split_slots(xml_text[pos:]))
+    return segments
+
+
+def find_slot_ids(xml_text: str) -> List[int]:
+    """XML文本中出现的槽位编号"""
+    return [_slot_index(m) for m in SLOT_RE.finditer(xml_text)]
+
+
+def _slot_index(m) -> int:
+    return int("".join(str(ord(c) - _SLOT_DIGIT_BASE) for c in m.group(1)))
+
+
+def _split_slots(xml_text: str) -> List[Segment]:
+    segments: List[Segment] = []
+    pos = 0
+    for m in SLOT_RE.finditer(xml_text):
+        segments.append(xml_text[pos:m.start()].encode("utf-8"))
+        segments.append(_slot_index(m))
+        pos = m.end()
+    segments.append(xml_text[pos:].encode("utf-8"))
+    return segments
+
+
+@dataclass
+class ImageData:
+    """
+    已读取并解析的图片（同一内容在一批生成中只有一份）
+    
+    media_name: 文档内的媒体部件名，按内容哈希命名，同一文档中多处使用时只写入一次
+    """
+    digest: str
+    ext: str
+    content_type: str
+    blob: bytes
+    px_width: int
+    px_height: int
+    
+    @property
+    def media_name(self) -> str:
+        return f"media/tplv_{self.digest[:16]}.{self.ext}"
+
+
+def cm_to_emu(cm: float) -> int:
+    return int(cm * _EMU_PER_CM)
+
+
+def render_image_value(image: ImageData, slot_id: int, width: int) -> bytes:
+    """图片槽位的XML：结束当前 <w:t>，插入内嵌图片（按宽度等比缩放），再开始新的 <w:t>"""
+    height = int(width * image.px_height / image.px_width) if image.px_width else width
+    doc_pr = IMAGE_DOC_PR_BASE + slot_id
+    return _DRAWING.format(
+        cx=width, cy=height, doc_pr=doc_pr, name=image.media_name.rsplit("/", 1)[-1],
+        rel_id=IMAGE_REL_ID.format(slot_id)
+    ).encode("utf-8")
+
+
+def render_image_rel(image: ImageData, slot_id: int) -> bytes:
+    """图片槽位所在部件的关系（写入该部件的 .rels）"""
+    return _IMAGE_REL.format(rel_id=IMAGE_REL_ID.format(slot_id), target=image.media_name).encode("utf-8")
+
+
+def render_text_value(value: str) -> bytes:
+    """
+    把变量值转换为可直接放入 <w:t> 的XML
+    
+    与 python-docx 设置 run.text 的行为一致：换行转为 <w:br/>，制表符转为 <w:tab/>
+    """
+    text = _INVALID_XML_CHARS.sub("", str(value))
+    text = escape(text).replace("\r\n", "\n").replace("\r", "\n")
+    text = text.replace("\n", _LINE_BREAK).replace("\t", _TAB)
+    return text.encode("utf-8")
+
+
+@dataclass
+class CompiledTemplate:
+    """
+    预编译模板
+    
+    members: 按原顺序排列的压缩包成员，值为原始字节（静态）或片段列表（含槽位）
+    slots: 槽位编号 → (变量名, 原文本)，变量未提供值时保留原文本
+    images: 图片槽位编号 → (宽度EMU, 关系槽位编号)；关系槽位位于图片所在部件的 .rels 中，
+            行数据中该变量的值为 ImageData 时插入图片，否则两个槽位均为空
+    """
+    members: List[Tuple[str, Union[bytes, memoryview, List[Segment]]]]
+    slots: List[Tuple[str, str]]
+    key: str = ""
+    images: Dict[int, Tuple[int, int]] = field(default_factory=dict)
+    size: int = field(init=False)
+    
+    def __post_init__(self):
+        self.size = sum(
+            segments_size(content) if isinstance(content, list) else len(content)
+            for _, content in self.members
+        )
+    
+    @property
+    def variables(self) -> List[str]:
+        """模板中出现的变量名（去重，保持顺序）"""
+        return list(dict.fromkeys(var_name for var_name, _ in self.slots))
+    
+    @property
+    def image_variables(self) -> List[str]:
+        """图片变量名（去重，保持顺序）"""
+        return list(dict.fromkeys(self.slots[slot_id][0] for slot_id in self.images))
+    
+    def render_values(self, values: Dict[str, str]) -> List[bytes]:
+        """计算每个槽位的XML文本"""
+        cache: Dict[Tuple[str, str], bytes] = {}
+        rendered = []
+        for var_name, original_text in self.slots:
+            value = values.get(var_name)
+            if value is None:
+                value = original_text
+            elif isinstance(value, ImageData):
+                rendered.append(b"")  # 下面按图片槽位填充
+                continue
+            key = (var_name, value)
+            if key not in cache:
+                cache[key] = render_text_value(value)
+            rendered.append(cache[key])
+        
+        for slot_id, (width, rel_slot) in self.images.items():
+            image = values.get(self.slots[slot_id][0])
+            if isinstance(image, ImageData):
+                rendered[slot_id] = render_image_value(image, slot_id, width)
+                rendered[rel_slot] = render_image_rel(image, slot_id)
+            else:
+                rendered[slot_id] = rendered[rel_slot] = b""
+        return rendered
+    
+    def row_media(self, values: Dict) -> Dict[str, bytes]:
+        """本行用到的图片媒体部件 {压缩包成员名: 图片字节}，同一图片只写入一次"""
+        media = {}
+        for slot_id in self.images:
+            image = values.get(self.slots[slot_id][0])
+            if isinstance(image, ImageData):
+                media[f"word/{image.media_name}"] = image.blob
+        return media
+    
+    def render(self, values: Dict[str, str]) -> bytes:
+        """用一行数据生成docx"""
+        output = BytesIO()
+        self.render_to(output, values)
+        return output.getvalue()
+    
+    def render_to(self, fileobj: BinaryIO, values: Dict[str, str]) -> None:
+        """
+        用一行数据生成docx并直接写入文件对象
+        
+        片段逐个写入压缩流，不拼接完整的XML，大模板的内存占用与模板大小无关
+        """
+        rendered = self.render_values(values)
+        with zipfile.ZipFile(fileobj, "w", zipfile.ZIP_DEFLATED) as zf:
+            for name, content in self.members:
+                if isinstance(content, list):
+                    with zf.open(name, "w") as dest:
+                        self._write_segments(dest, content, rendered, values)
+                else:
+                    zf.writestr(name, content)
+            
+            # 图片本身已压缩，不再压缩
+            if self.images:
+                for name, blob in self.row_media(values).items():
+                    zf.writestr(name, blob, compress_type=zipfile.ZIP_STORED)
+    
+    def _write_segments(self, dest: BinaryIO, segments: List[Segment], rendered: List[bytes], values: Dict) -> None:
+        for seg in segments:
+            if isinstance(seg, int):
+                dest.write(rendered[seg])
+            elif isinstance(seg, RepeatSection):
+                for record_rendered in self._render_records(seg, rendered, values):
+                    self._write_segments(dest, seg.segments, record_rendered, values)
+            else:
+                dest.write(seg)
+    
+    def _render_records(self, section: RepeatSection, rendered: List[bytes], values: Dict) -> Iterator[List[bytes]]:
+        """
+        逐条明细记录计算区段内槽位的值
+        
+        行数据中没有该区段的明细时按普通行输出一次；明细为空列表时不输出
+        """
+        details = values.get(DETAIL_DATA_KEY) or {}
+        if section.name not in details:
+            yield rendered
+            return
+        
+        cache: Dict[Tuple[str, str], bytes] = {}
+        for record in details[section.name]:
+            record_rendered = list(rendered)
+            for slot_id in section.slot_ids:
+                var_name = self.slots[slot_id][0]
+                value = record.get(var_name)
+                if value is None:
+                    continue
+                key = (var_name, value)
+                if key not in cache:
+                    cache[key] = render_text_value(value)
+                record_rendered[slot_id] = cache[key]
+            yield record_rendered
@@ -3,28 +3,110 @@ Excel处理服务
 负责读取Excel数据、验证、格式化
 """
 import pandas as pd
+from io import BytesIO
 from pathlib import Path
-from typing import List, Dict, Optional, Tuple
-from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+from datetime import date, datetime
 import tempfile
 
+from openpyxl import load_workbook
+
+from ..config import DETAIL_DATA_KEY
+
+
+# pandas推断类型 → 显示名称
+COLUMN_TYPE_LABELS = {
+    "string": "文本",
+    "integer": "整数",
+    "floating": "小数",
+    "mixed-integer-float": "小数",
+    "decimal": "小数",
+    "boolean": "布尔",
+    "datetime64": "日期",
+    "datetime": "日期",
+    "date": "日期",
+    "time": "时间",
+    "timedelta64": "时长",
+    "timedelta": "时长",
+}
+
 
 class ExcelService:
     """Excel处理服务"""
     
-    def read_excel(self, file_bytes: bytes, filename: str) -> Tuple[Optional[pd.DataFrame], Optional[str]]:
+    def read_excel(
+        self,
+        file_bytes: bytes,
+        filename: str,
+        sheet_name: Union[int, str] = 0
+    ) -> Tuple[Optional[pd.DataFrame], Optional[str]]:
         """
         读取Excel文件
         
+        Args:
+            sheet_name: 工作表名称或序号，默认第一个
+        
         Returns:
             (DataFrame, 错误信息)
         """
         try:
-            df = pd.read_excel(file_bytes)
+            df = pd.read_excel(BytesIO(file_bytes), sheet_name=sheet_name)
             return df, None
         except Exception as e:
             return None, str(e)
     
+    def iter_records(
+        self,
+        source: Union[str, Path],
+        sheet_name: Union[int, str] = 0
+    ) -> Iterator[Dict[str, str]]:
+        """
+        逐行读取Excel（.xlsx 只读流式解析，不加载整个工作表）
+        
+        首行为列名，取值规则同 format_row_data；整行为空的行跳过。
+        .xls 等其他格式仍整表读取后逐行输出
+        """
+        if Path(source).suffix.lower() not in (".xlsx", ".xlsm"):
+            df = pd.read_excel(source, sheet_name=sheet_name)
+            for _, row in df.iterrows():
+                yield self.format_row_data(row)
+            return
+        
+        workbook = load_workbook(source, read_only=True, data_only=True)
+        try:
+            sheet = workbook.worksheets[sheet_name] if isinstance(sheet_name, int) else workbook[sheet_name]
+            rows = sheet.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                return
+            columns = [
+                str(name) if name is not None else f"Unnamed: {i}"
+                for i, name in enumerate(header)
+            ]
+            for values in rows:
+                if all(v is None for v in values):
+                    continue
+                yield {
+                    col: self._format_value(value)
+                    for col, value in zip(columns, values)
+                }
+        finally:
+            workbook.close()
+    
+    def _format_value(self, value) -> str:
+        if value is None:
+            return ""
+        if isinstance(value, (datetime, date)):
+            return value.strftime("%Y-%m-%d")
+        return str(value)
+    
+    def list_sheets(self, file_bytes: bytes) -> List[str]:
+        """列出Excel中的工作表名称"""
+        try:
+            return pd.ExcelFile(BytesIO(file_bytes)).sheet_names
+        except Exception:
+            return []
+    
     def get_columns(self, df: pd.DataFrame) -> List[str]:
         """获取列名列表"""
         return df.columns.tolist()
@@ -46,6 +128,13 @@ class ExcelService:
         missing = required_set - existing_columns
         return len(missing) == 0, list(missing)
     
+    def match_column(self, var_name: str, columns: List[str]) -> Optional[str]:
+        """自动匹配变量对应的列：同名，或一方包含另一方（取第一个）"""
+        for col in columns:
+            if col == var_name or var_name in col or col in var_name:
+                return col
+        return None
+    
     def format_row_data(self, row: pd.Series) -> Dict[str, str]:
         """
         格式化单行数据，处理特殊类型
@@ -67,9 +156,129 @@ class ExcelService:
         """将DataFrame转换为字典列表"""
         return [self.format_row_data(row) for _, row in df.iterrows()]
     
+    def format_columns(self, df: pd.DataFrame, column_mapping: Dict[str, str]) -> pd.DataFrame:
+        """
+        按列映射整列格式化为文本（规则同 format_row_data：空值为空串，日期为 YYYY-MM-DD）
+        
+        Returns:
+            以变量名为列名的DataFrame，只包含存在的列
+        """
+        formatted = {}
+        for var_name, col_name in column_mapping.items():
+            if col_name not in df.columns:
+                continue
+            series = df[col_name]
+            if pd.api.types.is_datetime64_any_dtype(series):
+                text = series.dt.strftime("%Y-%m-%d")
+            else:
+                text = series.map(
+                    lambda v: v.strftime("%Y-%m-%d") if isinstance(v, (pd.Timestamp, datetime)) else str(v)
+                )
+            formatted[var_name] = text.where(series.notna(), "")
+        return pd.DataFrame(formatted, index=df.index)
+    
+    def format_keys(self, df: pd.DataFrame, key_column: str) -> pd.Series:
+        """
+        格式化关联列
+        
+        含空值的整数列会被读成小数（1 → 1.0），去掉末尾的 .0 使主表和明细表的关联值一致
+        """
+        keys = self.format_columns(df, {"key": key_column})["key"]
+        return keys.str.replace(r"\.0$", "", regex=True)
+    
+    def group_details(
+        self,
+        detail_df: pd.DataFrame,
+        key_column: str,
+        column_mapping: Dict[str, str]
+    ) -> Dict[str, List[Dict[str, str]]]:
+        """
+        把明细表按关联列分组
+        
+        整表只格式化一次、分组一次（groupby.indices），不为每条主记录重新筛选明细表
+        
+        Returns:
+            {关联值: [明细记录, ...]}，空关联值的明细忽略
+        """
+        records = self.format_columns(detail_df, column_mapping).to_dict("records")
+        keys = self.format_keys(detail_df, key_column)
+        groups = keys.groupby(keys, sort=False).indices
+        return {
+            key: [records[i] for i in positions]
+            for key, positions in groups.items()
+            if key != ""
+        }
+    
+    def attach_details(
+        self,
+        rows: List[Dict],
+        master_keys: List[str],
+        repeat_name: str,
+        groups: Dict[str, List[Dict[str, str]]]
+    ) -> None:
+        """为每条主记录挂上对应的明细记录（没有明细的记录为空列表）"""
+        for row, key in zip(rows, master_keys):
+            row.setdefault(DETAIL_DATA_KEY, {})[repeat_name] = groups.get(key, [])
+    
     def preview_data(self, df: pd.DataFrame, rows: int = 5) -> pd.DataFrame:
         """预览前N行数据"""
         return df.head(rows)
+    
+    def get_page(self, df: pd.DataFrame, page: int, page_size: int) -> pd.DataFrame:
+        """
+        获取指定页的数据（页码从1开始）
+        
+        只切片当前页，避免把整个DataFrame序列化到浏览器
+        """
+        total_pages = self.count_pages(df, page_size)
+        page = min(max(page, 1), total_pages)
+        start = (page - 1) * page_size
+        return df.iloc[start:start + page_size]
+    
+    def count_pages(self, df: pd.DataFrame, page_size: int) -> int:
+        """计算总页数（至少1页）"""
+        return max(1, -(-len(df) // page_size))
+    
+    def sample_rows(self, df: pd.DataFrame, rows: int, seed: int = 0) -> pd.DataFrame:
+        """随机抽样N行数据（保持原顺序）"""
+        if len(df) <= rows:
+            return df
+        return df.sample(n=rows, random_state=seed).sort_index()
+    
+    def compute_column_stats(self, df: pd.DataFrame) -> List[Dict]:
+        """
+        计算每列统计信息：空值数、不同值数、最大字符长度、识别类型
+        
+        每列只做一次向量化计算，结果可缓存复用
+        
+        Returns:
+            [{"列名", "类型", "空值数", "不同值数", "最大长度"}, ...]
+        """
+        stats = []
+        for col in df.columns:
+            series = df[col]
+            non_null = series.dropna()
+            
+            if non_null.empty:
+                max_len = 0
+            else:
+                max_len = int(non_null.astype(str).str.len().max())
+            
+            stats.append({
+                "列名": str(col),
+                "类型": self._detect_type(non_null),
+                "空值数": int(len(series) - len(non_null)),
+                "不同值数": int(non_null.nunique()),
+                "最大长度": max_len,
+            })
+        return stats
+    
+    def _detect_type(self, series: pd.Series) -> str:
+        """识别列的数据类型"""
+        if series.empty:
+            return "空"
+        inferred = pd.api.types.infer_dtype(series, skipna=True)
+        return COLUMN_TYPE_LABELS.get(inferred, "混合")
 
 
 # 单例实例
@@ -0,0 +1,474 @@
+"""
+批量生成流水线
+读取 → 渲染 → 归档 三个阶段由有界队列相连：下游跟不上时上游阻塞等待（背压），
+内存占用只与队列深度有关，与数据行数无关；生成的文档直接写入磁盘上的压缩包。
+文档在渲染线程中按压缩包格式预先压缩，归档线程只追加字节。
+暂存的数据按任务内存预算记账，超出预算时渲染阶段等待或把文档先写入临时文件。
+指定任务日志时，每行写入压缩包后记入日志；中断后再次运行同一任务只重做未完成的行。
+渲染每行前向调度器申请工作槽位，多个任务按优先级和用户份额共享渲染能力
+"""
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from ..config import (
+    ARCHIVE_DEFAULT_MODE, ARCHIVE_DEFLATE_LEVEL, ARCHIVE_VOLUME_MB, PIPELINE_QUEUE_DEPTH, PIPELINE_RENDERERS
+)
+from ..utils import unique_path
+from .archive_writer import ArchiveMember, ArchiveWriter, prepare_member
+from .image_loader import ImageLoader
+from .job_journal import JobJournal
+from .job_scheduler import JobTicket, job_scheduler
+from .memory_budget import JobMemory, memory_budget
+
+
+# 队列结束标记
+_DONE = object()
+
+# 等待队列时检查取消的间隔（秒）
+_POLL_SECONDS = 0.1
+
+
+class PipelineCancelled(Exception):
+    """流水线因其他阶段出错而中止"""
+
+
+@dataclass
+class StageStats:
+    """
+    单个阶段的计数
+    
+    busy: 处理耗时（秒，多线程累加）
+    blocked: 等待下游队列腾出空间的时间（被背压）
+    starved: 等待上游数据的时间
+    """
+    name: str
+    workers: int = 1
+    items: int = 0
+    failed: int = 0
+    busy: float = 0.0
+    blocked: float = 0.0
+    starved: float = 0.0
+    
+    def utilization(self, elapsed: float) -> float:
+        """忙碌时间占比（按线程数平均），最高的阶段即瓶颈"""
+        if elapsed <= 0:
+            return 0.0
+        return self.busy / (self.workers * elapsed)
+    
+    def to_dict(self, elapsed: float) -> Dict:
+        return {
+            "items": self.items,
+            "failed": self.failed,
+            "per_second": self.items / elapsed if elapsed > 0 else 0.0,
+            "busy": round(self.busy, 3),
+            "blocked": round(self.blocked, 3),
+            "starved": round(self.starved, 3),
+            "utilization": round(self.utilization(elapsed), 3),
+        }
+
+
+@dataclass
+class PipelineResult:
+    """一次流水线运行的结果"""
+    output_paths: List[Path]  # 压缩包（分卷时按卷序排列）
+    rows: int                 # 本次读取并生成的行数（不含续跑跳过的行）
+    documents: int            # 压缩包中的文档数（含续跑前已写入的）
+    failed: int
+    elapsed: float
+    stages: Dict[str, Dict] = field(default_factory=dict)
+    bottleneck: str = ""
+    memory: Dict = field(default_factory=dict)  # JobMemory.summary()
+    resumed: int = 0          # 续跑时跳过的已完成行数
+    scheduling: Dict = field(default_factory=dict)  # JobTicket.summary()
+
+
+class GenerationPipeline:
+    """
+    批量生成流水线（一次运行一个实例）
+    
+    读取线程逐行取数据，多个渲染线程生成文档，单个归档线程写压缩包；
+    某行渲染失败只跳过该行，读取或归档出错时中止整个流水线
+    
+    同一行的文档作为一组归档并记入任务日志，续跑时以行为单位跳过
+    """
+    
+    def __init__(
+        self,
+        render: Callable[[Dict, int], List[Tuple[str, bytes]]],
+        renderers: int = PIPELINE_RENDERERS,
+        queue_depth: int = PIPELINE_QUEUE_DEPTH,
+        memory: Optional[JobMemory] = None,
+        archive_mode: str = ARCHIVE_DEFAULT_MODE,
+        deflate_level: int = ARCHIVE_DEFLATE_LEVEL,
+        volume_mb: float = ARCHIVE_VOLUME_MB,
+        journal: Optional[JobJournal] = None,
+        ticket: Optional[JobTicket] = None,
+        images: Optional[ImageLoader] = None
+    ):
+        """
+        Args:
+            render: 用一行数据（及行号）生成文件 → [(压缩包内路径, 文件内容)]
+            renderers: 渲染线程数
+            queue_depth: 每个队列的最大长度
+            memory: 任务内存记账，默认按配置的预算在全局预算中登记
+            archive_mode: 压缩包格式（见 ARCHIVE_MODES）
+            deflate_level: 压缩级别（deflate 和 tar.gz）
+            volume_mb: 分卷大小，0 表示不分卷
+            journal: 任务进度日志；有未完成的记录时校验已写入的内容并续跑，
+                     出错中止时保留未完成的压缩包；运行期间持有任务的排他锁
+            ticket: 任务在调度器中的登记，默认按批量任务登记
+            images: 模板有图片变量时的图片读取器（与 render 使用同一个）：读取阶段为即将渲染的行预读图片，
+                    预读深度即队列长度；图片缓存计入本任务的内存记账
+        """
+        self.render = render
+        self.archive_mode = archive_mode
+        self.deflate_level = deflate_level
+        self.volume_bytes = int(volume_mb * 1024 * 1024)
+        self.memory = memory or memory_budget.job()
+        self.journal = journal
+        self.ticket = ticket or job_scheduler.job("default")
+        self.images = images
+        self.renderers = max(1, renderers)
+        self.rows_queue: queue.Queue = queue.Queue(maxsize=queue_depth)
+        self.docs_queue: queue.Queue = queue.Queue(maxsize=queue_depth)
+        self.stats = {
+            "reader": StageStats("reader"),
+            "renderer": StageStats("renderer", workers=self.renderers),
+            "archiver": StageStats("archiver"),
+        }
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._error: Optional[BaseException] = None
+        self._started = 0.0
+        self._spill_dir: Optional[Path] = None
+        self._used_names: Dict[str, int] = {}
+        self._completed: Set[int] = set()
+        self._resumed_documents = 0
+    
+    def run(
+        self,
+        rows: Iterable[Dict],
+        output_path: Path,
+        on_progress: Optional[Callable[[Dict], None]] = None
+    ) -> PipelineResult:
+        """
+        运行流水线，生成的文档写入 output_path（先写临时文件，完成后替换；分卷时见 ArchiveWriter）
+        
+        Args:
+            on_progress: 运行期间在调用线程中定期回调，参数为 snapshot()
+        
+        Raises:
+            读取或归档阶段的异常（此时不产生输出文件）
+            JobLocked: 同一任务正在另一次运行中生成
+        """
+        output_path = Path(output_path)
+        work_dir = self.journal.job_dir if self.journal else None
+        writer = ArchiveWriter(output_path, self.archive_mode, self.volume_bytes, work_dir=work_dir)
+        self._spill_dir = output_path.parent
+        self._started = time.perf_counter()
+        if self.images:
+            self.images.bind(self.memory)
+        if self.journal:
+            try:
+                self.journal.acquire()
+                self._resume(writer)
+            except BaseException:
+                self.journal.close()
+                self.memory.close()
+                self.ticket.close()
+                raise
+        
+        threads = [threading.Thread(target=self._guard, args=(self._read, rows), daemon=True)]
+        threads += [
+            threading.Thread(target=self._guard, args=(self._render_loop,), daemon=True)
+            for _ in range(self.renderers)
+        ]
+        threads.append(threading.Thread(target=self._guard, args=(self._archive, writer), daemon=True))
+        for thread in threads:
+            thread.start()
+        
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(timeout=0.5)
+                    if on_progress:
+                        on_progress(self.snapshot())
+        finally:
+            self.memory.close()
+            self.ticket.close()
+        
+        if self._error is not None:
+            self._discard_queued()
+            writer.abort(keep=self.journal is not None)
+            if self.journal:
+                self.journal.close()
+            raise self._error
+        
+        output_paths = writer.close()
+        if self.journal:
+            self.journal.remove()
+        snapshot = self.snapshot()
+        return PipelineResult(
+            output_paths=output_paths,
+            rows=self.stats["reader"].items,
+            documents=self._resumed_documents + self.stats["archiver"].items,
+            failed=self.stats["renderer"].failed,
+            elapsed=snapshot["elapsed"],
+            stages=snapshot["stages"],
+            bottleneck=snapshot["bottleneck"],
+            memory=snapshot["memory"],
+            resumed=len(self._completed),
+            scheduling=snapshot["scheduling"]
+        )
+    
+    def _resume(self, writer: ArchiveWriter) -> None:
+        """
+        按写入顺序校验日志中已完成的行，从第一处不一致（数据缺失或哈希不符）起全部重做；
+        压缩包截断到最后一个校验通过的成员，日志只保留校验通过的记录
+        """
+        kept = []
+        for entry in self.journal.load():
+            if entry["status"] != "done":
+                continue
+            if not all(writer.verify(location) for location in entry["files"]):
+                break
+            kept.append(entry)
+        
+        locations = [location for entry in kept for location in entry["files"]]
+        writer.restore(locations)
+        self.journal.reset(kept)
+        for location in locations:
+            self._used_names.setdefault(location["path"], 2)
+        self._completed = {entry["row"] for entry in kept}
+        self._resumed_documents = len(locations)
+    
+    def cancel(self) -> None:
+        """从其他线程取消运行（run 抛出 PipelineCancelled，不产生输出文件）"""
+        with self._lock:
+            if self._error is None:
+                self._error = PipelineCancelled("已取消")
+        self._stop.set()
+    
+    def snapshot(self) -> Dict:
+        """
+        当前计数
+        
+        Returns:
+            {"elapsed", "stages": {阶段: 计数}, "bottleneck": 忙碌占比最高的阶段,
+             "queued": {"rows", "docs"}: 队列中等待的数量, "memory": 内存记账,
+             "scheduling": 等待工作槽位的统计}
+        """
+        elapsed = time.perf_counter() - self._started
+        with self._lock:
+            stages = {name: stage.to_dict(elapsed) for name, stage in self.stats.items()}
+        bottleneck = max(self.stats.values(), key=lambda s: s.utilization(elapsed)).name
+        return {
+            "elapsed": elapsed,
+            "stages": stages,
+            "bottleneck": bottleneck,
+            "queued": {"rows": self.rows_queue.qsize(), "docs": self.docs_queue.qsize()},
+            "memory": self.memory.summary(),
+            "scheduling": self.ticket.summary(),
+        }
+    
+    def _guard(self, target, *args) -> None:
+        """阶段出错时记录第一个异常并通知其他阶段中止"""
+        try:
+            target(*args)
+        except PipelineCancelled:
+            pass
+        except BaseException as e:
+            with self._lock:
+                if self._error is None:
+                    self._error = e
+            self._stop.set()
+    
+    def _put(self, q: queue.Queue, item, stage: StageStats) -> None:
+        start = time.perf_counter()
+        while True:
+            if self._stop.is_set():
+                raise PipelineCancelled()
+            try:
+                q.put(item, timeout=_POLL_SECONDS)
+                break
+            except queue.Full:
+                continue
+        self._add(stage, blocked=time.perf_counter() - start)
+    
+    def _get(self, q: queue.Queue, stage: StageStats):
+        start = time.perf_counter()
+        while True:
+            if self._stop.is_set():
+                raise PipelineCancelled()
+            try:
+                item = q.get(timeout=_POLL_SECONDS)
+                break
+            except queue.Empty:
+                continue
+        self._add(stage, starved=time.perf_counter() - start)
+        return item
+    
+    def _add(self, stage: StageStats, **amounts) -> None:
+        with self._lock:
+            for name, amount in amounts.items():
+                setattr(stage, name, getattr(stage, name) + amount)
+    
+    def _read(self, rows: Iterable[Dict]) -> None:
+        stage = self.stats["reader"]
+        iterator = iter(rows)
+        idx = 0
+        while True:
+            start = time.perf_counter()
+            row = next(iterator, _DONE)
+            self._add(stage, busy=time.perf_counter() - start)
+            if row is _DONE:
+                break
+            if idx in self._completed:
+                idx += 1
+                continue
+            size = row_size(row)
+            self.memory.track("reader", size)
+            if self.images:
+                # 排队期间并行读取该行的图片，渲染时不再等待磁盘
+                self.images.prefetch_row(row)
+            self._put(self.rows_queue, (idx, row, size), stage)
+            self._add(stage, items=1)
+            idx += 1
+        
+        for _ in range(self.renderers):
+            self._put(self.rows_queue, _DONE, stage)
+    
+    def _render_loop(self) -> None:
+        stage = self.stats["renderer"]
+        while True:
+            item = self._get(self.rows_queue, stage)
+            if item is _DONE:
+                break
+            
+            idx, row, size = item
+            self.memory.track("reader", -size)
+            if not self.ticket.acquire(self._stop):
+                raise PipelineCancelled()
+            start = time.perf_counter()
+            try:
+                members = [
+                    prepare_member(self._unique_name(name), content, self.archive_mode, self.deflate_level)
+                    for name, content in self.render(row, idx)
+                ]
+            except Exception as e:
+                print(f"Error generating row {idx+1}: {e}")
+                self.ticket.release(time.perf_counter() - start)
+                self._add(stage, busy=time.perf_counter() - start, failed=1)
+                if self.journal:
+                    self.journal.record_failed(idx, str(e))
+                continue
+            self.ticket.release(time.perf_counter() - start)
+            self._add(stage, busy=time.perf_counter() - start, items=1)
+            
+            entries = []
+            try:
+                for member in members:
+                    entries.append(self._hold(member))
+                self._put(self.docs_queue, (idx, entries), stage)
+            except PipelineCancelled:
+                for entry in entries:
+                    discard_spill(entry)
+                raise
+        
+        self._put(self.docs_queue, _DONE, stage)
+    
+    def _unique_name(self, name: str) -> str:
+        """压缩包内路径去重（成员头部含路径，压缩前确定）"""
+        with self._lock:
+            return unique_path(name, self._used_names)
+    
+    def _hold(self, member: ArchiveMember) -> Tuple[ArchiveMember, int]:
+        """
+        暂存待归档的成员
+        
+        进程内存超出全局预算时写入临时文件；超出任务预算时等待归档阶段释放（限流）
+        
+        Returns:
+            (成员, 记账字节数)
+        """
+        if self.memory.over_global():
+            self._spill(member)
+            return member, 0
+        
+        size = member.payload_size
+        while not self.memory.reserve("renderer", size):
+            if self._stop.is_set():
+                raise PipelineCancelled()
+            self.memory.wait(_POLL_SECONDS)
+        return member, size
+    
+    def _spill(self, member: ArchiveMember) -> None:
+        fd, path = tempfile.mkstemp(prefix=".spill_", dir=self._spill_dir)
+        with os.fdopen(fd, "wb") as f:
+            f.write(member.data)
+        member.path = Path(path)
+        member.data = b""
+        self.memory.record_spill(member.payload_size)
+    
+    def _discard_queued(self) -> None:
+        """中止后删除队列中未归档的临时文件"""
+        while True:
+            try:
+                item = self.docs_queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not _DONE:
+                for entry in item[1]:
+                    discard_spill(entry)
+    
+    def _archive(self, writer: ArchiveWriter) -> None:
+        stage = self.stats["archiver"]
+        remaining = self.renderers
+        
+        while remaining:
+            item = self._get(self.docs_queue, stage)
+            if item is _DONE:
+                remaining -= 1
+                continue
+            
+            idx, entries = item
+            start = time.perf_counter()
+            locations = []
+            try:
+                for entry in entries:
+                    locations.append(self._write(writer, entry))
+            finally:
+                for entry in entries:
+                    discard_spill(entry)
+            if self.journal:
+                writer.flush()
+                self.journal.record_row(idx, locations)
+            self._add(stage, busy=time.perf_counter() - start, items=len(entries))
+    
+    def _write(self, writer: ArchiveWriter, entry: Tuple[ArchiveMember, int]) -> Dict:
+        member, size = entry
+        if member.path:
+            return writer.add(member)
+        self.memory.track("renderer", -size)
+        self.memory.track("archiver", size)
+        location = writer.add(member)
+        self.memory.track("archiver", -size)
+        return location
+
+
+def discard_spill(entry: Tuple[ArchiveMember, int]) -> None:
+    """删除待归档成员的临时文件（如有）"""
+    if entry[0].path:
+        entry[0].path.unlink(missing_ok=True)
+
+
+def row_size(row: Dict) -> int:
+    """行数据占用内存的估算（字典及各值，不计明细记录的嵌套内容）"""
+    return sys.getsizeof(row) + sum(sys.getsizeof(v) for v in row.values())
@@ -0,0 +1,371 @@
+"""
+监视目录（无人值守生成）
+定时扫描收件箱，新放入的Excel按命名约定或同名JSON配置匹配模板，用批量生成流水线生成，
+压缩包写入发件箱；处理完的输入文件移入 processed，出错的移入 failed 并附错误说明
+
+匹配规则（依次）：
+    1. 同名配置文件 名称.xlsx.json 或 名称.json：
+       {"template": 模板名称} 或 {"bundle": 组合名称}，
+       可选 "column_mapping": {变量: 列名}、"sheet"、"layout"、"archive_mode"、"deflate_level"、"image_dir"
+    2. 文件名：模板名称.xlsx 或 模板名称__任意.xlsx（模板组合同理，先找模板再找组合）
+未指定列映射时按变量名自动匹配列（同数据导入页面的默认值）；循环行的明细表不支持，明细变量留空
+发件箱中已有同名结果或同名文件正在处理时，输出名称加时间前缀，不覆盖之前的结果
+
+扫描只读目录项和文件状态：收件箱目录的修改时间不变且没有待稳定的文件时不列目录；
+文件大小和修改时间保持不变超过 settle_seconds 后才处理（跳过仍在复制中的文件）。
+同时处理的文件数不超过工作线程数，其余留在收件箱中等下一轮
+"""
+import glob
+import itertools
+import json
+import os
+import shutil
+import threading
+import time
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from ..config import (
+    ARCHIVE_DEFAULT_MODE, ARCHIVE_DEFLATE_LEVEL, HOT_FOLDER_DIR, WATCH_POLL_SECONDS, WATCH_SETTLE_SECONDS,
+    WATCH_WORKERS
+)
+from ..models.schemas import TemplateConfig
+from .archive_writer import ARCHIVE_EXTENSIONS
+from .bundle_service import bundle_service
+from .excel_service import excel_service
+from .generation_pipeline import GenerationPipeline
+from .image_loader import ImageLoader
+from .job_journal import JobJournal, job_fingerprint
+from .job_scheduler import job_scheduler
+from .template_cache import template_cache
+from .template_service import template_service
+from .word_service import word_service
+
+
+INPUT_SUFFIXES = {".xlsx", ".xlsm", ".xls"}
+
+# 命名约定：模板名称__任意.xlsx
+NAME_SEPARATOR = "__"
+
+
+class HotFolder:
+    """监视目录守护进程"""
+    
+    def __init__(
+        self,
+        root: Path = HOT_FOLDER_DIR,
+        workers: int = WATCH_WORKERS,
+        settle_seconds: float = WATCH_SETTLE_SECONDS
+    ):
+        """
+        Args:
+            root: 根目录，其下为 inbox / outbox / processed / failed
+            workers: 同时处理的文件数
+            settle_seconds: 文件状态保持不变多久后处理
+        """
+        self.root = Path(root)
+        self.inbox = self.root / "inbox"
+        self.outbox = self.root / "outbox"
+        self.processed = self.root / "processed"
+        self.failed = self.root / "failed"
+        for dir_path in [self.inbox, self.outbox, self.processed, self.failed]:
+            dir_path.mkdir(parents=True, exist_ok=True)
+        
+        self.workers = max(1, workers)
+        self.settle_seconds = settle_seconds
+        self.stats = {"scans": 0, "listings": 0, "done": 0, "failed": 0}
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="hot-folder")
+        self._running: Dict[Path, Future] = {}
+        self._pending: Dict[Path, Tuple[int, int, float]] = {}  # 路径 → (大小, 修改时间, 状态首次出现的时间)
+        self._inbox_mtime = None
+        self._reserved = set()  # 处理中的文件占用的输出名称（不含扩展名）
+        self._lock = threading.Lock()
+    
+    def run_forever(self, stop: Optional[threading.Event] = None, interval: float = WATCH_POLL_SECONDS) -> None:
+        """按间隔扫描，直到 stop 被设置；退出前等待处理中的文件完成"""
+        stop = stop or threading.Event()
+        try:
+            while not stop.is_set():
+                self.poll()
+                stop.wait(interval)
+        finally:
+            self.close()
+    
+    def poll(self) -> List[Path]:
+        """扫描一次，提交已稳定的文件；返回本次提交的文件"""
+        with self._lock:
+            self._reap()
+            submitted = []
+            for path in self.scan():
+                if len(self._running) >= self.workers:
+                    break
+                self._pending.pop(path, None)
+                self._running[path] = self._executor.submit(self.process, path)
+                submitted.append(path)
+            return submitted
+    
+    def wait(self) -> None:
+        """等待处理中的文件完成"""
+        with self._lock:
+            futures = list(self._running.values())
+        for future in futures:
+            future.exception()
+        with self._lock:
+            self._reap()
+    
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+    
+    def scan(self) -> List[Path]:
+        """
+        已稳定、可以处理的输入文件（按修改时间先后）
+        
+        收件箱目录修改时间未变且没有待稳定的文件时直接返回，不列目录
+        """
+        self.stats["scans"] += 1
+        try:
+            inbox_mtime = os.stat(self.inbox).st_mtime_ns
+        except OSError:
+            return []
+        if inbox_mtime == self._inbox_mtime and not self._pending:
+            return []
+        self._inbox_mtime = inbox_mtime
+        self.stats["listings"] += 1
+        
+        now = time.monotonic()
+        ready = []
+        seen = set()
+        with os.scandir(self.inbox) as entries:
+            for entry in entries:
+                path = Path(entry.path)
+                if not self._is_input(entry) or path in self._running:
+                    continue
+                seen.add(path)
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                signature = (stat.st_size, stat.st_mtime_ns)
+                previous = self._pending.get(path)
+                if previous is None or previous[:2] != signature:
+                    self._pending[path] = (*signature, now)
+                elif now - previous[2] >= self.settle_seconds:
+                    ready.append((stat.st_mtime_ns, path))
+        for path in list(self._pending):
+            if path not in seen:
+                del self._pending[path]
+        return [path for _, path in sorted(ready)]
+    
+    def process(self, path: Path) -> Optional[Path]:
+        """
+        处理一个输入文件（在工作线程中调用），出错时移入 failed 并写错误说明
+        
+        Returns:
+            生成的压缩包（出错时为None）
+        """
+        sidecar = self.sidecar(path)
+        try:
+            output = self.generate(path, self.load_settings(path, sidecar))
+        except Exception as e:
+            print(f"[监视目录] 处理失败 {path.name}: {e}")
+            target = self._move(path, self.failed)
+            (target.parent / f"{target.name}.error.txt").write_text(
+                f"{e}\n\n{traceback.format_exc()}", encoding="utf-8"
+            )
+            if sidecar:
+                self._move(sidecar, self.failed)
+            self._count("failed")
+            return None
+        
+        self._move(path, self.processed)
+        if sidecar:
+            self._move(sidecar, self.processed)
+        self._count("done")
+        return output
+    
+    def sidecar(self, path: Path) -> Optional[Path]:
+        """同名配置文件（名称.xlsx.json 或 名称.json）"""
+        for candidate in (path.with_name(path.name + ".json"), path.with_suffix(".json")):
+            if candidate.exists():
+                return candidate
+        return None
+    
+    def load_settings(self, path: Path, sidecar: Optional[Path] = None) -> Dict:
+        """
+        解析生成设置
+        
+        Returns:
+            {"source": 模板或组合名称, "templates": [TemplateConfig], "layout", "column_mapping",
+             "sheet", "archive_mode", "deflate_level", "image_dir"}
+        
+        Raises:
+            ValueError: 配置文件无效或找不到匹配的模板
+        """
+        settings = {}
+        if sidecar:
+            try:
+                settings = json.loads(sidecar.read_text(encoding="utf-8"))
+            except ValueError as e:
+                raise ValueError(f"配置文件格式错误: {sidecar.name}: {e}")
+        
+        if settings.get("bundle"):
+            source, templates = settings["bundle"], self._find_bundle(settings["bundle"])
+        else:
+            source = settings.get("template") or path.stem.split(NAME_SEPARATOR)[0].strip()
+            templates = self._find_template(source)
+            if templates is None and not settings.get("template"):
+                templates = self._find_bundle(source)
+        if not templates:
+            raise ValueError(f"未找到匹配的模板或模板组合: {source}")
+        
+        bundle = len(templates) > 1 or bool(settings.get("bundle"))
+        return {
+            "source": source,
+            "templates": templates,
+            "layout": settings.get("layout", "person") if bundle else None,
+            "column_mapping": settings.get("column_mapping"),
+            "sheet": settings.get("sheet", 0),
+            "archive_mode": settings.get("archive_mode", ARCHIVE_DEFAULT_MODE),
+            "deflate_level": settings.get("deflate_level", ARCHIVE_DEFLATE_LEVEL),
+            "image_dir": settings.get("image_dir", ""),
+        }
+    
+    def generate(self, path: Path, settings: Dict) -> Path:
+        """按设置生成，压缩包写入发件箱（服务重启后按任务日志续跑）"""
+        templates: List[TemplateConfig] = settings["templates"]
+        compiled_templates = []
+        for template in templates:
+            compiled = template_cache.get_compiled(template)
+            if compiled is None:
+                raise ValueError(f"模板不存在: {template.template_name}")
+            compiled_templates.append((template.template_name, compiled))
+        
+        # 逐行读取；先取第一行得到列名用于自动匹配
+        records = excel_service.iter_records(path, settings["sheet"])
+        first = next(records, None)
+        if first is not None:
+            records = itertools.chain([first], records)
+        column_mapping = settings["column_mapping"]
+        if column_mapping is None:
+            columns = list(first) if first else []
+            variables = bundle_service.merge_variables(templates)["variables"]
+            matches = {var_name: excel_service.match_column(var_name, columns) for var_name in variables}
+            column_mapping = {var_name: column for var_name, column in matches.items() if column}
+        if not column_mapping:
+            raise ValueError("没有可用的列映射（请检查列名或在配置文件中指定 column_mapping）")
+        rows = ({var: record.get(col, "") for var, col in column_mapping.items()} for record in records)
+        
+        stat = path.stat()
+        journal = JobJournal(job_fingerprint({
+            "file": [path.name, stat.st_size, stat.st_mtime_ns],
+            "templates": [template_cache.cache_key(t) for t in templates],
+            "column_mapping": column_mapping,
+            "settings": {k: settings[k] for k in ("layout", "sheet", "archive_mode", "deflate_level", "image_dir")},
+        }))
+        extension = ARCHIVE_EXTENSIONS[settings["archive_mode"]]
+        # 续跑时沿用首次运行选定的名称（记录在任务日志中）
+        output_stem = self._reserve_stem(path.stem, journal.meta().get("output_name", "")[:-len(extension)])
+        output_name = f"{output_stem}{extension}"
+        
+        image_vars = [v for _, compiled in compiled_templates for v in getattr(compiled, "image_variables", [])]
+        loader = None
+        try:
+            journal.start(output_name)
+            loader = ImageLoader(settings["image_dir"], variables=image_vars) if image_vars else None
+            render = partial(
+                word_service.render_row_files, compiled_templates, layout=settings["layout"], images=loader
+            )
+            result = GenerationPipeline(
+                render,
+                archive_mode=settings["archive_mode"],
+                deflate_level=settings["deflate_level"],
+                journal=journal,
+                ticket=job_scheduler.job("hot-folder", priority="bulk"),
+                images=loader
+            ).run(rows, self.outbox / output_name)
+        finally:
+            journal.close()
+            self._release_stem(output_stem)
+            if loader:
+                loader.close()
+        
+        for template in templates:
+            template_service.record_usage(template.template_id)
+        summary = {
+            "input": path.name,
+            "source": settings["source"],
+            "column_mapping": column_mapping,
+            "outputs": [p.name for p in result.output_paths],
+            "rows": result.rows + result.resumed,
+            "documents": result.documents,
+            "failed": result.failed,
+            "elapsed": round(result.elapsed, 3),
+            "finished": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        (self.outbox / f"{output_stem}.result.json").write_text(
+            json.dumps(summary, ensure_ascii=False, indent=2), encoding="utf-8"
+        )
+        print(f"[监视目录] {path.name} → {output_name}：{result.documents} 份，失败 {result.failed} 行")
+        return result.output_paths[0]
+    
+    def _is_input(self, entry: os.DirEntry) -> bool:
+        name = entry.name
+        # Office 打开文件时生成的锁文件（~$名称.xlsx）和隐藏文件跳过
+        if name.startswith(("~$", ".")) or Path(name).suffix.lower() not in INPUT_SUFFIXES:
+            return False
+        try:
+            return entry.is_file()
+        except OSError:
+            return False
+    
+    def _find_template(self, name: str) -> Optional[List[TemplateConfig]]:
+        matches = [t for t in template_service.list_templates() if t.template_name == name]
+        return matches[:1] or None
+    
+    def _find_bundle(self, name: str) -> Optional[List[TemplateConfig]]:
+        for bundle in bundle_service.list_bundles():
+            if bundle.bundle_name == name:
+                return bundle_service.get_templates(bundle)
+        return None
+    
+    def _move(self, path: Path, target_dir: Path) -> Path:
+        """移入目标目录，重名时加时间前缀"""
+        target = target_dir / path.name
+        if target.exists():
+            target = target_dir / f"{datetime.now():%Y%m%d_%H%M%S_%f}_{path.name}"
+        shutil.move(str(path), str(target))
+        return target
+    
+    def _reserve_stem(self, stem: str, previous: str = "") -> str:
+        """
+        选定发件箱中未被占用的输出名称（不含扩展名），处理完成后 _release_stem
+        
+        已有同名结果（如次日再次放入同名文件）或同名文件正在处理（X.xlsx 与 X.xls）时加时间前缀，同 _move；
+        previous 为续跑任务首次运行时选定的名称，直接沿用
+        """
+        with self._lock:
+            if previous:
+                self._reserved.add(previous)
+                return previous
+            candidate = stem
+            while candidate in self._reserved or glob.glob(str(self.outbox / f"{glob.escape(candidate)}.*")):
+                candidate = f"{datetime.now():%Y%m%d_%H%M%S_%f}_{stem}"
+            self._reserved.add(candidate)
+            return candidate
+    
+    def _release_stem(self, stem: str) -> None:
+        with self._lock:
+            self._reserved.discard(stem)
+    
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self.stats[key] += 1
+    
+    def _reap(self) -> None:
+        for path, future in list(self._running.items()):
+            if future.done():
+                del self._running[path]
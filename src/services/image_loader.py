@@ -0,0 +1,195 @@
+"""
+图片变量读取
+流水线的读取阶段把即将渲染的行中的图片提交给线程池并行读取，渲染时直接取用（与渲染重叠进行）；
+同一内容只读取、解析一次。取用后的图片放入按字节限制的缓存，最近最少使用的先淘汰；
+缓存和尚未取用的预读结果计入任务的内存记账，内存占用取决于预读深度和缓存上限，与行数无关
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from docx.image.image import Image
+
+from ..config import IMAGE_CACHE_MB, IMAGE_PREFETCH_WORKERS
+from .compiled_template import ImageData
+
+
+# 任务内存记账中的阶段名
+MEMORY_STAGE = "images"
+
+
+class ImageLoader:
+    """
+    图片读取器（一批生成一个实例）
+    
+    Excel单元格中的值为图片路径，相对路径按 image_dir 解析；
+    文件不存在或不是支持的图片格式时返回 None，该处留空
+    """
+    
+    def __init__(
+        self,
+        image_dir: Optional[str] = None,
+        max_workers: int = IMAGE_PREFETCH_WORKERS,
+        variables: Iterable[str] = (),
+        max_bytes: int = IMAGE_CACHE_MB * 1024 * 1024
+    ):
+        """
+        Args:
+            image_dir: 相对路径所在的目录
+            max_workers: 并行读取的线程数
+            variables: 图片变量名，prefetch_row 按这些列预读
+            max_bytes: 已取用图片的缓存上限
+        """
+        self.image_dir = Path(image_dir) if image_dir else None
+        self.variables = list(dict.fromkeys(variables))
+        self.max_bytes = max_bytes
+        self.memory = None
+        self.held_bytes = 0
+        self.loads = 0
+        self.prefetched = 0
+        self.evictions = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._pending: Dict[Path, Future] = {}  # 已提交、尚未取用的读取任务
+        self._cache: "OrderedDict[Path, Optional[ImageData]]" = OrderedDict()
+        # 内容哈希 → [图片, 持有数]：缓存条目和未取用的读取结果各持有一次，归零时释放
+        self._blobs: Dict[str, List] = {}
+        self._lock = threading.Lock()
+    
+    def bind(self, memory) -> None:
+        """把图片占用的内存计入任务的内存记账（JobMemory）"""
+        with self._lock:
+            self.memory = memory
+            if self.held_bytes:
+                memory.track(MEMORY_STAGE, self.held_bytes)
+    
+    def resolve(self, value) -> Optional[Path]:
+        """单元格值对应的图片路径（空值返回 None）"""
+        text = str(value).strip() if value is not None else ""
+        if not text:
+            return None
+        path = Path(text)
+        if not path.is_absolute() and self.image_dir:
+            path = self.image_dir / path
+        return path
+    
+    def prefetch(self, values: Iterable) -> None:
+        """提交读取任务（已缓存或已提交的路径跳过）"""
+        for value in values:
+            path = self.resolve(value)
+            if path is None:
+                continue
+            with self._lock:
+                if path not in self._cache and path not in self._pending:
+                    self._pending[path] = self._executor.submit(self._load, path)
+    
+    def prefetch_row(self, row: Dict) -> None:
+        """预读一行数据中的全部图片变量"""
+        self.prefetch(row.get(var_name) for var_name in self.variables)
+    
+    def get(self, value) -> Optional[ImageData]:
+        """取得图片（未预读时当场读取；可在多个渲染线程中调用）"""
+        path = self.resolve(value)
+        if path is None:
+            return None
+        with self._lock:
+            if path in self._cache:
+                self._cache.move_to_end(path)
+                return self._cache[path]
+            future = self._pending.get(path)
+        
+        data = future.result() if future is not None else self._load(path)
+        with self._lock:
+            if future is not None:
+                if self._pending.get(path) is not future:
+                    # 其他线程已取走该结果并放入缓存
+                    return self._cache.get(path, data)
+                del self._pending[path]
+                self.prefetched += 1
+            if path in self._cache:
+                self._drop(data)
+                return self._cache[path]
+            self._cache[path] = data
+            self._evict()
+            return data
+    
+    def stats(self) -> Dict:
+        """
+        Returns:
+            {"cached": 缓存的路径数, "pending": 未取用的预读数, "held_bytes", "loads": 读取次数,
+             "prefetched": 取用时已预读的次数, "evictions"}
+        """
+        with self._lock:
+            return {
+                "cached": len(self._cache),
+                "pending": len(self._pending),
+                "held_bytes": self.held_bytes,
+                "loads": self.loads,
+                "prefetched": self.prefetched,
+                "evictions": self.evictions,
+            }
+    
+    def _load(self, path: Path) -> Optional[ImageData]:
+        """读取并解析图片，返回的结果持有一次（由取用方放入缓存或释放）"""
+        try:
+            image = Image.from_blob(path.read_bytes())
+        except Exception as e:
+            print(f"Error loading image {path}: {e}")
+            return None
+        
+        # 不同路径的相同图片共用一份数据，生成的文档中也只写入一个媒体部件
+        with self._lock:
+            self.loads += 1
+            entry = self._blobs.get(image.sha1)
+            if entry is None:
+                entry = self._blobs[image.sha1] = [ImageData(
+                    digest=image.sha1,
+                    ext=image.ext,
+                    content_type=image.content_type,
+                    blob=image.blob,
+                    px_width=image.px_width,
+                    px_height=image.px_height
+                ), 0]
+                self._charge(len(image.blob))
+            entry[1] += 1
+            return entry[0]
+    
+    def _drop(self, data: Optional[ImageData]) -> None:
+        if data is None:
+            return
+        entry = self._blobs[data.digest]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._blobs[data.digest]
+            self._charge(-len(data.blob))
+    
+    def _evict(self) -> None:
+        """超出上限时淘汰最久未用的缓存条目（至少保留刚放入的一个）"""
+        while self.held_bytes > self.max_bytes and len(self._cache) > 1:
+            _, data = self._cache.popitem(last=False)
+            self._drop(data)
+            self.evictions += 1
+    
+    def _charge(self, size: int) -> None:
+        self.held_bytes += size
+        if self.memory is not None:
+            self.memory.track(MEMORY_STAGE, size)
+    
+    def close(self) -> None:
+        """停止读取，释放缓存和未取用的结果"""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        with self._lock:
+            for future in self._pending.values():
+                if not future.cancelled() and future.exception() is None:
+                    self._drop(future.result())
+            self._pending.clear()
+            for data in self._cache.values():
+                self._drop(data)
+            self._cache.clear()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
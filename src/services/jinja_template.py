@@ -0,0 +1,112 @@
+"""
+Jinja模板（docxtpl {{ 变量 }} 语法）预编译
+模板XML只预处理、编译一次，逐行生成时只执行编译好的Jinja模板，不再为每行创建 DocxTemplate
+"""
+import re
+import zipfile
+from dataclasses import dataclass, field
+from io import BytesIO
+from typing import BinaryIO, Dict, List, Tuple, Union
+
+import docx.oxml.ns
+from docxtpl import DocxTemplate
+from jinja2 import Environment, Template
+from jinja2.sandbox import SandboxedEnvironment
+from lxml import etree
+
+
+# 模板中是否含有 {{ }} 或 {% %} 语法
+JINJA_TAG_RE = re.compile(r"\{[{%]")
+
+XML_DECLARATION = b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\r\n'
+
+# docxtpl 的文本后处理（换行、制表符转换等）不依赖模板状态，共用一个未加载文档的实例
+_docxtpl = DocxTemplate(None)
+
+
+def create_jinja_env() -> Environment:
+    """
+    变量值来自Excel，可能含有 & < > 等字符，输出时按XML转义；
+    模板由用户上传并在共用的服务进程中执行，使用沙箱环境，禁止访问 __class__ 等内部属性
+    """
+    return SandboxedEnvironment(autoescape=True)
+
+
+@dataclass
+class JinjaPart:
+    """
+    含Jinja语法的XML部件
+    
+    输出为 prefix + 渲染结果 + suffix；正文部件只有 <w:body> 是模板，前后为原始字节
+    """
+    prefix: bytes
+    template: Template
+    suffix: bytes
+    source_size: int
+    fix_tree: bool = False  # 含列循环（{%tc %}）或图片时，渲染后需修正表格列宽和图片编号
+
+
+@dataclass
+class CompiledJinjaTemplate:
+    """
+    预编译Jinja模板
+    
+    与 CompiledTemplate 接口一致（render / render_to / size / key），可放入同一缓存
+    
+    members: 按原顺序排列的压缩包成员，值为原始字节（静态）或 JinjaPart
+    """
+    members: List[Tuple[str, Union[bytes, JinjaPart]]]
+    variables: List[str]
+    key: str = ""
+    size: int = field(init=False)
+    
+    def __post_init__(self):
+        self.size = sum(
+            len(content.prefix) + content.source_size + len(content.suffix)
+            if isinstance(content, JinjaPart) else len(content)
+            for _, content in self.members
+        )
+    
+    def render(self, values: Dict[str, str]) -> bytes:
+        """用一行数据生成docx"""
+        output = BytesIO()
+        self.render_to(output, values)
+        return output.getvalue()
+    
+    def render_to(self, fileobj: BinaryIO, values: Dict[str, str]) -> None:
+        """用一行数据生成docx并直接写入文件对象"""
+        with zipfile.ZipFile(fileobj, "w", zipfile.ZIP_DEFLATED) as zf:
+            for name, content in self.members:
+                if isinstance(content, JinjaPart):
+                    with zf.open(name, "w") as dest:
+                        dest.write(content.prefix)
+                        dest.write(render_part(content, values).encode("utf-8"))
+                        dest.write(content.suffix)
+                else:
+                    zf.writestr(name, content)
+
+
+def render_part(part: JinjaPart, values: Dict[str, str]) -> str:
+    """渲染一个部件，后处理与 DocxTemplate.render_xml_part 一致"""
+    xml = part.template.render(values)
+    xml = re.sub(r"\n<w:p([ >])", r"<w:p\1", xml)
+    xml = xml.replace("{_{", "{{").replace("}_}", "}}").replace("{_%", "{%").replace("%_}", "%}")
+    xml = _docxtpl.resolve_listing(xml)
+    
+    if part.fix_tree:
+        tree = _docxtpl.fix_tables(xml)
+        for doc_pr_id, elt in enumerate(tree.xpath("//wp:docPr", namespaces=docx.oxml.ns.nsmap), 1001):
+            elt.attrib["id"] = str(doc_pr_id)
+        xml = etree.tostring(tree, encoding="unicode")
+    return xml
+
+
+def compile_jinja_source(env: Environment, src_xml: str) -> Template:
+    """编译预处理后的XML；与 docxtpl 相同，段落前加换行使报错行号对应到段落"""
+    return env.from_string(re.sub(r"<w:p([ >])", r"\n<w:p\1", src_xml))
+
+
+def needs_tree_fix(src_xml: str) -> bool:
+    """含列循环或图片（循环中复制后编号重复）时，渲染后需要解析一次XML做修正"""
+    text = re.sub(r"<[^>]*>", "", src_xml)
+    return "<wp:docPr" in src_xml or re.search(r"\{%\s*tc\s", text) is not None
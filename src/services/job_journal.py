@@ -0,0 +1,218 @@
+"""
+生成任务进度日志
+每个任务一个目录（OUTPUTS_DIR/jobs/任务指纹），内含只追加的日志 journal.jsonl 与未完成的压缩包分卷；
+每行生成结果写入压缩包后记一行（行号、压缩包内路径、位置与内容哈希、状态），
+服务重启后同一任务（模板、数据、设置都相同）校验已写入的内容，只重做剩下的行
+
+同一任务同时只能有一次运行（两个会话、两个标签页或重复点击会得到相同的指纹）：
+运行期间持有任务目录中锁文件的排他锁（操作系统文件锁，进程退出时自动释放，服务重启后可以续跑）
+
+日志格式（每行一个JSON）：
+    {"row": 行号, "status": "done", "files": [ArchiveWriter.add 返回的成员位置, ...]}
+    {"row": 行号, "status": "failed", "error": 错误信息}
+"""
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from ..config import JOBS_DIR
+
+
+JOURNAL_FILE = "journal.jsonl"
+META_FILE = "meta.json"
+LOCK_FILE = "lock"
+
+
+class JobLocked(RuntimeError):
+    """同一任务正在另一次运行中生成"""
+
+
+def _try_lock(fd: int) -> bool:
+    """非阻塞地取得文件的排他锁"""
+    try:
+        if sys.platform == "win32":
+            import msvcrt
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
+
+def job_fingerprint(parts: Dict) -> str:
+    """任务指纹：模板、数据与生成设置的哈希，相同指纹的任务可以续跑"""
+    text = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+class JobJournal:
+    """单个生成任务的进度日志（多个渲染线程可同时记录）"""
+    
+    def __init__(self, fingerprint: str, jobs_dir: Path = JOBS_DIR):
+        self.fingerprint = fingerprint
+        self.job_dir = Path(jobs_dir) / fingerprint
+        self.journal_path = self.job_dir / JOURNAL_FILE
+        self.lock_path = self.job_dir / LOCK_FILE
+        self._file = None
+        self._lock = threading.Lock()
+        self._lock_fd = None
+    
+    def exists(self) -> bool:
+        """是否有未完成的任务"""
+        return self.journal_path.exists()
+    
+    def running(self) -> bool:
+        """任务是否正在另一次运行中生成"""
+        if self._lock_fd is not None or not self.lock_path.exists():
+            return False
+        try:
+            self.acquire()
+        except JobLocked:
+            return True
+        self.release()
+        return False
+    
+    def acquire(self) -> None:
+        """
+        取得任务的排他锁（已持有时直接返回），close 或 remove 时释放
+        
+        Raises:
+            JobLocked: 另一次运行正在生成该任务
+        """
+        if self._lock_fd is not None:
+            return
+        self.job_dir.mkdir(parents=True, exist_ok=True)
+        while True:
+            fd = os.open(self.lock_path, os.O_CREAT | os.O_RDWR)
+            if not _try_lock(fd):
+                os.close(fd)
+                raise JobLocked("该任务正在另一个会话中生成，请等待其完成")
+            # 上一次运行完成时会删除锁文件；拿到的是已删除的旧文件时重新打开
+            try:
+                if os.fstat(fd).st_ino == os.stat(self.lock_path).st_ino:
+                    break
+            except OSError:
+                pass
+            os.close(fd)
+        self._lock_fd = fd
+    
+    def release(self) -> None:
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+    
+    def start(self, output_name: str, total: int = 0) -> None:
+        """
+        开始或续跑任务：取得排他锁，首次运行时记录输出文件名与总行数
+        
+        Raises:
+            JobLocked: 另一次运行正在生成该任务
+        """
+        self.acquire()
+        if not (self.job_dir / META_FILE).exists():
+            meta = {"output_name": output_name, "total": total, "created": time.strftime("%Y-%m-%d %H:%M:%S")}
+            (self.job_dir / META_FILE).write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+    
+    def meta(self) -> Dict:
+        """{"output_name", "total", "created"}；没有记录时为空"""
+        try:
+            return json.loads((self.job_dir / META_FILE).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+    
+    def load(self) -> List[Dict]:
+        """
+        按写入顺序读取日志
+        
+        进程中断时最后一行可能只写了一半，忽略无法解析的行
+        """
+        entries = []
+        try:
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.endswith("\n"):
+                        break
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        break
+        except OSError:
+            pass
+        return entries
+    
+    def completed_rows(self) -> List[int]:
+        return [entry["row"] for entry in self.load() if entry["status"] == "done"]
+    
+    def reset(self, entries: List[Dict]) -> None:
+        """只保留校验通过的记录（先写临时文件再替换），之后继续追加"""
+        self.job_dir.mkdir(parents=True, exist_ok=True)
+        self._close_file()
+        tmp_path = self.journal_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        tmp_path.replace(self.journal_path)
+    
+    def record_row(self, row: int, files: List[Dict]) -> None:
+        """记录一行已写入压缩包（调用前压缩包数据须已 flush）"""
+        self._append({"row": row, "status": "done", "files": files})
+    
+    def record_failed(self, row: int, error: str) -> None:
+        """记录一行生成失败（续跑时重试）"""
+        self._append({"row": row, "status": "failed", "error": error})
+    
+    def close(self) -> None:
+        """关闭日志并释放锁（保留进度，可以续跑）"""
+        self._close_file()
+        self.release()
+    
+    def remove(self) -> None:
+        """
+        任务完成或放弃时删除日志与未完成的压缩包
+        
+        持有锁时删除，其他运行不会在删除过程中开始；另一次运行正在生成时抛出 JobLocked
+        """
+        self.acquire()
+        self._close_file()
+        for path in self.job_dir.iterdir():
+            if path == self.lock_path:
+                continue
+            if path.is_dir():
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                path.unlink(missing_ok=True)
+        # POSIX 下持有锁时即可删除锁文件；Windows 下打开的文件不能删除，释放后再删
+        for _ in range(2):
+            try:
+                self.lock_path.unlink(missing_ok=True)
+                break
+            except OSError:
+                self.release()
+        self.release()
+        try:
+            self.job_dir.rmdir()
+        except OSError:
+            pass
+    
+    def _append(self, entry: Dict) -> None:
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            if self._file is None:
+                self.job_dir.mkdir(parents=True, exist_ok=True)
+                self._file = open(self.journal_path, "a", encoding="utf-8")
+            self._file.write(line)
+            self._file.flush()
+    
+    def _close_file(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,195 @@
+"""
+生成任务调度
+Streamlit 的所有会话共用同一进程，一个用户的大批量任务会占满渲染线程，其他用户的单份合同只能排队；
+调度器在所有任务的渲染线程之上限制同时渲染的行数（工作槽位），按行分配槽位：
+    1. 优先级高的先分配（少量行的交互任务先于批量任务）
+    2. 同一优先级内按用户加权公平分配：已占用槽位时间 / 权重 最少的用户先得到槽位
+    3. 同一用户内按请求先后
+"""
+import itertools
+import threading
+import time
+from typing import Dict, List, Optional
+
+from ..config import JOB_PRIORITIES, SCHEDULER_INTERACTIVE_ROWS, SCHEDULER_WORKERS
+
+
+# 排队时检查取消的间隔（秒）
+_POLL_SECONDS = 0.1
+
+
+class _Request:
+    """一次槽位请求（渲染一行）"""
+    
+    __slots__ = ("ticket", "seq", "queued_at")
+    
+    def __init__(self, ticket: "JobTicket", seq: int):
+        self.ticket = ticket
+        self.seq = seq
+        self.queued_at = time.monotonic()
+    
+    def order(self, scheduler: "JobScheduler"):
+        ticket = self.ticket
+        return ticket.rank, scheduler.usage.get(ticket.user, 0.0), self.seq
+
+
+class JobTicket:
+    """
+    单个任务在调度器中的登记
+    
+    渲染线程每行先 acquire 取得槽位，渲染完成后 release；任务结束时 close
+    """
+    
+    def __init__(self, scheduler: "JobScheduler", user: str, priority: str, weight: float):
+        self.scheduler = scheduler
+        self.user = user
+        self.priority = priority
+        self.rank = list(JOB_PRIORITIES).index(priority)
+        self.weight = max(weight, 0.01)
+        self.acquired = 0
+        self.running = 0
+        self.waited = 0.0
+        self.max_wait = 0.0
+        self.created = time.monotonic()
+    
+    def acquire(self, cancel: Optional[threading.Event] = None) -> bool:
+        """等待一个工作槽位；cancel 被设置时放弃排队并返回 False"""
+        return self.scheduler.acquire(self, cancel)
+    
+    def release(self, elapsed: float) -> None:
+        """归还槽位，elapsed 为占用时间（计入用户的已用份额）"""
+        self.scheduler.release(self, elapsed)
+    
+    def summary(self) -> Dict:
+        """{"user", "priority", "acquired", "waited": 累计等待秒数, "avg_wait", "max_wait"}"""
+        return {
+            "user": self.user,
+            "priority": self.priority,
+            "acquired": self.acquired,
+            "waited": round(self.waited, 3),
+            "avg_wait": round(self.waited / self.acquired, 4) if self.acquired else 0.0,
+            "max_wait": round(self.max_wait, 4),
+        }
+    
+    def close(self) -> None:
+        self.scheduler.unregister(self)
+
+
+class JobScheduler:
+    """进程内所有生成任务共用的调度器"""
+    
+    def __init__(self, workers: int = SCHEDULER_WORKERS, interactive_rows: int = SCHEDULER_INTERACTIVE_ROWS):
+        """
+        Args:
+            workers: 同时渲染的行数上限
+            interactive_rows: 行数不超过该值的任务按交互任务优先
+        """
+        self.workers = max(1, workers)
+        self.interactive_rows = interactive_rows
+        self.running = 0
+        self.usage: Dict[str, float] = {}  # 用户 → 已占用槽位时间 / 权重（虚拟时间）
+        self.tickets: List[JobTicket] = []
+        self._waiting: Dict[str, List[_Request]] = {}  # 用户 → 排队中的请求
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+    
+    def job(self, user: str, rows: Optional[int] = None, priority: Optional[str] = None,
+            weight: float = 1.0) -> JobTicket:
+        """
+        登记一个任务（结束时调用 JobTicket.close）
+        
+        Args:
+            user: 用户标识，同一用户的任务共享份额
+            rows: 任务行数，未指定优先级时据此判断（未知时按批量任务）
+            priority: JOB_PRIORITIES 中的键
+            weight: 用户权重，权重为2的用户得到的槽位时间是权重为1的两倍
+        """
+        if priority is None:
+            interactive = rows is not None and rows <= self.interactive_rows
+            priority = "interactive" if interactive else "bulk"
+        ticket = JobTicket(self, user, priority, weight)
+        with self._cond:
+            # 新来（或空闲了一段时间）的用户从当前最少的已用份额开始，不累积空闲期间的额度
+            active = [self.usage[t.user] for t in self.tickets if t.user in self.usage]
+            floor = min(active) if active else 0.0
+            self.usage[user] = max(self.usage.get(user, 0.0), floor)
+            self.tickets.append(ticket)
+        return ticket
+    
+    def acquire(self, ticket: JobTicket, cancel: Optional[threading.Event] = None) -> bool:
+        with self._cond:
+            request = _Request(ticket, next(self._seq))
+            self._waiting.setdefault(ticket.user, []).append(request)
+            while not (self.running < self.workers and self._next() is request):
+                if cancel is not None and cancel.is_set():
+                    self._dequeue(request)
+                    self._cond.notify_all()
+                    return False
+                self._cond.wait(_POLL_SECONDS)
+            
+            self._dequeue(request)
+            self.running += 1
+            ticket.running += 1
+            ticket.acquired += 1
+            waited = time.monotonic() - request.queued_at
+            ticket.waited += waited
+            ticket.max_wait = max(ticket.max_wait, waited)
+            self._cond.notify_all()
+            return True
+    
+    def release(self, ticket: JobTicket, elapsed: float) -> None:
+        with self._cond:
+            self.running -= 1
+            ticket.running -= 1
+            self.usage[ticket.user] = self.usage.get(ticket.user, 0.0) + elapsed / ticket.weight
+            self._cond.notify_all()
+    
+    def unregister(self, ticket: JobTicket) -> None:
+        with self._cond:
+            if ticket in self.tickets:
+                self.tickets.remove(ticket)
+            if not any(t.user == ticket.user for t in self.tickets):
+                self.usage.pop(ticket.user, None)
+    
+    def stats(self) -> Dict:
+        """
+        Returns:
+            {"workers", "running", "queued": 排队的行数,
+             "users": [{"user", "jobs", "running", "queued", "oldest_wait": 最早的排队请求已等待秒数}]}
+        """
+        now = time.monotonic()
+        with self._cond:
+            users = {}
+            for ticket in self.tickets:
+                user = users.setdefault(ticket.user, {
+                    "user": ticket.user, "jobs": 0, "running": 0, "queued": 0, "oldest_wait": 0.0
+                })
+                user["jobs"] += 1
+                user["running"] += ticket.running
+            for name, requests in self._waiting.items():
+                if name in users and requests:
+                    users[name]["queued"] = len(requests)
+                    users[name]["oldest_wait"] = round(now - min(r.queued_at for r in requests), 3)
+            return {
+                "workers": self.workers,
+                "running": self.running,
+                "queued": sum(len(requests) for requests in self._waiting.values()),
+                "users": list(users.values()),
+            }
+    
+    def _next(self) -> Optional[_Request]:
+        """下一个应得到槽位的请求"""
+        candidates = [request for requests in self._waiting.values() for request in requests]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda request: request.order(self))
+    
+    def _dequeue(self, request: _Request) -> None:
+        requests = self._waiting[request.ticket.user]
+        requests.remove(request)
+        if not requests:
+            del self._waiting[request.ticket.user]
+
+
+# 单例
+job_scheduler = JobScheduler()
@@ -0,0 +1,199 @@
+"""
+生成任务内存预算
+每个任务记录各阶段暂存的数据量，超出任务预算时等待下游释放；
+进程常驻内存超出全局预算时（多个会话同时生成），待归档的文档先写入临时文件，不再占用内存
+"""
+import ctypes
+import os
+import sys
+import threading
+import time
+from typing import Dict, Optional
+
+from ..config import GLOBAL_MEMORY_BUDGET_MB, JOB_MEMORY_BUDGET_MB, MEMORY_SAMPLE_SECONDS
+
+try:
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+_MB = 1024 * 1024
+
+
+class _ProcessMemoryCounters(ctypes.Structure):
+    """Windows PROCESS_MEMORY_COUNTERS"""
+    _fields_ = [
+        ("cb", ctypes.c_uint32),
+        ("PageFaultCount", ctypes.c_uint32),
+        ("PeakWorkingSetSize", ctypes.c_size_t),
+        ("WorkingSetSize", ctypes.c_size_t),
+        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+        ("QuotaPagedPoolUsage", ctypes.c_size_t),
+        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+        ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+        ("PagefileUsage", ctypes.c_size_t),
+        ("PeakPagefileUsage", ctypes.c_size_t),
+    ]
+
+
+def process_rss() -> int:
+    """当前进程的常驻内存（字节）；无法读取时返回0"""
+    if sys.platform == "win32":
+        counters = _ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        kernel32 = ctypes.windll.kernel32
+        if kernel32.K32GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize
+        return 0
+    
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        pass
+    
+    # 没有 /proc 的系统（macOS）只能取得峰值
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class JobMemory:
+    """
+    单个生成任务的内存记账
+    
+    各阶段暂存的数据（队列中的行数据、待归档的文档）按字节记账，记录各阶段峰值；
+    同时按采样间隔读取进程常驻内存，记录任务期间的峰值
+    """
+    
+    def __init__(self, budget: "MemoryBudget", limit: int):
+        self.budget = budget
+        self.limit = limit
+        self.held: Dict[str, int] = {}
+        self.peaks: Dict[str, int] = {}
+        self.peak_total = 0
+        self.peak_rss = 0
+        self.spilled = 0
+        self.spilled_bytes = 0
+        self.throttled = 0.0
+        self._cond = threading.Condition()
+        self._sampled_at = 0.0
+        self._rss = 0
+    
+    @property
+    def total(self) -> int:
+        return sum(self.held.values())
+    
+    def track(self, stage: str, size: int) -> None:
+        """记账（不检查预算）；size 为负数时释放"""
+        with self._cond:
+            held = self.held.get(stage, 0) + size
+            self.held[stage] = held
+            if size > 0:
+                self.peaks[stage] = max(self.peaks.get(stage, 0), held)
+                self.peak_total = max(self.peak_total, self.total)
+            else:
+                self._cond.notify_all()
+    
+    def reserve(self, stage: str, size: int) -> bool:
+        """
+        在任务预算内记账
+        
+        该阶段未暂存任何数据时总是成功：单个超大文档也能通过，
+        其他阶段（如队列中的行数据）占满预算时也不会互相等待
+        
+        Returns:
+            是否已记账（超出预算时不记账）
+        """
+        with self._cond:
+            # 检查与记账在同一临界区内，多个渲染线程不会同时通过检查
+            if self.held.get(stage, 0) and self.total + size > self.limit:
+                return False
+            self.track(stage, size)
+            return True
+    
+    def wait(self, timeout: float) -> None:
+        """等待其他阶段释放内存（超时返回，调用方重新检查）"""
+        start = time.perf_counter()
+        with self._cond:
+            self._cond.wait(timeout)
+            self.throttled += time.perf_counter() - start
+    
+    def over_global(self) -> bool:
+        """进程常驻内存是否超出全局预算（按采样间隔读取）"""
+        return self.sample_rss() > self.budget.limit
+    
+    def sample_rss(self) -> int:
+        # 采样与赋值在锁内完成，其他线程不会在采样时间已更新、内存值尚未写入时读到旧值
+        with self._cond:
+            now = time.monotonic()
+            if now - self._sampled_at >= MEMORY_SAMPLE_SECONDS:
+                self._rss = process_rss()
+                self._sampled_at = now
+                self.peak_rss = max(self.peak_rss, self._rss)
+            return self._rss
+    
+    def record_spill(self, size: int) -> None:
+        with self._cond:
+            self.spilled += 1
+            self.spilled_bytes += size
+    
+    def summary(self) -> Dict:
+        """
+        Returns:
+            {"limit", "peak_total", "stages": {阶段: 峰值字节}, "peak_rss",
+             "spilled", "spilled_bytes", "throttled": 等待秒数}
+        """
+        self.sample_rss()
+        with self._cond:
+            return {
+                "limit": self.limit,
+                "peak_total": self.peak_total,
+                "stages": dict(self.peaks),
+                "peak_rss": self.peak_rss,
+                "spilled": self.spilled,
+                "spilled_bytes": self.spilled_bytes,
+                "throttled": round(self.throttled, 3),
+            }
+    
+    def close(self) -> None:
+        self.budget.unregister(self)
+
+
+class MemoryBudget:
+    """进程内所有生成任务共用的全局预算（Streamlit 的多个会话在同一进程中）"""
+    
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.jobs = []
+        self._lock = threading.Lock()
+    
+    def job(self, limit: Optional[int] = None) -> JobMemory:
+        """登记一个任务（结束时调用 JobMemory.close）"""
+        job = JobMemory(self, limit or JOB_MEMORY_BUDGET_MB * _MB)
+        with self._lock:
+            self.jobs.append(job)
+        return job
+    
+    def unregister(self, job: JobMemory) -> None:
+        with self._lock:
+            if job in self.jobs:
+                self.jobs.remove(job)
+    
+    def stats(self) -> Dict:
+        """全局统计：进程常驻内存、进行中的任务数及其暂存数据量"""
+        with self._lock:
+            jobs = list(self.jobs)
+        return {
+            "limit": self.limit,
+            "rss": process_rss(),
+            "jobs": len(jobs),
+            "held": sum(job.total for job in jobs),
+        }
+
+
+# 单例
+memory_budget = MemoryBudget(GLOBAL_MEMORY_BUDGET_MB * _MB)
@@ -0,0 +1,134 @@
+"""
+分布式生成 worker
+从共享工作队列领取数据块，用与单机生成相同的 WordService 逻辑和流水线生成，压缩包写回共享目录；
+生成期间定期续约并上报进度，失去租约（被判定宕机后由他人接手）或任务取消时放弃该数据块
+"""
+import sqlite3
+import threading
+import time
+from functools import partial
+from typing import Dict, List, Optional, Tuple
+
+from ..config import ARCHIVE_DEFLATE_LEVEL, CLUSTER_POLL_SECONDS, PIPELINE_RENDERERS
+from .archive_writer import ARCHIVE_EXTENSIONS
+from .compiled_template import CompiledTemplate
+from .generation_pipeline import GenerationPipeline, PipelineCancelled
+from .image_loader import ImageLoader
+from .job_scheduler import job_scheduler
+from .work_queue import WorkQueue, worker_name
+from .word_service import word_service
+
+
+# 上报进度的最长间隔（秒）；续约间隔为租约时长的三分之一，取两者中较短的
+_PROGRESS_SECONDS = 5
+
+
+class QueueWorker:
+    """单个 worker 进程（每次处理一个数据块，数据块内多线程渲染）"""
+    
+    def __init__(self, work_queue: WorkQueue, name: Optional[str] = None, renderers: int = PIPELINE_RENDERERS):
+        self.queue = work_queue
+        self.name = name or worker_name()
+        self.renderers = renderers
+        self.processed = 0
+        # 同一任务的数据块共用预编译模板（只保留最近一个任务）
+        self._templates: Tuple[str, List[Tuple[str, CompiledTemplate]], Dict] = ("", [], {})
+    
+    def run_forever(self, stop: Optional[threading.Event] = None, exit_when_idle: bool = False) -> int:
+        """
+        持续领取并处理数据块
+        
+        Args:
+            stop: 设置后处理完当前数据块即退出
+            exit_when_idle: 队列中没有可领取的数据块时退出
+        
+        Returns:
+            处理的数据块数
+        """
+        stop = stop or threading.Event()
+        try:
+            while not stop.is_set():
+                if not self.run_once():
+                    if exit_when_idle:
+                        break
+                    stop.wait(CLUSTER_POLL_SECONDS)
+        finally:
+            self.queue.release_worker(self.name)
+        return self.processed
+    
+    def run_once(self) -> bool:
+        """领取并处理一个数据块，没有可领取的数据块时返回 False"""
+        task = self.queue.claim(self.name)
+        if task is None:
+            return False
+        
+        print(f"[{self.name}] 数据块 {task['job_id']}/{task['chunk']}（第 {task['attempts']} 次）")
+        try:
+            self.process(task)
+        except PipelineCancelled:
+            print(f"[{self.name}] 已放弃 {task['job_id']}/{task['chunk']}：租约已被接手或任务已取消")
+        except Exception as e:
+            print(f"[{self.name}] 数据块出错 {task['job_id']}/{task['chunk']}: {e}")
+            self.queue.fail(task, self.name, str(e))
+        self.processed += 1
+        return True
+    
+    def process(self, task: Dict) -> None:
+        templates, spec = self._load(task["job_id"])
+        first_row = task["first_row"]
+        
+        image_vars = [v for _, compiled in templates for v in getattr(compiled, "image_variables", [])]
+        loader = ImageLoader(spec.get("image_dir"), variables=image_vars) if image_vars else None
+        render_files = partial(
+            word_service.render_row_files, templates, layout=spec.get("layout"), images=loader
+        )
+        
+        mode = spec.get("archive_mode", "stored")
+        # 每次尝试写入不同的文件：租约过期但仍在运行的 worker 与接手的 worker 不会互相覆盖或删除
+        output = f"output/{task['chunk']:05d}.{task['attempts']}{ARCHIVE_EXTENSIONS[mode]}"
+        pipeline = GenerationPipeline(
+            lambda data, idx: render_files(data, first_row + idx),
+            renderers=self.renderers,
+            archive_mode=mode,
+            deflate_level=spec.get("deflate_level", ARCHIVE_DEFLATE_LEVEL),
+            volume_mb=0,
+            ticket=job_scheduler.job(self.name, rows=task["rows"]),
+            images=loader
+        )
+        
+        interval = min(self.queue.lease_seconds / 3, _PROGRESS_SECONDS)
+        last_beat = {"at": time.monotonic()}
+        
+        def on_progress(snapshot):
+            if time.monotonic() - last_beat["at"] < interval:
+                return
+            last_beat["at"] = time.monotonic()
+            try:
+                held = self.queue.heartbeat(task, self.name, snapshot["stages"]["renderer"]["items"])
+            except sqlite3.Error as e:
+                # 共享目录暂时不可用：继续生成，下次再续约（完成时仍会校验是否持有数据块）
+                print(f"[{self.name}] 续约失败 {task['job_id']}/{task['chunk']}: {e}")
+                return
+            if not held:
+                pipeline.cancel()
+        
+        try:
+            result = pipeline.run(
+                self.queue.read_chunk(task["job_id"], task["chunk"]),
+                self.queue.job_dir(task["job_id"]) / output,
+                on_progress=on_progress
+            )
+        finally:
+            if loader:
+                loader.close()
+        
+        if not self.queue.complete(task, self.name, output, result.documents, result.failed):
+            print(f"[{self.name}] 数据块 {task['job_id']}/{task['chunk']} 已由其他 worker 完成")
+            for path in result.output_paths:
+                path.unlink(missing_ok=True)
+    
+    def _load(self, job_id: str) -> Tuple[List[Tuple[str, CompiledTemplate]], Dict]:
+        if self._templates[0] != job_id:
+            spec = self.queue.spec(job_id)
+            self._templates = (job_id, self.queue.load_templates(job_id, spec), spec)
+        return self._templates[1], self._templates[2]
@@ -0,0 +1,284 @@
+"""
+大模板流式编译
+逐块读取 word/document.xml 的正文（段落、表格），只有包含映射位置的块才解析为
+python-docx 对象并复用保留格式的替换逻辑，其余块原样输出。
+编译结果边生成边写入预编译文件，再通过 mmap 加载，内存占用与模板大小无关。
+"""
+import posixpath
+import re
+import zipfile
+from io import BytesIO
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from docx.oxml.ns import qn
+from docx.oxml.parser import parse_xml
+from docx.table import Table
+from docx.text.paragraph import Paragraph
+from lxml import etree
+
+from ..config import STREAMING_COMPILE_MIN_MB
+from ..models.schemas import group_locations, image_variables
+from .artifact_store import ArtifactStore, artifact_store
+from .compiled_template import CompiledTemplate, Segment, make_slot_marker, split_segments
+from .word_service import HEADER_FOOTER_PARTS, word_service
+
+
+DOCUMENT_PART = "word/document.xml"
+DOCUMENT_RELS = "word/_rels/document.xml.rels"
+
+BODY_START_RE = re.compile(rb"<((?:[\w.-]+:)?)body\b[^>]*>")
+ROOT_START_RE = re.compile(rb"<((?:[\w.-]+:)?)document\b")
+NS_DECL_RE = re.compile(r'\sxmlns(?::([\w.-]+))?="([^"]*)"')
+NS_DECLS_RE = re.compile(r'(?:\sxmlns(?::[\w.-]+)?="[^"]*")+')
+CELL_ID_RE = re.compile(r"^cell_(\d+)_")
+
+# 页眉页脚属性 → 节属性中引用的类型
+REFERENCE_TYPES = {
+    "header": "default",
+    "first_page_header": "first",
+    "even_page_header": "even",
+    "footer": "default",
+    "first_page_footer": "first",
+    "even_page_footer": "even",
+}
+
+
+class StreamingCompiler:
+    """大模板流式编译"""
+    
+    def __init__(self, store: ArtifactStore = artifact_store, min_bytes: int = STREAMING_COMPILE_MIN_MB * 1024 * 1024):
+        self.store = store
+        self.min_bytes = min_bytes
+    
+    def should_stream(self, file_bytes: bytes, mapping_info: Dict) -> bool:
+        """
+        正文XML足够大且为位置映射时使用流式编译
+        
+        文本映射需要全文查找、图片变量需要改写部件关系，仍走完整解析
+        """
+        if mapping_info["type"] != "location" or image_variables(mapping_info["data"]):
+            return False
+        with zipfile.ZipFile(BytesIO(file_bytes)) as zf:
+            try:
+                return zf.getinfo(DOCUMENT_PART).file_size >= self.min_bytes
+            except KeyError:
+                return False
+    
+    def compile_to_artifact(
+        self,
+        template_id: str,
+        file_bytes: bytes,
+        location_mapping: Dict[str, Dict],
+        key: str,
+        repeat_rows: Optional[List[Dict]] = None
+    ) -> CompiledTemplate:
+        """流式编译并写入预编译文件，返回通过 mmap 加载的结果"""
+        targets = group_locations(location_mapping)
+        
+        slots: List[Tuple[str, str]] = []
+        with zipfile.ZipFile(BytesIO(file_bytes)) as zf:
+            has_header_targets = any(
+                elem_id.startswith(("header_", "footer_")) for elem_id in targets
+            )
+            header_parts = self._header_footer_parts(zf) if has_header_targets else {}
+            members = self._iter_members(zf, targets, header_parts, repeat_rows or [], slots)
+            self.store.write(template_id, key, members, slots)
+        
+        compiled = self.store.load(template_id, key)
+        if compiled is None:
+            raise RuntimeError(f"Failed to load streamed artifact for template {template_id}")
+        return compiled
+    
+    def _iter_members(self, zf: zipfile.ZipFile, targets: Dict, header_parts: Dict, repeat_rows: List, slots: List):
+        """按原顺序输出压缩包成员：正文流式编译，含映射的页眉页脚单独解析，其余原样"""
+        for info in zf.infolist():
+            if info.filename == DOCUMENT_PART:
+                yield info.filename, self._compile_document(zf, info, targets, repeat_rows, slots)
+            elif info.filename in header_parts:
+                yield info.filename, self._compile_part(
+                    zf.read(info), header_parts[info.filename], targets, slots
+                )
+            else:
+                yield info.filename, zf.read(info)
+    
+    def _compile_document(
+        self, zf: zipfile.ZipFile, info: zipfile.ZipInfo, targets: Dict, repeat_rows: List, slots: List
+    ) -> Iterator[Segment]:
+        """逐块编译正文"""
+        # 正文之前的部分（XML声明、根元素、背景等）原样输出
+        with zf.open(info) as f:
+            head = b""
+            match = None
+            while match is None:
+                chunk = f.read(64 * 1024)
+                if not chunk:
+                    raise ValueError("document.xml has no <w:body>")
+                head += chunk
+                match = BODY_START_RE.search(head)
+        root_prefix = ROOT_START_RE.search(head).group(1).decode()
+        body_prefix = match.group(1).decode()
+        yield head[:match.end()]
+        
+        table_targets: Dict[int, List[Tuple[str, Dict]]] = {}
+        for elem_id, items in targets.items():
+            m = CELL_ID_RE.match(elem_id)
+            if m:
+                table_targets.setdefault(int(m.group(1)), []).extend(items)
+        
+        table_repeats: Dict[int, List[Dict]] = {}
+        for repeat_row in repeat_rows:
+            table_repeats.setdefault(repeat_row["table_index"], []).append(repeat_row)
+        
+        para_idx = 0
+        table_idx = 0
+        ns_in_scope: Set[Tuple] = set()
+        decl_cache: Dict[str, str] = {}
+        with zf.open(info) as f:
+            for block in self._iter_body_blocks(f):
+                if not ns_in_scope:
+                    ns_in_scope = set(block.getparent().nsmap.items())
+                
+                block_repeats = None
+                if block.tag == qn("w:p"):
+                    elem_id = f"para_{para_idx}"
+                    block_targets = targets.get(elem_id)
+                    para_idx += 1
+                elif block.tag == qn("w:tbl"):
+                    elem_id = table_idx
+                    block_targets = table_targets.get(table_idx)
+                    block_repeats = table_repeats.get(table_idx)
+                    table_idx += 1
+                else:
+                    block_targets = None
+                
+                if block_targets or block_repeats:
+                    yield from self._compile_block(
+                        block, elem_id, block_targets or [], block_repeats or [], slots, ns_in_scope, decl_cache
+                    )
+                else:
+                    yield self._serialize(block, ns_in_scope, decl_cache).encode("utf-8")
+        
+        yield f"</{body_prefix}body></{root_prefix}document>".encode("utf-8")
+    
+    def _compile_block(
+        self, block, elem_id, block_targets: List, block_repeats: List, slots: List,
+        ns_in_scope: Set, decl_cache: Dict
+    ) -> List[Segment]:
+        """
+        把含映射位置或循环行的块解析为 python-docx 对象，
+        用保留格式的替换逻辑写入槽位标记，并标记循环行
+        """
+        element = parse_xml(etree.tostring(block))
+        repeat_names = []
+        if isinstance(elem_id, int):
+            table = Table(element, None)
+            element_map = {
+                cell_id: cell
+                for cell_id, cell, _ in word_service.iter_table_cells(table, elem_id)
+            }
+            self._apply_targets(element, element_map, block_targets, slots)
+            repeat_names = word_service.mark_repeat_rows([table], block_repeats, table_offset=elem_id)
+        else:
+            self._apply_targets(element, {elem_id: Paragraph(element, None)}, block_targets, slots)
+        
+        return split_segments(self._serialize(element, ns_in_scope, decl_cache), repeat_names)
+    
+    def _compile_part(self, data: bytes, owners: List[Tuple[str, int]], targets: Dict, slots: List):
+        """编译页眉页脚部件（体积小，整体解析）"""
+        root = parse_xml(data)
+        element_map = {}
+        for prefix, section_idx in owners:
+            for para_idx, p in enumerate(root.findall(qn("w:p"))):
+                element_map[f"{prefix}_{section_idx}_{para_idx}"] = Paragraph(p, None)
+        
+        part_targets = [item for elem_id in element_map for item in targets.get(elem_id, [])]
+        if not part_targets:
+            return data
+        
+        self._apply_targets(root, element_map, part_targets, slots)
+        xml = etree.tostring(root, xml_declaration=True, encoding="UTF-8", standalone=True)
+        return split_segments(xml.decode("utf-8"))
+    
+    def _apply_targets(self, element, element_map: Dict, items: List, slots: List) -> None:
+        bookmarks = word_service.bookmark_index_of(element)
+        for var_name, loc in items:
+            marker = make_slot_marker(len(slots))
+            if word_service.replace_location(element_map, bookmarks, loc, marker):
+                slots.append((var_name, loc.get("original_text", "")))
+        word_service.preserve_slot_space(element)
+    
+    def _iter_body_blocks(self, stream) -> Iterator:
+        """增量解析，逐个返回 <w:body> 的直接子元素，处理完即释放"""
+        body_tag = qn("w:body")
+        depth = 0
+        for event, elem in etree.iterparse(stream, events=("start", "end"), huge_tree=True):
+            if event == "start":
+                depth += 1
+                continue
+            
+            if depth == 3 and elem.getparent().tag == body_tag:
+                yield elem
+                parent = elem.getparent()
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del parent[0]
+            depth -= 1
+    
+    def _serialize(self, element, ns_in_scope: Set, decl_cache: Dict[str, str]) -> str:
+        """
+        序列化块，去掉根元素上已声明的命名空间（否则每个块都会重复声明）
+        
+        同一文档中各块输出的声明串几乎相同，按声明串缓存处理结果
+        """
+        xml = etree.tostring(element, encoding="unicode", with_tail=False)
+        decls = NS_DECLS_RE.search(xml, 0, xml.index(">"))
+        if decls is None:
+            return xml
+        
+        cleaned = decl_cache.get(decls.group())
+        if cleaned is None:
+            cleaned = NS_DECL_RE.sub(
+                lambda m: "" if (m.group(1), m.group(2)) in ns_in_scope else m.group(0),
+                decls.group()
+            )
+            decl_cache[decls.group()] = cleaned
+        return xml[:decls.start()] + cleaned + xml[decls.end():]
+    
+    def _header_footer_parts(self, zf: zipfile.ZipFile) -> Dict[str, List[Tuple[str, int]]]:
+        """
+        页眉页脚部件 → [(元素ID前缀, 节序号)]
+        
+        只读取各节的 sectPr，节序号和链接规则与 python-docx 的 doc.sections 一致
+        """
+        rels = etree.fromstring(zf.read(DOCUMENT_RELS))
+        rel_targets = {}
+        for rel in rels:
+            target = rel.get("Target", "")
+            rel_targets[rel.get("Id")] = (
+                target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join("word", target))
+            )
+        
+        sections = []
+        with zf.open(DOCUMENT_PART) as f:
+            for block in self._iter_body_blocks(f):
+                sect_pr = block if block.tag == qn("w:sectPr") else block.find(f"{qn('w:pPr')}/{qn('w:sectPr')}")
+                if sect_pr is not None:
+                    sections.append({
+                        (ref.tag, ref.get(qn("w:type"))): ref.get(qn("r:id"))
+                        for ref in sect_pr
+                        if ref.tag in (qn("w:headerReference"), qn("w:footerReference"))
+                    })
+        
+        parts: Dict[str, List[Tuple[str, int]]] = {}
+        for section_idx, refs in enumerate(sections):
+            for attr, prefix, elem_type in HEADER_FOOTER_PARTS:
+                ref_tag = qn("w:headerReference") if elem_type == "header" else qn("w:footerReference")
+                rel_id = refs.get((ref_tag, REFERENCE_TYPES[attr]))
+                # 没有引用即链接到上一节，与 iter_elements 一致跳过
+                if rel_id in rel_targets:
+                    parts.setdefault(rel_targets[rel_id], []).append((prefix, section_idx))
+        return parts
+
+
+# 单例
+streaming_compiler = StreamingCompiler()
@@ -0,0 +1,151 @@
+"""
+预编译模板缓存
+进程内共享、线程安全，按模板ID + 内容哈希作为键，按内存占用做LRU淘汰
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, Optional
+
+from ..config import COMPILED_CACHE_MAX_MB
+from ..models.schemas import TemplateConfig
+from .artifact_store import artifact_store, make_compiled_key
+from .compiled_template import CompiledTemplate
+from .template_service import template_service
+
+
+class CompiledTemplateCache:
+    """预编译模板缓存"""
+    
+    def __init__(self, max_bytes: int = COMPILED_CACHE_MAX_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, CompiledTemplate]" = OrderedDict()
+        self._pending: Dict[str, Future] = {}
+        self._bytes = 0
+        self._stats = {"hits": 0, "misses": 0, "compiles": 0, "disk_loads": 0, "evictions": 0}
+    
+    def get_compiled(self, config: TemplateConfig) -> Optional[CompiledTemplate]:
+        """
+        获取模板的预编译结果，未命中时编译
+        
+        多个会话同时请求同一模板时只编译一次，其余等待结果
+        """
+        key = self.cache_key(config)
+        if key is None:
+            return None
+        
+        with self._lock:
+            compiled = self._entries.get(key)
+            if compiled is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return compiled
+            
+            self._stats["misses"] += 1
+            future = self._pending.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._pending[key] = future
+        
+        if not owner:
+            return future.result()
+        
+        try:
+            compiled = self._compile(config, key)
+            future.set_result(compiled)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+        
+        self._put(key, compiled)
+        return compiled
+    
+    def cache_key(self, config: TemplateConfig) -> Optional[str]:
+        """缓存键：模板ID + 模板文件与映射的内容哈希"""
+        content_hash = template_service.get_content_hash(config.template_id)
+        if content_hash is None:
+            return None
+        return make_compiled_key(config.template_id, content_hash, config.get_mapping())
+    
+    def warm_up(self, limit: int) -> int:
+        """预热使用次数最多的模板，返回预热数量"""
+        templates = sorted(
+            template_service.list_templates(),
+            key=lambda t: t.usage_count,
+            reverse=True
+        )
+        warmed = 0
+        for config in templates[:limit]:
+            if config.usage_count <= 0:
+                break
+            try:
+                if self.get_compiled(config) is not None:
+                    warmed += 1
+            except Exception as e:
+                print(f"Warm-up failed for template {config.template_id}: {e}")
+        return warmed
+    
+    def warm_up_async(self, limit: int) -> threading.Thread:
+        """后台线程预热，不阻塞启动"""
+        thread = threading.Thread(target=self.warm_up, args=(limit,), daemon=True)
+        thread.start()
+        return thread
+    
+    def invalidate(self, template_id: str) -> None:
+        """移除某个模板的所有缓存"""
+        with self._lock:
+            for key in [k for k in self._entries if k.startswith(f"{template_id}:")]:
+                self._bytes -= self._entries.pop(key).size
+    
+    def clear(self) -> None:
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+    
+    def stats(self) -> Dict[str, int]:
+        """命中/未命中等统计"""
+        with self._lock:
+            return dict(
+                self._stats,
+                entries=len(self._entries),
+                bytes=self._bytes,
+                max_bytes=self.max_bytes
+            )
+    
+    def _compile(self, config: TemplateConfig, key: str) -> CompiledTemplate:
+        """优先加载磁盘上的预编译文件，缺失或失效时编译并写回磁盘"""
+        compiled = artifact_store.load(config.template_id, key)
+        if compiled is not None:
+            with self._lock:
+                self._stats["disk_loads"] += 1
+            return compiled
+        
+        template_bytes = template_service.get_template_bytes(config.template_id)
+        compiled = template_service.compile_artifact(config, template_bytes, key)
+        
+        with self._lock:
+            self._stats["compiles"] += 1
+        return compiled
+    
+    def _put(self, key: str, compiled: CompiledTemplate) -> None:
+        """写入缓存并按内存上限淘汰最久未用的条目"""
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = compiled
+            self._bytes += compiled.size
+            
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+                self._stats["evictions"] += 1
+
+
+# 单例
+template_cache = CompiledTemplateCache()
@@ -2,21 +2,44 @@
 模板管理服务
 支持位置映射模式：精确记录变量位置，避免全文替换错误
 """
-import json
 import uuid
 from pathlib import Path
 from typing import Dict, List, Optional
 
-from ..config import TEMPLATES_DIR, CONFIGS_DIR
+from ..config import TEMPLATES_DIR, CONFIGS_DIR, TEMPLATE_STORE_BACKEND, TEMPLATE_DB_PATH
 from ..models.schemas import TemplateConfig
+from .artifact_store import artifact_store, make_compiled_key
+from .blob_store import content_hash_of
+from .compiled_template import CompiledTemplate
+from .streaming_compiler import streaming_compiler
+from .template_store import JsonTemplateStore, SqliteTemplateStore
+from .word_service import word_service
+
+
+def create_template_store(backend: str = TEMPLATE_STORE_BACKEND):
+    """
+    创建模板存储后端
+    
+    首次启用SQLite时自动导入已有的JSON模板
+    """
+    json_store = JsonTemplateStore(CONFIGS_DIR, TEMPLATES_DIR)
+    if backend != "sqlite":
+        return json_store
+    
+    is_new = not TEMPLATE_DB_PATH.exists()
+    sqlite_store = SqliteTemplateStore(TEMPLATE_DB_PATH)
+    if is_new:
+        sqlite_store.import_from(json_store)
+    return sqlite_store
 
 
 class TemplateService:
     """模板管理服务"""
     
-    def __init__(self):
+    def __init__(self, store=None):
         self.templates_dir = TEMPLATES_DIR
         self.configs_dir = CONFIGS_DIR
+        self.store = store or create_template_store()
     
     def create_location_template(
         self,
@@ -24,12 +47,20 @@ class TemplateService:
         original_filename: str,
         docx_bytes: bytes,
         location_mapping: Dict[str, Dict],  # {变量名: {element_id, start, end, length, original_text}}
-        description: str = ""
+        description: str = "",
+        optimize: bool = False,
+        bind: bool = False,
+        repeat_rows: Optional[List[Dict]] = None
     ) -> TemplateConfig:
         """
         创建位置映射模式模板
         
         Args:
+            optimize: 保存前规范化模板（合并碎片run、去除rsid和拼写标记）
+            bind: 用隐藏书签绑定映射位置，生成时按书签直接定位
+                  （绑定后文件内容随映射变化，不同映射的版本不再共享同一文件）
+            repeat_rows: 循环行 [{"name", "table_index", "row_index"}]，
+                         位于循环行中的变量从明细表逐条取值
             location_mapping: 位置映射
                 {
                     "姓名": {
@@ -42,12 +73,16 @@ class TemplateService:
                     }
                 }
         """
+        source_hash = content_hash_of(docx_bytes)
+        if optimize:
+            docx_bytes, location_mapping, _ = word_service.normalize_template(
+                docx_bytes, location_mapping
+            )
+        if bind:
+            docx_bytes, location_mapping = word_service.bind_bookmarks(docx_bytes, location_mapping)
+        
         template_id = str(uuid.uuid4())[:8]
         template_filename = f"{template_id}_{original_filename}"
-        template_path = self.templates_dir / template_filename
-        
-        with open(template_path, "wb") as f:
-            f.write(docx_bytes)
         
         config = TemplateConfig(
             template_id=template_id,
@@ -55,39 +90,110 @@ class TemplateService:
             original_filename=original_filename,
             template_filename=template_filename,
             location_mapping=location_mapping,
-            description=description
+            description=description,
+            content_hash=content_hash_of(docx_bytes),
+            source_hash=source_hash,
+            repeat_rows=repeat_rows or []
         )
         
-        self.save_config(config)
+        # 模板文件按内容寻址，同一文件重新上传（修改映射）不会重复存储
+        self.store.save_template(config, docx_bytes)
+        self.precompile(config, docx_bytes)
         return config
     
+    def precompile(self, config: TemplateConfig, docx_bytes: bytes) -> bool:
+        """
+        保存时写入预编译文件，之后任何进程都可直接加载
+        
+        失败不影响保存，首次生成时会重新编译
+        """
+        key = make_compiled_key(
+            config.template_id,
+            config.content_hash or content_hash_of(docx_bytes),
+            config.get_mapping()
+        )
+        try:
+            self.compile_artifact(config, docx_bytes, key)
+            return True
+        except Exception as e:
+            print(f"Precompile failed for template {config.template_id}: {e}")
+            return False
+    
+    def create_jinja_template(
+        self,
+        template_name: str,
+        original_filename: str,
+        docx_bytes: bytes,
+        description: str = ""
+    ) -> TemplateConfig:
+        """
+        创建Jinja模板（docxtpl {{ 变量 }} 语法，支持条件和循环）
+        
+        变量从模板中识别，Excel列按变量名映射
+        
+        Raises:
+            ValueError: 模板中没有 {{ }} 语法或没有需要提供的变量
+            jinja2.TemplateSyntaxError: 模板语法错误
+        """
+        variables = word_service.scan_jinja_variables(docx_bytes)
+        if not variables:
+            raise ValueError("模板中没有 {{ 变量 }}")
+        
+        template_id = str(uuid.uuid4())[:8]
+        config = TemplateConfig(
+            template_id=template_id,
+            template_name=template_name,
+            original_filename=original_filename,
+            template_filename=f"{template_id}_{original_filename}",
+            description=description,
+            content_hash=content_hash_of(docx_bytes),
+            source_hash=content_hash_of(docx_bytes),
+            jinja_variables=variables
+        )
+        
+        self.store.save_template(config, docx_bytes)
+        self.precompile(config, docx_bytes)
+        return config
+    
+    def compile_artifact(self, config: TemplateConfig, docx_bytes: bytes, key: str) -> CompiledTemplate:
+        """
+        编译模板并写入预编译文件
+        
+        大模板流式编译，结果直接写入磁盘并通过 mmap 加载；
+        其余模板在内存中编译，写入失败不影响返回结果
+        """
+        mapping_info = config.get_mapping()
+        if mapping_info["type"] == "jinja":
+            # 编译结果是Jinja代码对象，不写入预编译文件，进程内缓存复用
+            return word_service.compile_jinja_template(docx_bytes, key=key)
+        if streaming_compiler.should_stream(docx_bytes, mapping_info):
+            return streaming_compiler.compile_to_artifact(
+                config.template_id, docx_bytes, mapping_info["data"], key,
+                repeat_rows=mapping_info.get("repeats")
+            )
+        
+        compiled = word_service.compile_config(config, docx_bytes, key=key)
+        try:
+            artifact_store.save(config.template_id, compiled)
+        except OSError as e:
+            print(f"Failed to persist compiled template {config.template_id}: {e}")
+        return compiled
+    
     def save_config(self, config: TemplateConfig) -> None:
         """保存模板配置"""
-        config_path = self.configs_dir / f"{config.template_id}.json"
-        with open(config_path, "w", encoding="utf-8") as f:
-            json.dump(config.to_dict(), f, ensure_ascii=False, indent=2)
+        self.store.save_config(config)
     
     def load_config(self, template_id: str) -> Optional[TemplateConfig]:
         """加载模板配置"""
-        config_path = self.configs_dir / f"{template_id}.json"
-        if not config_path.exists():
-            return None
-        
-        with open(config_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        
-        return TemplateConfig.from_dict(data)
+        return self.store.load_config(template_id)
     
     def list_templates(self) -> List[TemplateConfig]:
-        """列出所有模板"""
-        templates = []
-        for config_file in self.configs_dir.glob("*.json"):
-            with open(config_file, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            templates.append(TemplateConfig.from_dict(data))
-        
-        templates.sort(key=lambda x: x.updated_at, reverse=True)
-        return templates
+        """列出所有模板（按更新时间倒序）"""
+        return self.store.list_configs()
+    
+    def count_templates(self) -> int:
+        """模板数量"""
+        return self.store.count()
     
     def delete_template(self, template_id: str) -> bool:
         """删除模板"""
@@ -95,34 +201,41 @@ class TemplateService:
         if not config:
             return False
         
-        template_path = self.templates_dir / config.template_filename
-        if template_path.exists():
-            template_path.unlink()
-        
-        config_path = self.configs_dir / f"{template_id}.json"
-        if config_path.exists():
-            config_path.unlink()
-        
+        self.store.delete(config)
+        artifact_store.remove(template_id)
         return True
     
+    def record_usage(self, template_id: str) -> None:
+        """记录一次模板使用（用于缓存预热排序）"""
+        self.store.increment_usage(template_id)
+    
     def get_template_path(self, template_id: str) -> Optional[Path]:
-        """获取模板文件路径"""
+        """获取模板文件路径（SQLite后端没有独立文件，返回None）"""
         config = self.load_config(template_id)
         if not config:
             return None
-        
-        template_path = self.templates_dir / config.template_filename
-        if template_path.exists():
-            return template_path
-        return None
+        return self.store.file_path(config)
     
     def get_template_bytes(self, template_id: str) -> Optional[bytes]:
         """获取模板文件二进制"""
-        path = self.get_template_path(template_id)
-        if path:
-            with open(path, "rb") as f:
-                return f.read()
-        return None
+        config = self.load_config(template_id)
+        if not config:
+            return None
+        return self.store.read_file(config)
+    
+    def find_versions(self, content_hash: str) -> List[TemplateConfig]:
+        """使用同一模板文件（存储文件或上传的原始文件）的所有模板（按更新时间倒序）"""
+        return [
+            c for c in self.store.list_configs()
+            if content_hash in (c.content_hash, c.source_hash)
+        ]
+    
+    def get_content_hash(self, template_id: str) -> Optional[str]:
+        """获取模板文件内容哈希"""
+        config = self.load_config(template_id)
+        if not config:
+            return None
+        return self.store.content_hash(config)
 
 
 # 单例
@@ -0,0 +1,409 @@
+"""
+模板存储后端
+- JsonTemplateStore: 每个模板一个JSON配置，模板文件按内容哈希存放（默认）
+- SqliteTemplateStore: SQLite（WAL模式）保存配置、使用次数和模板文件，事务化读写
+
+模板文件按内容寻址：相同文件只存一份，引用计数归零时删除
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from ..config import REGISTRY_MTIME_SLACK, SQLITE_BUSY_TIMEOUT_MS
+from ..models.schemas import TemplateConfig
+from .blob_store import FileBlobStore, content_hash_of
+
+
+class JsonTemplateStore:
+    """JSON文件存储"""
+    
+    def __init__(self, configs_dir: Path, templates_dir: Path, blob_store: Optional[FileBlobStore] = None):
+        self.configs_dir = configs_dir
+        self.templates_dir = templates_dir
+        self.blobs = blob_store or FileBlobStore()
+        
+        # 模板注册表：进程内缓存，以配置目录的修改时间判断是否失效
+        self._lock = threading.RLock()
+        self._registry: Dict[str, TemplateConfig] = {}
+        self._sorted: List[TemplateConfig] = []
+        self._registry_mtime: Optional[int] = None
+        # 路径 → (修改时间, 大小, 内容哈希)，文件未变化时不重新读取计算
+        self._hash_memo: Dict[str, Tuple[int, int, str]] = {}
+    
+    def save_template(self, config: TemplateConfig, docx_bytes: bytes) -> None:
+        """
+        保存模板文件（相同内容已存在时不重复写入）和配置
+        
+        写入文件、保存配置与清理旧文件在同一把锁内完成，
+        避免并发删除其他模板时在配置保存前看到引用计数为0而删掉刚写入的文件
+        """
+        with self._lock:
+            previous = self.load_config(config.template_id)
+            config.content_hash = self.blobs.put(docx_bytes, config.content_hash or None)
+            self.save_config(config)
+            
+            # 覆盖保存且文件已变化：旧文件无引用时删除
+            if previous and previous.content_hash and previous.content_hash != config.content_hash:
+                if self.ref_count(previous.content_hash) == 0:
+                    self.blobs.delete(previous.content_hash)
+    
+    def save_config(self, config: TemplateConfig) -> None:
+        """保存模板配置（先写临时文件再原子替换，读取方不会看到半截JSON）"""
+        config_path = self.configs_dir / f"{config.template_id}.json"
+        tmp_path = self.configs_dir / f".{config.template_id}.json.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(config.to_dict(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, config_path)
+        
+        with self._lock:
+            self._registry[config.template_id] = config
+            self._rebuild_sorted()
+    
+    def load_config(self, template_id: str) -> Optional[TemplateConfig]:
+        with self._lock:
+            self._refresh_registry()
+            return self._registry.get(template_id)
+    
+    def list_configs(self) -> List[TemplateConfig]:
+        with self._lock:
+            self._refresh_registry()
+            return list(self._sorted)
+    
+    def count(self) -> int:
+        with self._lock:
+            self._refresh_registry()
+            return len(self._registry)
+    
+    def delete(self, config: TemplateConfig) -> None:
+        config_path = self.configs_dir / f"{config.template_id}.json"
+        with self._lock:
+            if config_path.exists():
+                config_path.unlink()
+            
+            self._registry.pop(config.template_id, None)
+            self._rebuild_sorted()
+            
+            if config.content_hash:
+                # 引用计数由配置推导，不会因进程崩溃与实际引用不一致
+                if self.ref_count(config.content_hash) == 0:
+                    self.blobs.delete(config.content_hash)
+            else:
+                template_path = self.templates_dir / config.template_filename
+                if template_path.exists():
+                    template_path.unlink()
+    
+    def ref_count(self, content_hash: str) -> int:
+        """引用该模板文件的模板数量"""
+        return len(self.find_by_hash(content_hash))
+    
+    def find_by_hash(self, content_hash: str) -> List[TemplateConfig]:
+        """使用同一模板文件的所有模板（版本）"""
+        return [c for c in self.list_configs() if c.content_hash == content_hash]
+    
+    def increment_usage(self, template_id: str) -> None:
+        with self._lock:
+            config = self.load_config(template_id)
+            if config:
+                config.usage_count += 1
+                self.save_config(config)
+    
+    def file_path(self, config: TemplateConfig) -> Optional[Path]:
+        if config.content_hash:
+            template_path = self.blobs.path(config.content_hash)
+        else:
+            template_path = self.templates_dir / config.template_filename
+        if template_path.exists():
+            return template_path
+        return None
+    
+    def read_file(self, config: TemplateConfig) -> Optional[bytes]:
+        path = self.file_path(config)
+        if path:
+            with open(path, "rb") as f:
+                return f.read()
+        return None
+    
+    def content_hash(self, config: TemplateConfig) -> Optional[str]:
+        """模板文件内容哈希（旧模板按文件状态缓存计算）"""
+        if config.content_hash:
+            return config.content_hash if self.blobs.exists(config.content_hash) else None
+        
+        path = self.file_path(config)
+        if path is None:
+            return None
+        
+        stat = path.stat()
+        memo = self._hash_memo.get(str(path))
+        if memo and memo[:2] == (stat.st_mtime_ns, stat.st_size):
+            return memo[2]
+        
+        with open(path, "rb") as f:
+            content_hash = hashlib.sha256(f.read()).hexdigest()
+        self._hash_memo[str(path)] = (stat.st_mtime_ns, stat.st_size, content_hash)
+        return content_hash
+    
+    def _refresh_registry(self) -> None:
+        """
+        配置目录有变化时重新加载注册表
+        
+        新建/删除/替换配置文件都会更新目录修改时间，未变化时直接使用缓存。
+        目录刚修改过（在时间戳精度内）时不信任缓存，下次继续检查。
+        """
+        dir_mtime = os.stat(self.configs_dir).st_mtime_ns
+        if dir_mtime == self._registry_mtime:
+            return
+        
+        registry = {}
+        for config_file in self.configs_dir.glob("*.json"):
+            with open(config_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            config = TemplateConfig.from_dict(data)
+            registry[config.template_id] = config
+        
+        self._registry = registry
+        self._rebuild_sorted()
+        
+        if time.time_ns() - dir_mtime > REGISTRY_MTIME_SLACK * 1_000_000_000:
+            self._registry_mtime = dir_mtime
+        else:
+            self._registry_mtime = None
+    
+    def _rebuild_sorted(self) -> None:
+        """更新按时间排序的列表"""
+        self._sorted = sorted(self._registry.values(), key=lambda x: x.updated_at, reverse=True)
+
+
+class SqliteTemplateStore:
+    """
+    SQLite存储
+    
+    WAL模式下读写互不阻塞；保存/删除在单个事务内完成，不会读到半截数据。
+    每次写入递增 revision，列表缓存只需一次主键查询即可判断是否失效（跨进程有效）。
+    """
+    
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS templates (
+        template_id   TEXT PRIMARY KEY,
+        template_name TEXT NOT NULL,
+        updated_at    TEXT NOT NULL,
+        usage_count   INTEGER NOT NULL DEFAULT 0,
+        config        TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_templates_name ON templates(template_name);
+    CREATE INDEX IF NOT EXISTS idx_templates_updated ON templates(updated_at);
+    CREATE TABLE IF NOT EXISTS template_files (
+        template_id  TEXT PRIMARY KEY,
+        content_hash TEXT NOT NULL,
+        data         BLOB NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS blobs (
+        content_hash TEXT PRIMARY KEY,
+        refcount     INTEGER NOT NULL,
+        data         BLOB NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS meta (
+        key   TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    );
+    INSERT OR IGNORE INTO meta(key, value) VALUES ('revision', 0);
+    """
+    
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._cached_revision: Optional[int] = None
+        self._cached_list: List[TemplateConfig] = []
+        
+        conn = self._conn()
+        conn.executescript(self.SCHEMA)
+    
+    def save_template(self, config: TemplateConfig, docx_bytes: bytes) -> None:
+        """
+        配置和模板文件在同一事务中写入
+        
+        相同内容的文件只保存一份，引用计数加一（覆盖保存同一模板时不重复计数）
+        """
+        config.content_hash = config.content_hash or content_hash_of(docx_bytes)
+        conn = self._conn()
+        with conn:
+            previous = conn.execute(
+                "SELECT config FROM templates WHERE template_id = ?", (config.template_id,)
+            ).fetchone()
+            previous_hash = json.loads(previous[0]).get("content_hash", "") if previous else ""
+            
+            if previous_hash != config.content_hash:
+                conn.execute(
+                    "INSERT OR IGNORE INTO blobs(content_hash, refcount, data) VALUES (?, 0, ?)",
+                    (config.content_hash, docx_bytes)
+                )
+                conn.execute(
+                    "UPDATE blobs SET refcount = refcount + 1 WHERE content_hash = ?",
+                    (config.content_hash,)
+                )
+                if previous_hash:
+                    self._release_blob(conn, previous_hash)
+            
+            self._upsert_config(conn, config)
+    
+    def save_config(self, config: TemplateConfig) -> None:
+        conn = self._conn()
+        with conn:
+            self._upsert_config(conn, config)
+    
+    def load_config(self, template_id: str) -> Optional[TemplateConfig]:
+        row = self._conn().execute(
+            "SELECT config, usage_count FROM templates WHERE template_id = ?", (template_id,)
+        ).fetchone()
+        return self._to_config(row) if row else None
+    
+    def list_configs(self) -> List[TemplateConfig]:
+        """按更新时间倒序列出，revision 未变化时直接返回缓存"""
+        conn = self._conn()
+        revision = self._revision(conn)
+        with self._lock:
+            if revision == self._cached_revision:
+                return list(self._cached_list)
+        
+        rows = conn.execute(
+            "SELECT config, usage_count FROM templates ORDER BY updated_at DESC"
+        ).fetchall()
+        configs = [self._to_config(row) for row in rows]
+        
+        with self._lock:
+            self._cached_revision = revision
+            self._cached_list = configs
+        return list(configs)
+    
+    def find_by_name(self, template_name: str) -> List[TemplateConfig]:
+        """按名称查询（索引）"""
+        rows = self._conn().execute(
+            "SELECT config, usage_count FROM templates WHERE template_name = ? ORDER BY updated_at DESC",
+            (template_name,)
+        ).fetchall()
+        return [self._to_config(row) for row in rows]
+    
+    def count(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM templates").fetchone()[0]
+    
+    def delete(self, config: TemplateConfig) -> None:
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM templates WHERE template_id = ?", (config.template_id,))
+            conn.execute("DELETE FROM template_files WHERE template_id = ?", (config.template_id,))
+            if config.content_hash:
+                self._release_blob(conn, config.content_hash)
+            self._bump_revision(conn)
+    
+    def ref_count(self, content_hash: str) -> int:
+        """引用该模板文件的模板数量"""
+        row = self._conn().execute(
+            "SELECT refcount FROM blobs WHERE content_hash = ?", (content_hash,)
+        ).fetchone()
+        return row[0] if row else 0
+    
+    def find_by_hash(self, content_hash: str) -> List[TemplateConfig]:
+        """使用同一模板文件的所有模板（版本）"""
+        return [c for c in self.list_configs() if c.content_hash == content_hash]
+    
+    def increment_usage(self, template_id: str) -> None:
+        """原子递增，并发生成时不会丢失计数"""
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "UPDATE templates SET usage_count = usage_count + 1 WHERE template_id = ?",
+                (template_id,)
+            )
+            self._bump_revision(conn)
+    
+    def file_path(self, config: TemplateConfig) -> Optional[Path]:
+        """SQLite后端没有独立的模板文件"""
+        return None
+    
+    def read_file(self, config: TemplateConfig) -> Optional[bytes]:
+        if config.content_hash:
+            row = self._conn().execute(
+                "SELECT data FROM blobs WHERE content_hash = ?", (config.content_hash,)
+            ).fetchone()
+        else:
+            row = self._conn().execute(
+                "SELECT data FROM template_files WHERE template_id = ?", (config.template_id,)
+            ).fetchone()
+        return bytes(row[0]) if row else None
+    
+    def content_hash(self, config: TemplateConfig) -> Optional[str]:
+        if config.content_hash:
+            return config.content_hash
+        row = self._conn().execute(
+            "SELECT content_hash FROM template_files WHERE template_id = ?", (config.template_id,)
+        ).fetchone()
+        return row[0] if row else None
+    
+    def import_from(self, source: JsonTemplateStore) -> int:
+        """从JSON存储导入全部模板（已存在的跳过），返回导入数量"""
+        imported = 0
+        for config in source.list_configs():
+            if self.load_config(config.template_id):
+                continue
+            docx_bytes = source.read_file(config)
+            if docx_bytes is None:
+                continue
+            self.save_template(config, docx_bytes)
+            imported += 1
+        return imported
+    
+    def _conn(self) -> sqlite3.Connection:
+        """每个线程一个连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+            self._local.conn = conn
+        return conn
+    
+    def _upsert_config(self, conn: sqlite3.Connection, config: TemplateConfig) -> None:
+        conn.execute(
+            """
+            INSERT INTO templates(template_id, template_name, updated_at, usage_count, config)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(template_id) DO UPDATE SET
+                template_name = excluded.template_name,
+                updated_at = excluded.updated_at,
+                config = excluded.config
+            """,
+            (
+                config.template_id,
+                config.template_name,
+                config.updated_at,
+                config.usage_count,
+                json.dumps(config.to_dict(), ensure_ascii=False)
+            )
+        )
+        self._bump_revision(conn)
+    
+    def _release_blob(self, conn: sqlite3.Connection, content_hash: str) -> None:
+        """引用计数减一，归零时删除文件内容"""
+        conn.execute(
+            "UPDATE blobs SET refcount = refcount - 1 WHERE content_hash = ?", (content_hash,)
+        )
+        conn.execute(
+            "DELETE FROM blobs WHERE content_hash = ? AND refcount <= 0", (content_hash,)
+        )
+    
+    def _bump_revision(self, conn: sqlite3.Connection) -> None:
+        conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'revision'")
+    
+    def _revision(self, conn: sqlite3.Connection) -> int:
+        return conn.execute("SELECT value FROM meta WHERE key = 'revision'").fetchone()[0]
+    
+    def _to_config(self, row) -> TemplateConfig:
+        config = TemplateConfig.from_dict(json.loads(row[0]))
+        config.usage_count = row[1]
+        return config
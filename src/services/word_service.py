@@ -2,18 +2,175 @@
 Word文档处理服务
 重点：保留原始格式进行替换
 """
+import copy
+import zipfile
 from io import BytesIO
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, Iterator, List, Tuple, Optional
 from docx import Document
+from docxtpl import DocxTemplate
 from docx.oxml.ns import qn
+from docx.oxml.simpletypes import ST_Merge
+from docx.table import _Cell
 from docx.oxml import OxmlElement
+from docx.text.paragraph import Paragraph
+from docx.text.run import Run
 from lxml import etree
 import re
 
+from ..config import IMAGE_DEFAULT_WIDTH_CM, PLACEHOLDER_PATTERN
+from ..models.schemas import group_locations, iter_locations
+from ..utils import safe_filename, unique_path
+from .image_loader import ImageLoader
+from .compiled_template import (
+    CompiledTemplate, REPEAT_CLOSE, REPEAT_MARK, REPEAT_OPEN, SLOT_OPEN,
+    cm_to_emu, find_slot_ids, make_slot_marker, split_segments
+)
+from .jinja_template import (
+    CompiledJinjaTemplate, JINJA_TAG_RE, JinjaPart, XML_DECLARATION,
+    compile_jinja_source, create_jinja_env, needs_tree_fix
+)
+
+
+PLACEHOLDER_RE = re.compile(PLACEHOLDER_PATTERN)
+
+# 需要规范化的正文类部件
+CONTENT_PART_RE = re.compile(r"^word/(document|header\d*|footer\d*|footnotes|endnotes)\.xml$")
+
+# 只包含这些子元素的run可以安全合并（纯文本类内容）
+MERGEABLE_RUN_CHILDREN = {qn("w:t"), qn("w:tab"), qn("w:br"), qn("w:noBreakHyphen"), qn("w:softHyphen")}
+
+# 变量绑定书签的名称前缀（下划线开头的书签在Word中默认隐藏）
+BOOKMARK_PREFIX = "_tplv_"
+
+# 图片变量：图片格式的内容类型（按扩展名登记到 [Content_Types].xml）
+CONTENT_TYPES_PART = "[Content_Types].xml"
+IMAGE_CONTENT_TYPES = {
+    "png": "image/png",
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "gif": "image/gif",
+    "bmp": "image/bmp",
+    "tiff": "image/tiff",
+}
+EMPTY_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">{}</Relationships>'
+)
+
+# 页眉页脚：(section属性名, 元素ID前缀, 元素类型)
+HEADER_FOOTER_PARTS = [
+    ("header", "header", "header"),
+    ("first_page_header", "header_first", "header"),
+    ("even_page_header", "header_even", "header"),
+    ("footer", "footer", "footer"),
+    ("first_page_footer", "footer_first", "footer"),
+    ("even_page_footer", "footer_even", "footer"),
+]
+
 
 class WordService:
     """Word文档处理服务"""
     
+    def iter_elements(self, doc, include_aliases: bool = True) -> Iterator[Tuple[str, str, object]]:
+        """
+        遍历文档中所有可映射元素
+        
+        元素ID规则：
+            para_{段落}                 正文段落
+            cell_{表格}_{行}_{列}        正文表格单元格
+            header_{节}_{段落}           页眉段落（header_first_/header_even_ 为首页/偶数页）
+            footer_{节}_{段落}           页脚段落（footer_first_/footer_even_ 同上）
+        
+        Args:
+            include_aliases: 是否包含合并单元格的别名ID（替换时需要，兼容已有映射；
+                             展示和扫描时不需要，避免同一单元格重复出现）
+        
+        Yields:
+            (元素ID, 元素类型, Paragraph 或 _Cell)
+        """
+        for para_idx, para in enumerate(doc.paragraphs):
+            yield f"para_{para_idx}", "paragraph", para
+        
+        for table_idx, table in enumerate(doc.tables):
+            for cell_id, cell, is_alias in self.iter_table_cells(table, table_idx):
+                if include_aliases or not is_alias:
+                    yield cell_id, "table_cell", cell
+        
+        for section_idx, section in enumerate(doc.sections):
+            for attr, prefix, elem_type in HEADER_FOOTER_PARTS:
+                part = getattr(section, attr)
+                # 链接到上一节的页眉页脚没有独立内容，跳过避免重复
+                if part.is_linked_to_previous:
+                    continue
+                for para_idx, para in enumerate(part.paragraphs):
+                    yield f"{prefix}_{section_idx}_{para_idx}", elem_type, para
+    
+    def iter_table_cells(self, table, table_idx: int) -> Iterator[Tuple[str, object, bool]]:
+        """
+        直接遍历 w:tr/w:tc 生成单元格索引，一次线性扫描
+        
+        编号与 python-docx 的 row.cells 一致（横向合并的单元格每个网格列各占一个编号，
+        纵向合并的后续行指向起始单元格），但不逐行重新计算表格网格。
+        单元格在起始网格列、起始行的编号为主ID，其余编号为别名。
+        
+        Yields:
+            (元素ID, _Cell, 是否为别名)
+        """
+        above: Dict[int, _Cell] = {}
+        for row_idx, tr in enumerate(table._tbl.tr_lst):
+            grid_col = tr.grid_before
+            cell_idx = 0
+            row_cells: Dict[int, _Cell] = {}
+            
+            for tc in tr.tc_lst:
+                span = tc.grid_span
+                merged_cell = above.get(grid_col) if tc.vMerge == ST_Merge.CONTINUE else None
+                cell = merged_cell or _Cell(tc, table)
+                
+                for offset in range(span):
+                    row_cells[grid_col + offset] = cell
+                    yield f"cell_{table_idx}_{row_idx}_{cell_idx}", cell, merged_cell is not None or offset > 0
+                    cell_idx += 1
+                grid_col += span
+            
+            above = row_cells
+    
+    def scan_placeholders(self, file_bytes: bytes) -> Dict[str, object]:
+        """
+        扫描文档中所有【变量名】占位符，生成位置映射
+        
+        一次遍历正文、表格、页眉页脚；按元素完整文本匹配，
+        因此Word把占位符拆分到多个run中也能识别。
+        
+        Returns:
+            {变量名: 位置} ，同一变量出现多次时值为位置列表
+        """
+        doc = Document(BytesIO(file_bytes))
+        occurrences: Dict[str, List[Dict]] = {}
+        
+        for elem_id, elem_type, element in self.iter_elements(doc, include_aliases=False):
+            text = element.text
+            if "【" not in text:
+                continue
+            
+            for m in PLACEHOLDER_RE.finditer(text):
+                var_name = m.group(1).strip()
+                if not var_name:
+                    continue
+                occurrences.setdefault(var_name, []).append({
+                    "element_id": elem_id,
+                    "element_type": elem_type,
+                    "start": m.start(),
+                    "end": m.end(),
+                    "length": m.end() - m.start(),
+                    "original_text": m.group()
+                })
+        
+        return {
+            var_name: locs[0] if len(locs) == 1 else locs
+            for var_name, locs in occurrences.items()
+        }
+    
     def replace_preserving_format(
         self,
         file_bytes: bytes,
@@ -30,17 +187,9 @@ class WordService:
         element_map = {}
         element_texts = {}
         
-        for para_idx, para in enumerate(doc.paragraphs):
-            elem_id = f"para_{para_idx}"
-            element_map[elem_id] = para
-            element_texts[elem_id] = para.text
-        
-        for table_idx, table in enumerate(doc.tables):
-            for row_idx, row in enumerate(table.rows):
-                for cell_idx, cell in enumerate(row.cells):
-                    elem_id = f"cell_{table_idx}_{row_idx}_{cell_idx}"
-                    element_map[elem_id] = cell
-                    element_texts[elem_id] = cell.text
+        for elem_id, _, element in self.iter_elements(doc):
+            element_map[elem_id] = element
+            element_texts[elem_id] = element.text
         
         # 构建位置映射
         if location_mapping:
@@ -50,28 +199,540 @@ class WordService:
         else:
             final_mapping = {}
         
-        # 执行替换
-        for var_name, new_value in mapping.items():
-            if var_name not in final_mapping:
+        bookmarks = self._bookmark_index(doc)
+        
+        # 执行替换：逐元素从后往前，同一变量的多处出现一次遍历完成
+        for items in group_locations(final_mapping).values():
+            for var_name, loc in items:
+                if var_name in mapping:
+                    self.replace_location(element_map, bookmarks, loc, mapping[var_name])
+        
+        output = BytesIO()
+        doc.save(output)
+        output.seek(0)
+        return output.getvalue()
+    
+    def normalize_template(
+        self,
+        file_bytes: bytes,
+        location_mapping: Optional[Dict[str, Dict]] = None
+    ) -> Tuple[bytes, Dict[str, Dict], Dict[str, int]]:
+        """
+        规范化模板：合并格式相同的相邻run，去除 rsid* 属性和拼写检查标记
+        
+        Word在编辑过程中会把文本切成大量碎片run，规范化后大多数变量落在单个run内，
+        替换更快，生成的文档也更小。段落文本不变，位置映射随之校验/修正。
+        
+        Returns:
+            (规范化后的docx, 位置映射, 统计信息)
+        """
+        stats = {"runs_before": 0, "runs_after": 0, "proof_marks": 0, "rsid_attrs": 0}
+        output = BytesIO()
+        
+        with zipfile.ZipFile(BytesIO(file_bytes)) as src, \
+                zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as dst:
+            for info in src.infolist():
+                data = src.read(info)
+                if CONTENT_PART_RE.match(info.filename):
+                    root = etree.fromstring(data)
+                    self._normalize_part(root, stats)
+                    data = etree.tostring(root, xml_declaration=True, encoding="UTF-8", standalone=True)
+                dst.writestr(info, data)
+        
+        normalized = output.getvalue()
+        mapping = self.rebase_location_mapping(normalized, location_mapping or {})
+        return normalized, mapping, stats
+    
+    def _normalize_part(self, root, stats: Dict[str, int]) -> None:
+        """规范化单个XML部件"""
+        for proof in root.findall(".//" + qn("w:proofErr")):
+            proof.getparent().remove(proof)
+            stats["proof_marks"] += 1
+        
+        rsid_prefix = qn("w:rsid")
+        for elem in root.iter():
+            for attr in [a for a in elem.attrib if a.startswith(rsid_prefix)]:
+                del elem.attrib[attr]
+                stats["rsid_attrs"] += 1
+        
+        runs = root.findall(".//" + qn("w:r"))
+        stats["runs_before"] += len(runs)
+        
+        for run in runs:
+            if run.getparent() is None:
                 continue
-            
-            loc = final_mapping[var_name]
-            elem_id = loc["element_id"]
-            
-            if elem_id not in element_map:
+            self._merge_following_runs(run)
+        
+        stats["runs_after"] += len(root.findall(".//" + qn("w:r")))
+    
+    def _merge_following_runs(self, run) -> None:
+        """把紧随其后、格式相同的纯文本run合并进当前run"""
+        if not self._is_mergeable_run(run):
+            return
+        
+        run_format = self._run_format_key(run)
+        nxt = run.getnext()
+        while nxt is not None and nxt.tag == qn("w:r") and self._is_mergeable_run(nxt) \
+                and self._run_format_key(nxt) == run_format:
+            for child in list(nxt):
+                if child.tag != qn("w:rPr"):
+                    run.append(child)
+            nxt.getparent().remove(nxt)
+            nxt = run.getnext()
+        
+        # 合并相邻的 <w:t>
+        prev_t = None
+        for child in list(run):
+            if child.tag == qn("w:t"):
+                if prev_t is not None:
+                    prev_t.text = (prev_t.text or "") + (child.text or "")
+                    prev_t.set(qn("xml:space"), "preserve")
+                    run.remove(child)
+                    continue
+                prev_t = child
+            else:
+                prev_t = None
+    
+    def _is_mergeable_run(self, run) -> bool:
+        return all(
+            child.tag == qn("w:rPr") or child.tag in MERGEABLE_RUN_CHILDREN
+            for child in run
+        )
+    
+    def _run_format_key(self, run) -> bytes:
+        rpr = run.find(qn("w:rPr"))
+        return etree.tostring(rpr) if rpr is not None else b""
+    
+    def rebase_location_mapping(
+        self,
+        file_bytes: bytes,
+        location_mapping: Dict[str, Dict]
+    ) -> Dict[str, Dict]:
+        """
+        按文档当前文本校验位置映射，偏移失效时按原文本重新定位
+        
+        找不到原文本的位置保持不变（生成时仍会按原逻辑尝试查找）
+        """
+        if not location_mapping:
+            return {}
+        
+        doc = Document(BytesIO(file_bytes))
+        element_texts = {elem_id: element.text for elem_id, _, element in self.iter_elements(doc)}
+        
+        rebased = {}
+        for var_name, location in location_mapping.items():
+            locs = []
+            for loc in iter_locations(location):
+                text = element_texts.get(loc.get("element_id"), "")
+                original_text = loc.get("original_text", "")
+                if original_text and text[loc["start"]:loc["end"]] != original_text:
+                    pos = text.find(original_text)
+                    if pos >= 0:
+                        loc = dict(loc, start=pos, end=pos + len(original_text))
+                locs.append(loc)
+            rebased[var_name] = locs if isinstance(location, list) else locs[0]
+        
+        return rebased
+    
+    def compile_template(
+        self,
+        file_bytes: bytes,
+        location_mapping: Optional[Dict[str, Dict]] = None,
+        text_mapping: Optional[Dict[str, str]] = None,
+        key: str = "",
+        repeat_rows: Optional[List[Dict]] = None
+    ) -> CompiledTemplate:
+        """
+        预编译模板
+        
+        用与逐行替换完全相同的保留格式逻辑，把每个映射位置替换为槽位标记，
+        再把含标记的XML部件拆分为静态片段。之后每行只需拼接片段，
+        不再解析docx、查找元素或计算偏移。
+        
+        循环行以注释标记包围，拆分后成为循环区段，生成时按明细记录重复输出。
+        """
+        doc = Document(BytesIO(file_bytes))
+        
+        element_map = {}
+        element_texts = {}
+        for elem_id, _, element in self.iter_elements(doc):
+            element_map[elem_id] = element
+            element_texts[elem_id] = element.text
+        
+        if location_mapping:
+            final_mapping = location_mapping
+        elif text_mapping:
+            final_mapping = self._build_location_mapping(element_texts, text_mapping)
+        else:
+            final_mapping = {}
+        
+        bookmarks = self._bookmark_index(doc)
+        
+        slots = []
+        image_widths = {}
+        for items in group_locations(final_mapping).values():
+            for var_name, loc in items:
+                marker = make_slot_marker(len(slots))
+                if self.replace_location(element_map, bookmarks, loc, marker):
+                    if loc.get("kind") == "image":
+                        image_widths[len(slots)] = cm_to_emu(loc.get("width_cm") or IMAGE_DEFAULT_WIDTH_CM)
+                    slots.append((var_name, loc.get("original_text", "")))
+        
+        for part in doc.part.package.iter_parts():
+            part_element = getattr(part, "_element", None)
+            if part_element is not None:
+                self.preserve_slot_space(part_element)
+        
+        repeat_names = self.mark_repeat_rows(doc.tables, repeat_rows or [])
+        
+        output = BytesIO()
+        doc.save(output)
+        
+        with zipfile.ZipFile(BytesIO(output.getvalue())) as zf:
+            parts = [(info.filename, zf.read(info)) for info in zf.infolist()]
+        
+        images = {}
+        if image_widths:
+            parts, images = self.add_image_relationships(parts, slots, image_widths)
+        
+        members = []
+        for name, data in parts:
+            if SLOT_OPEN.encode("utf-8") in data or (repeat_names and REPEAT_MARK in data):
+                members.append((name, split_segments(data.decode("utf-8"), repeat_names)))
+            else:
+                members.append((name, data))
+        
+        return CompiledTemplate(members=members, slots=slots, key=key, images=images)
+    
+    def add_image_relationships(
+        self,
+        parts: List[Tuple[str, bytes]],
+        slots: List[Tuple[str, str]],
+        image_widths: Dict[int, int]
+    ) -> Tuple[List[Tuple[str, bytes]], Dict[int, Tuple[int, int]]]:
+        """
+        为每个图片槽位在其所在部件的 .rels 中加入一个关系槽位，并登记图片格式的内容类型
+        
+        图片关系随行数据变化（指向按内容命名的媒体部件），编译后和文本槽位一样逐行填充
+        
+        Returns:
+            (更新后的压缩包成员, {图片槽位: (宽度EMU, 关系槽位)})
+        """
+        images = {}
+        rel_markers: Dict[str, str] = {}
+        for name, data in parts:
+            if SLOT_OPEN.encode("utf-8") not in data:
+                continue
+            for slot_id in find_slot_ids(data.decode("utf-8")):
+                if slot_id not in image_widths:
+                    continue
+                rel_slot = len(slots)
+                slots.append((slots[slot_id][0], ""))
+                images[slot_id] = (image_widths[slot_id], rel_slot)
+                folder, base = name.rsplit("/", 1) if "/" in name else ("", name)
+                rels_name = f"{folder}/_rels/{base}.rels" if folder else f"_rels/{base}.rels"
+                rel_markers[rels_name] = rel_markers.get(rels_name, "") + make_slot_marker(rel_slot)
+        
+        result = []
+        for name, data in parts:
+            if name in rel_markers:
+                markers = rel_markers.pop(name).encode("utf-8")
+                data = data.replace(b"</Relationships>", markers + b"</Relationships>")
+            elif name == CONTENT_TYPES_PART:
+                data = self._add_image_content_types(data)
+            result.append((name, data))
+        
+        # 原来没有关系文件的部件（如不含图片和链接的页眉）
+        for rels_name, markers in rel_markers.items():
+            result.append((rels_name, EMPTY_RELS.format(markers).encode("utf-8")))
+        return result, images
+    
+    def _add_image_content_types(self, data: bytes) -> bytes:
+        """补充缺少的图片扩展名内容类型"""
+        text = data.decode("utf-8")
+        defaults = "".join(
+            f'<Default Extension="{ext}" ContentType="{content_type}"/>'
+            for ext, content_type in IMAGE_CONTENT_TYPES.items()
+            if f'Extension="{ext}"' not in text
+        )
+        return text.replace("</Types>", defaults + "</Types>").encode("utf-8")
+    
+    def mark_repeat_rows(self, tables, repeat_rows: List[Dict], table_offset: int = 0) -> List[str]:
+        """
+        用注释标记包围循环行，返回区段编号对应的循环行名称
+        
+        Args:
+            tables: 文档正文的表格（流式编译时为单个表格，table_offset 为其序号）
+        """
+        names = []
+        for repeat_row in repeat_rows:
+            table_idx = repeat_row["table_index"] - table_offset
+            if not 0 <= table_idx < len(tables):
+                continue
+            rows = tables[table_idx]._tbl.tr_lst
+            if repeat_row["row_index"] >= len(rows):
                 continue
             
-            element = element_map[elem_id]
+            tr = rows[repeat_row["row_index"]]
+            tr.addprevious(etree.Comment(REPEAT_OPEN.format(len(names))))
+            tr.addnext(etree.Comment(REPEAT_CLOSE.format(len(names))))
+            names.append(repeat_row["name"])
+        return names
+    
+    def preserve_slot_space(self, element) -> None:
+        """槽位所在的 <w:t> 需要保留空白，值可能以空格开头或结尾"""
+        for t in element.iter(qn("w:t")):
+            if t.text and SLOT_OPEN in t.text:
+                t.set(qn("xml:space"), "preserve")
+    
+    def compile_config(self, config, file_bytes: bytes, key: str = "") -> CompiledTemplate:
+        """按模板配置的映射类型预编译"""
+        mapping_info = config.get_mapping()
+        if mapping_info["type"] == "jinja":
+            return self.compile_jinja_template(file_bytes, key=key)
+        if mapping_info["type"] == "text":
+            return self.compile_template(file_bytes, text_mapping=mapping_info["data"], key=key)
+        return self.compile_template(
+            file_bytes,
+            location_mapping=mapping_info["data"],
+            key=key,
+            repeat_rows=mapping_info.get("repeats")
+        )
+    
+    def scan_jinja_variables(self, file_bytes: bytes) -> Optional[List[str]]:
+        """
+        识别 {{ 变量 }} 语法模板（docxtpl）中需要从数据提供的变量
+        
+        Returns:
+            变量名列表（按名称排序）；文档中没有 {{ }} / {% %} 语法时返回 None
+        
+        Raises:
+            jinja2.TemplateSyntaxError: 模板语法错误
+        """
+        with zipfile.ZipFile(BytesIO(file_bytes)) as zf:
+            has_tags = any(
+                JINJA_TAG_RE.search(re.sub(r"<[^>]*>", "", zf.read(info).decode("utf-8")))
+                for info in zf.infolist()
+                if CONTENT_PART_RE.match(info.filename)
+            )
+        if not has_tags:
+            return None
+        
+        tpl = DocxTemplate(BytesIO(file_bytes))
+        return sorted(tpl.get_undeclared_template_variables(create_jinja_env()))
+    
+    def compile_jinja_template(self, file_bytes: bytes, key: str = "") -> CompiledJinjaTemplate:
+        """
+        预编译Jinja模板
+        
+        与 DocxTemplate.render 相同的预处理（合并被拆散的标签、处理 {%tr %} 等行列语法）
+        只做一次，正文和含语法的页眉页脚各编译为一个Jinja模板；
+        之后每行只执行模板，其余压缩包成员原样复制。
+        """
+        tpl = DocxTemplate(BytesIO(file_bytes))
+        tpl.init_docx()
+        env = create_jinja_env()
+        
+        parts = {}
+        document_name = tpl.docx.part.partname.lstrip("/")
+        body_src = tpl.patch_xml(tpl.get_xml())
+        
+        with zipfile.ZipFile(BytesIO(file_bytes)) as zf:
+            # 正文只有 <w:body> 是模板，根元素和命名空间声明保留原始字节
+            document_xml = zf.read(document_name)
+            body_start = document_xml.index(b"<w:body")
+            body_end = document_xml.rindex(b"</w:body>") + len(b"</w:body>")
+            parts[document_name] = JinjaPart(
+                prefix=document_xml[:body_start],
+                template=compile_jinja_source(env, body_src),
+                suffix=document_xml[body_end:],
+                source_size=len(body_src),
+                fix_tree=needs_tree_fix(body_src)
+            )
+            
+            for part in tpl.docx.part.package.iter_parts():
+                name = part.partname.lstrip("/")
+                if name == document_name or not CONTENT_PART_RE.match(name):
+                    continue
+                src = tpl.patch_xml(tpl.get_part_xml(part))
+                if JINJA_TAG_RE.search(src):
+                    parts[name] = JinjaPart(
+                        prefix=XML_DECLARATION,
+                        template=compile_jinja_source(env, src),
+                        suffix=b"",
+                        source_size=len(src)
+                    )
             
-            if elem_id.startswith("para_"):
-                self._replace_in_paragraph_preserve_format(element, loc, new_value)
-            elif elem_id.startswith("cell_"):
-                self._replace_in_cell_preserve_format(element, loc, new_value)
+            members = [(info.filename, parts.get(info.filename) or zf.read(info)) for info in zf.infolist()]
+        
+        return CompiledJinjaTemplate(
+            members=members,
+            variables=sorted(tpl.get_undeclared_template_variables(env)),
+            key=key
+        )
+    
+    def bind_bookmarks(
+        self,
+        file_bytes: bytes,
+        location_mapping: Dict[str, Dict]
+    ) -> Tuple[bytes, Dict[str, Dict]]:
+        """
+        用隐藏书签绑定每个映射位置
+        
+        把目标文本拆分成独立的run并用书签包围，位置中记录书签名。
+        生成时直接按书签找到目标run替换，不再依赖偏移；模板被编辑导致偏移变化时也能命中。
+        文本本身不变，原有偏移依然有效，找不到书签时按偏移替换。
+        
+        Returns:
+            (绑定后的docx, 带书签名的位置映射)
+        """
+        doc = Document(BytesIO(file_bytes))
+        element_map = {elem_id: element for elem_id, _, element in self.iter_elements(doc)}
+        next_id = self._remove_bookmarks(doc) + 1
+        
+        bound = {}
+        for var_name, location in location_mapping.items():
+            locs = []
+            for loc in iter_locations(location):
+                loc = {k: v for k, v in loc.items() if k != "bookmark"}
+                element = element_map.get(loc.get("element_id"))
+                if isinstance(element, Paragraph):
+                    target = (element, loc)
+                elif element is not None:
+                    target = self._locate_in_cell(element, loc)
+                else:
+                    target = None
+                
+                runs = self._isolate_span(*target) if target else []
+                if runs:
+                    name = f"{BOOKMARK_PREFIX}{next_id}"
+                    bookmark_start = OxmlElement("w:bookmarkStart")
+                    bookmark_start.set(qn("w:id"), str(next_id))
+                    bookmark_start.set(qn("w:name"), name)
+                    bookmark_end = OxmlElement("w:bookmarkEnd")
+                    bookmark_end.set(qn("w:id"), str(next_id))
+                    runs[0].addprevious(bookmark_start)
+                    runs[-1].addnext(bookmark_end)
+                    loc["bookmark"] = name
+                    next_id += 1
+                locs.append(loc)
+            bound[var_name] = locs if isinstance(location, list) else locs[0]
         
         output = BytesIO()
         doc.save(output)
-        output.seek(0)
-        return output.getvalue()
+        return output.getvalue(), bound
+    
+    def _isolate_span(self, paragraph, location: Dict) -> List:
+        """
+        在run边界处拆分，使目标文本恰好由若干完整run组成
+        
+        Returns:
+            目标run元素列表；段落含超链接等嵌套结构无法拆分时返回空列表
+        """
+        span = self._resolve_span(paragraph, location)
+        if span is None or span[0] == span[1]:
+            return []
+        if "".join(run.text for run in paragraph.runs) != paragraph.text:
+            return []
+        
+        start, end = span
+        for offset in (end, start):
+            pos = 0
+            for run in paragraph.runs:
+                text = run.text
+                if pos < offset < pos + len(text):
+                    tail = copy.deepcopy(run._r)
+                    run._r.addnext(tail)
+                    run.text = text[:offset - pos]
+                    Run(tail, paragraph).text = text[offset - pos:]
+                    break
+                pos += len(text)
+        
+        runs = []
+        pos = 0
+        for run in paragraph.runs:
+            length = len(run.text)
+            if start <= pos and pos + length <= end and length:
+                runs.append(run._r)
+            pos += length
+        
+        if any(r.getparent() is not paragraph._p for r in runs):
+            return []
+        return runs
+    
+    def _remove_bookmarks(self, doc) -> int:
+        """删除已有的变量书签（重新绑定时），返回文档中剩余书签的最大ID"""
+        max_id = 0
+        for part in doc.part.package.iter_parts():
+            part_element = getattr(part, "_element", None)
+            if part_element is None:
+                continue
+            
+            removed = set()
+            for start in list(part_element.iter(qn("w:bookmarkStart"))):
+                if start.get(qn("w:name"), "").startswith(BOOKMARK_PREFIX):
+                    removed.add(start.get(qn("w:id")))
+                    start.getparent().remove(start)
+                else:
+                    max_id = max(max_id, int(start.get(qn("w:id"), "0")))
+            for end in list(part_element.iter(qn("w:bookmarkEnd"))):
+                if end.get(qn("w:id")) in removed:
+                    end.getparent().remove(end)
+        return max_id
+    
+    def _bookmark_index(self, doc) -> Dict[str, object]:
+        """变量书签索引：{书签名: bookmarkStart元素}"""
+        index = {}
+        for part in doc.part.package.iter_parts():
+            part_element = getattr(part, "_element", None)
+            if part_element is not None:
+                index.update(self.bookmark_index_of(part_element))
+        return index
+    
+    def bookmark_index_of(self, element) -> Dict[str, object]:
+        """单个XML元素内的变量书签索引"""
+        index = {}
+        for start in element.iter(qn("w:bookmarkStart")):
+            name = start.get(qn("w:name"), "")
+            if name.startswith(BOOKMARK_PREFIX):
+                index[name] = start
+        return index
+    
+    def replace_location(self, element_map: Dict, bookmarks: Dict, location: Dict, new_text: str) -> bool:
+        """替换一个位置：优先按书签定位，否则按元素和偏移；返回是否找到目标元素"""
+        bookmark = bookmarks.get(location.get("bookmark"))
+        if bookmark is not None and self._replace_in_bookmark(bookmark, new_text):
+            return True
+        
+        element = element_map.get(location["element_id"])
+        if element is None:
+            return False
+        
+        if isinstance(element, Paragraph):
+            self._replace_in_paragraph_preserve_format(element, location, new_text)
+        else:
+            self._replace_in_cell_preserve_format(element, location, new_text)
+        return True
+    
+    def _replace_in_bookmark(self, bookmark_start, new_text: str) -> bool:
+        """替换书签内的文本：第一个run写入新值（保留其格式），其余run删除"""
+        bookmark_id = bookmark_start.get(qn("w:id"))
+        runs = []
+        node = bookmark_start.getnext()
+        while node is not None:
+            if node.tag == qn("w:bookmarkEnd") and node.get(qn("w:id")) == bookmark_id:
+                break
+            if node.tag == qn("w:r"):
+                runs.append(node)
+            node = node.getnext()
+        
+        if node is None or not runs:
+            return False
+        
+        Run(runs[0], None).text = new_text
+        for run in runs[1:]:
+            run.getparent().remove(run)
+        return True
     
     def _replace_in_paragraph_preserve_format(self, paragraph, location: Dict, new_text: str):
         """
@@ -79,20 +740,10 @@ class WordService:
         
         关键：找到目标位置所在的run，保留该run的格式属性
         """
-        start = location["start"]
-        end = location["end"]
-        original_text = location.get("original_text", "")
-        
-        # 验证原文本是否在预期位置
-        full_text = paragraph.text
-        if full_text[start:end] != original_text:
-            # 位置不匹配，尝试重新查找
-            actual_pos = full_text.find(original_text)
-            if actual_pos >= 0:
-                start = actual_pos
-                end = actual_pos + len(original_text)
-            else:
-                return
+        span = self._resolve_span(paragraph, location)
+        if span is None:
+            return
+        start, end = span
         
         # 找到目标run
         runs = paragraph.runs
@@ -157,8 +808,58 @@ class WordService:
     
     def _replace_in_cell_preserve_format(self, cell, location: Dict, new_text: str):
         """在表格单元格中替换，保留格式"""
-        if cell.paragraphs:
-            self._replace_in_paragraph_preserve_format(cell.paragraphs[0], location, new_text)
+        located = self._locate_in_cell(cell, location)
+        if located is not None:
+            self._replace_in_paragraph_preserve_format(located[0], located[1], new_text)
+    
+    def _locate_in_cell(self, cell, location: Dict) -> Optional[Tuple[Paragraph, Dict]]:
+        """
+        定位单元格中的目标段落
+        
+        单元格文本由各段落以换行连接，按偏移定位到所在段落；偏移失效时按原文本查找
+        
+        Returns:
+            (段落, 段落内的位置)，找不到时返回None
+        """
+        paragraphs = cell.paragraphs
+        if not paragraphs:
+            return None
+        
+        start = location["start"]
+        para_offset = 0
+        for para in paragraphs:
+            para_len = len(para.text)
+            if start <= para_offset + para_len:
+                local = dict(
+                    location,
+                    start=start - para_offset,
+                    end=location["end"] - para_offset
+                )
+                if para.text[local["start"]:local["end"]] == location.get("original_text", ""):
+                    return para, local
+                break
+            para_offset += para_len + 1
+        
+        original_text = location.get("original_text", "")
+        for para in paragraphs:
+            if original_text and original_text in para.text:
+                return para, location
+        return None
+    
+    def _resolve_span(self, paragraph, location: Dict) -> Optional[Tuple[int, int]]:
+        """校验段落内的位置，偏移失效时按原文本重新查找；找不到返回None"""
+        start = location["start"]
+        end = location["end"]
+        original_text = location.get("original_text", "")
+        
+        full_text = paragraph.text
+        if full_text[start:end] != original_text:
+            actual_pos = full_text.find(original_text)
+            if actual_pos < 0:
+                return None
+            start = actual_pos
+            end = actual_pos + len(original_text)
+        return start, end
     
     def _build_location_mapping(self, element_texts: Dict[str, str], text_mapping: Dict[str, str]) -> Dict[str, Dict]:
         """从文本映射构建位置映射"""
@@ -182,32 +883,26 @@ class WordService:
         
         return location_mapping
     
-    def batch_generate_by_location(
+    def batch_generate_compiled(
         self,
-        template_bytes: bytes,
+        compiled: CompiledTemplate,
         data_list: List[Dict[str, str]],
-        location_mapping: Dict[str, Dict]
+        image_dir: Optional[str] = None
     ) -> List[Tuple[str, bytes]]:
-        """批量生成（位置映射模式）"""
+        """
+        批量生成（使用预编译模板）
+        
+        Args:
+            image_dir: 图片变量中相对路径所在的目录
+        """
         results = []
+        data_list = self.attach_images([compiled], data_list, image_dir)
         
         for idx, data in enumerate(data_list):
             try:
-                doc_bytes = self.replace_preserving_format(
-                    template_bytes,
-                    data,
-                    location_mapping=location_mapping
-                )
-                
-                name = data.get("姓名", data.get("name", f"合同_{idx+1}"))
-                safe_name = "".join(
-                    c for c in str(name) 
-                    if c.isalnum() or c in (' ', '-', '_') or '\u4e00' <= c <= '\u9fff'
-                )
-                filename = f"{safe_name}_合同.docx"
-                
-                results.append((filename, doc_bytes))
-                
+                doc_bytes = compiled.render(data)
+                results.append((self.output_filename(data, idx), doc_bytes))
+            
             except Exception as e:
                 print(f"Error generating contract {idx+1}: {e}")
                 import traceback
@@ -216,39 +911,137 @@ class WordService:
         
         return results
     
+    def batch_generate_by_location(
+        self,
+        template_bytes: bytes,
+        data_list: List[Dict[str, str]],
+        location_mapping: Dict[str, Dict]
+    ) -> List[Tuple[str, bytes]]:
+        """批量生成（位置映射模式）：模板只编译一次"""
+        compiled = self.compile_template(template_bytes, location_mapping=location_mapping)
+        return self.batch_generate_compiled(compiled, data_list)
+    
     def batch_generate_by_text(
         self,
         template_bytes: bytes,
         data_list: List[Dict[str, str]],
         text_mapping: Dict[str, str]
     ) -> List[Tuple[str, bytes]]:
-        """批量生成（文本映射模式）"""
+        """批量生成（文本映射模式）：模板只编译一次"""
+        compiled = self.compile_template(template_bytes, text_mapping=text_mapping)
+        return self.batch_generate_compiled(compiled, data_list)
+    
+    def batch_generate_bundle(
+        self,
+        templates: List[Tuple[str, CompiledTemplate]],
+        data_list: List[Dict[str, str]],
+        layout: str = "person",
+        image_dir: Optional[str] = None
+    ) -> List[Tuple[str, bytes]]:
+        """
+        批量生成模板组合：每行数据依次渲染组合中的全部模板
+        
+        Args:
+            templates: [(模板名称, 预编译模板)]
+            layout: "person" → 姓名/模板名称.docx；"template" → 模板名称/姓名.docx
+            image_dir: 图片变量中相对路径所在的目录
+        
+        Returns:
+            [(压缩包内路径, 文件内容)]
+        """
+        data_list = self.attach_images([compiled for _, compiled in templates], data_list, image_dir)
+        labels = self._unique_names(safe_filename(name, "模板") for name, _ in templates)
+        stems = self._unique_names(
+            safe_filename(self._row_name(data, idx), f"{idx+1}")
+            for idx, data in enumerate(data_list)
+        )
         results = []
         
         for idx, data in enumerate(data_list):
-            try:
-                doc_bytes = self.replace_preserving_format(
-                    template_bytes,
-                    data,
-                    text_mapping=text_mapping
-                )
-                
-                name = data.get("姓名", data.get("name", f"合同_{idx+1}"))
-                safe_name = "".join(
-                    c for c in str(name) 
-                    if c.isalnum() or c in (' ', '-', '_') or '\u4e00' <= c <= '\u9fff'
-                )
-                filename = f"{safe_name}_合同.docx"
-                
-                results.append((filename, doc_bytes))
+            for label, (_, compiled) in zip(labels, templates):
+                try:
+                    doc_bytes = compiled.render(data)
+                except Exception as e:
+                    print(f"Error generating {label} for row {idx+1}: {e}")
+                    continue
                 
-            except Exception as e:
-                print(f"Error generating contract {idx+1}: {e}")
-                import traceback
-                traceback.print_exc()
-                continue
+                if layout == "template":
+                    results.append((f"{label}/{stems[idx]}.docx", doc_bytes))
+                else:
+                    results.append((f"{stems[idx]}/{label}.docx", doc_bytes))
         
         return results
+    
+    def render_row_files(
+        self,
+        templates: List[Tuple[str, CompiledTemplate]],
+        data: Dict[str, str],
+        idx: int,
+        layout: Optional[str] = None,
+        images: Optional[ImageLoader] = None
+    ) -> List[Tuple[str, bytes]]:
+        """
+        用一行数据生成文件（流水线的渲染阶段，文件名与批量生成一致，重名由归档阶段处理）
+        
+        Args:
+            templates: [(模板名称, 预编译模板)]
+            layout: 模板组合的目录结构；None 表示单个模板
+            images: 模板有图片变量时的图片读取器（流水线读取阶段已为排队的行预读，未预读时当场读取）
+        
+        Returns:
+            [(压缩包内路径, 文件内容)]
+        """
+        if images is not None:
+            image_vars = [v for _, compiled in templates for v in getattr(compiled, "image_variables", [])]
+            data = {**data, **{var_name: images.get(data.get(var_name)) for var_name in image_vars}}
+        
+        if layout is None:
+            return [(self.output_filename(data, idx), templates[0][1].render(data))]
+        
+        stem = safe_filename(self._row_name(data, idx), f"{idx+1}")
+        files = []
+        for name, compiled in templates:
+            label = safe_filename(name, "模板")
+            path = f"{label}/{stem}.docx" if layout == "template" else f"{stem}/{label}.docx"
+            files.append((path, compiled.render(data)))
+        return files
+    
+    def attach_images(
+        self,
+        templates: List[CompiledTemplate],
+        data_list: List[Dict[str, str]],
+        image_dir: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        把图片变量的值（图片路径）替换为读取好的图片
+        
+        全部图片先并行读取（相同图片只读一次），逐行渲染时不再等待磁盘；
+        模板没有图片变量时原样返回
+        """
+        image_vars = list(dict.fromkeys(
+            var_name for compiled in templates for var_name in getattr(compiled, "image_variables", [])
+        ))
+        if not image_vars:
+            return data_list
+        
+        with ImageLoader(image_dir) as loader:
+            loader.prefetch(data.get(var_name) for data in data_list for var_name in image_vars)
+            return [
+                {**data, **{var_name: loader.get(data.get(var_name)) for var_name in image_vars}}
+                for data in data_list
+            ]
+    
+    def _unique_names(self, names) -> List[str]:
+        """重名时依次加编号（张三、张三_2），编号已被占用时继续递增，避免压缩包内路径冲突"""
+        used: Dict[str, int] = {}
+        return [unique_path(name, used) for name in names]
+    
+    def _row_name(self, data: Dict[str, str], idx: int) -> str:
+        return data.get("姓名", data.get("name", f"合同_{idx+1}"))
+    
+    def output_filename(self, data: Dict[str, str], idx: int) -> str:
+        """根据行数据生成输出文件名"""
+        return f"{safe_filename(self._row_name(data, idx), f'{idx+1}')}_合同.docx"
 
 
 # 单例
@@ -0,0 +1,362 @@
+"""
+共享工作队列（多台机器分布式生成）
+任务提交时按行切分为若干块，每块的行数据写入共享目录；各机器上的 worker.py 从队列领取数据块，
+生成后把压缩包写回共享目录。不需要额外的消息中间件，共享目录（网络盘）上的一个 SQLite 文件即是队列
+
+领取数据块时加租约：worker 定期续约并上报进度，进程或机器宕机后租约过期，数据块由其他 worker 重新领取；
+重试超过上限的数据块标记为失败
+
+目录结构：
+    CLUSTER_DIR/queue.db
+    CLUSTER_DIR/jobs/任务ID/spec.json           生成设置（模板、目录结构、压缩包格式……）
+    CLUSTER_DIR/jobs/任务ID/templates/          预编译模板（ArtifactStore 格式）
+    CLUSTER_DIR/jobs/任务ID/chunks/00000.jsonl  每块的行数据（已按列映射转换）
+    CLUSTER_DIR/jobs/任务ID/output/00000.1.zip  每块的生成结果（文件名含尝试次数）
+
+注意：网络文件系统上无法使用 WAL 模式（需要共享内存），队列数据库使用回滚日志模式
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from ..config import (
+    CLUSTER_CHUNK_ROWS, CLUSTER_DIR, CLUSTER_LEASE_SECONDS, CLUSTER_MAX_ATTEMPTS, SQLITE_BUSY_TIMEOUT_MS
+)
+from .artifact_store import ArtifactStore
+from .compiled_template import CompiledTemplate
+
+
+def worker_name() -> str:
+    """默认的 worker 标识：主机名 + 进程号"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class WorkQueue:
+    """SQLite 共享工作队列（每个线程一个连接，领取与续约在事务中完成）"""
+    
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        job_id     TEXT PRIMARY KEY,
+        name       TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        status     TEXT NOT NULL,
+        total_rows INTEGER NOT NULL,
+        chunks     INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS tasks (
+        job_id      TEXT NOT NULL,
+        chunk       INTEGER NOT NULL,
+        rows        INTEGER NOT NULL,
+        status      TEXT NOT NULL,
+        worker      TEXT,
+        lease_until REAL,
+        attempts    INTEGER NOT NULL DEFAULT 0,
+        rows_done   INTEGER NOT NULL DEFAULT 0,
+        documents   INTEGER NOT NULL DEFAULT 0,
+        failed_rows INTEGER NOT NULL DEFAULT 0,
+        output      TEXT,
+        error       TEXT,
+        PRIMARY KEY (job_id, chunk)
+    );
+    CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status, lease_until);
+    CREATE TABLE IF NOT EXISTS workers (
+        worker     TEXT PRIMARY KEY,
+        heartbeat  REAL NOT NULL,
+        task       TEXT
+    );
+    """
+    
+    def __init__(self, cluster_dir: Path = CLUSTER_DIR, lease_seconds: float = CLUSTER_LEASE_SECONDS,
+                 max_attempts: int = CLUSTER_MAX_ATTEMPTS):
+        self.cluster_dir = Path(cluster_dir)
+        self.db_path = self.cluster_dir / "queue.db"
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        
+        self.cluster_dir.mkdir(parents=True, exist_ok=True)
+        self._conn().executescript(self.SCHEMA)
+    
+    def job_dir(self, job_id: str) -> Path:
+        return self.cluster_dir / "jobs" / job_id
+    
+    # ==================== 提交 ====================
+    
+    def submit(
+        self,
+        name: str,
+        templates: List[Tuple[str, str, CompiledTemplate]],
+        rows: Iterable[Dict],
+        spec: Dict,
+        chunk_rows: int = CLUSTER_CHUNK_ROWS
+    ) -> str:
+        """
+        提交任务：写入模板与分块的行数据后登记到队列
+        
+        Args:
+            name: 任务名称（显示用，也用作压缩包文件名）
+            templates: [(模板ID, 模板名称, 预编译模板)]
+            rows: 已按列映射转换的行数据（含明细记录）
+            spec: 生成设置 {"layout", "archive_mode", "deflate_level", "image_dir"}
+        
+        Returns:
+            任务ID
+        """
+        job_id = f"{time.strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        job_dir = self.job_dir(job_id)
+        store = ArtifactStore(job_dir / "templates")
+        (job_dir / "templates").mkdir(parents=True)
+        (job_dir / "chunks").mkdir()
+        (job_dir / "output").mkdir()
+        
+        spec = dict(spec, templates=[
+            {"template_id": template_id, "name": template_name, "key": compiled.key}
+            for template_id, template_name, compiled in templates
+        ])
+        for template_id, _, compiled in templates:
+            store.save(template_id, compiled)
+        (job_dir / "spec.json").write_text(json.dumps(spec, ensure_ascii=False), encoding="utf-8")
+        
+        # 行号跨块连续（领取时按之前各块的行数算出起始行号），生成的文件名与单机生成一致
+        counts = []
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_rows:
+                self._write_chunk(job_dir, len(counts), chunk)
+                counts.append(len(chunk))
+                chunk = []
+        if chunk or not counts:
+            self._write_chunk(job_dir, len(counts), chunk)
+            counts.append(len(chunk))
+        
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO jobs(job_id, name, created_at, status, total_rows, chunks) "
+                "VALUES (?, ?, ?, 'running', ?, ?)",
+                (job_id, name, time.time(), sum(counts), len(counts))
+            )
+            conn.executemany(
+                "INSERT INTO tasks(job_id, chunk, rows, status) VALUES (?, ?, ?, 'pending')",
+                [(job_id, i, count) for i, count in enumerate(counts)]
+            )
+        return job_id
+    
+    def cancel(self, job_id: str) -> None:
+        """取消任务：未领取的数据块不再生成，已领取的在下次续约时停止"""
+        with self._transaction() as conn:
+            conn.execute("UPDATE jobs SET status = 'cancelled' WHERE job_id = ? AND status = 'running'", (job_id,))
+    
+    # ==================== worker ====================
+    
+    def claim(self, worker: str) -> Optional[Dict]:
+        """
+        领取一个数据块：待处理的，或租约已过期的（原 worker 已宕机）；按提交先后
+        
+        Returns:
+            {"job_id", "chunk", "first_row", "rows", "attempts"}；没有可领取的数据块时为None
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            # 租约过期且重试次数已用完的数据块标记为失败
+            expired = conn.execute(
+                "SELECT job_id, chunk FROM tasks WHERE status = 'leased' AND lease_until < ? AND attempts >= ?",
+                (now, self.max_attempts)
+            ).fetchall()
+            for job_id, chunk in expired:
+                self._mark_failed(conn, job_id, chunk, "租约过期次数超过上限")
+            
+            row = conn.execute(
+                """
+                SELECT t.job_id, t.chunk, t.rows, t.attempts FROM tasks t JOIN jobs j ON j.job_id = t.job_id
+                WHERE j.status = 'running'
+                  AND (t.status = 'pending' OR (t.status = 'leased' AND t.lease_until < ?))
+                ORDER BY j.created_at, t.chunk LIMIT 1
+                """,
+                (now,)
+            ).fetchone()
+            if row is None:
+                self._touch_worker(conn, worker, None)
+                return None
+            
+            job_id, chunk, rows, attempts = row
+            conn.execute(
+                "UPDATE tasks SET status = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1, "
+                "rows_done = 0 WHERE job_id = ? AND chunk = ?",
+                (worker, now + self.lease_seconds, job_id, chunk)
+            )
+            self._touch_worker(conn, worker, f"{job_id}/{chunk}")
+            first_row = conn.execute(
+                "SELECT COALESCE(SUM(rows), 0) FROM tasks WHERE job_id = ? AND chunk < ?", (job_id, chunk)
+            ).fetchone()[0]
+        return {"job_id": job_id, "chunk": chunk, "first_row": first_row, "rows": rows, "attempts": attempts + 1}
+    
+    def heartbeat(self, task: Dict, worker: str, rows_done: int) -> bool:
+        """
+        续约并上报进度
+        
+        Returns:
+            是否仍持有该数据块（租约已被他人接手或任务已取消时为 False，worker 应放弃）
+        """
+        with self._transaction() as conn:
+            updated = conn.execute(
+                "UPDATE tasks SET lease_until = ?, rows_done = ? "
+                "WHERE job_id = ? AND chunk = ? AND worker = ? AND status = 'leased' "
+                "AND (SELECT status FROM jobs WHERE job_id = tasks.job_id) = 'running'",
+                (time.time() + self.lease_seconds, rows_done, task["job_id"], task["chunk"], worker)
+            ).rowcount
+            self._touch_worker(conn, worker, f"{task['job_id']}/{task['chunk']}" if updated else None)
+        return bool(updated)
+    
+    def complete(self, task: Dict, worker: str, output: str, documents: int, failed_rows: int) -> bool:
+        """数据块完成；全部数据块完成时任务完成。已失去租约时不记录，返回 False"""
+        with self._transaction() as conn:
+            updated = conn.execute(
+                "UPDATE tasks SET status = 'done', output = ?, documents = ?, failed_rows = ?, rows_done = rows, "
+                "lease_until = NULL WHERE job_id = ? AND chunk = ? AND worker = ? AND status = 'leased'",
+                (output, documents, failed_rows, task["job_id"], task["chunk"], worker)
+            ).rowcount
+            if updated:
+                conn.execute(
+                    "UPDATE jobs SET status = 'done' WHERE job_id = ? AND status = 'running' AND NOT EXISTS "
+                    "(SELECT 1 FROM tasks WHERE job_id = ? AND status != 'done')",
+                    (task["job_id"], task["job_id"])
+                )
+            self._touch_worker(conn, worker, None)
+        return bool(updated)
+    
+    def fail(self, task: Dict, worker: str, error: str) -> None:
+        """数据块出错：重试次数未用完时放回队列，否则标记失败（任务随之失败）"""
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT attempts FROM tasks WHERE job_id = ? AND chunk = ? AND worker = ? AND status = 'leased'",
+                (task["job_id"], task["chunk"], worker)
+            ).fetchone()
+            if row is not None:
+                if row[0] >= self.max_attempts:
+                    self._mark_failed(conn, task["job_id"], task["chunk"], error)
+                else:
+                    conn.execute(
+                        "UPDATE tasks SET status = 'pending', worker = NULL, lease_until = NULL, error = ? "
+                        "WHERE job_id = ? AND chunk = ?",
+                        (error, task["job_id"], task["chunk"])
+                    )
+            self._touch_worker(conn, worker, None)
+    
+    def release_worker(self, worker: str) -> None:
+        """worker 正常退出时注销"""
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM workers WHERE worker = ?", (worker,))
+    
+    # ==================== 查询 ====================
+    
+    def jobs(self, limit: int = 20, job_id: Optional[str] = None) -> List[Dict]:
+        """
+        最近的任务及进度（指定 job_id 时只查该任务）
+        
+        Returns:
+            [{"job_id", "name", "created_at", "status", "total_rows", "chunks",
+              "chunks_done", "rows_done", "documents", "failed_rows", "leased", "error"}]
+        """
+        rows = self._conn().execute(
+            """
+            SELECT j.job_id, j.name, j.created_at, j.status, j.total_rows, j.chunks,
+                   SUM(t.status = 'done'), SUM(t.rows_done), SUM(t.documents), SUM(t.failed_rows),
+                   SUM(t.status = 'leased'), MAX(t.error)
+            FROM jobs j JOIN tasks t ON t.job_id = j.job_id
+            WHERE ? IS NULL OR j.job_id = ?
+            GROUP BY j.job_id ORDER BY j.created_at DESC LIMIT ?
+            """,
+            (job_id, job_id, limit)
+        ).fetchall()
+        keys = ["job_id", "name", "created_at", "status", "total_rows", "chunks",
+                "chunks_done", "rows_done", "documents", "failed_rows", "leased", "error"]
+        return [dict(zip(keys, row)) for row in rows]
+    
+    def job(self, job_id: str) -> Optional[Dict]:
+        jobs = self.jobs(limit=1, job_id=job_id)
+        return jobs[0] if jobs else None
+    
+    def outputs(self, job_id: str) -> List[Path]:
+        """已完成数据块的压缩包（按块序）"""
+        rows = self._conn().execute(
+            "SELECT output FROM tasks WHERE job_id = ? AND status = 'done' ORDER BY chunk", (job_id,)
+        ).fetchall()
+        return [self.job_dir(job_id) / output for (output,) in rows if output]
+    
+    def workers(self, active_seconds: Optional[float] = None) -> List[Dict]:
+        """最近有心跳的 worker：[{"worker", "heartbeat", "task"}]"""
+        since = time.time() - (active_seconds or 2 * self.lease_seconds)
+        rows = self._conn().execute(
+            "SELECT worker, heartbeat, task FROM workers WHERE heartbeat >= ? ORDER BY worker", (since,)
+        ).fetchall()
+        return [{"worker": w, "heartbeat": h, "task": t} for w, h, t in rows]
+    
+    def spec(self, job_id: str) -> Dict:
+        return json.loads((self.job_dir(job_id) / "spec.json").read_text(encoding="utf-8"))
+    
+    def load_templates(self, job_id: str, spec: Dict) -> List[Tuple[str, CompiledTemplate]]:
+        """加载任务的预编译模板 → [(模板名称, 预编译模板)]"""
+        store = ArtifactStore(self.job_dir(job_id) / "templates")
+        templates = []
+        for item in spec["templates"]:
+            compiled = store.load(item["template_id"], item["key"])
+            if compiled is None:
+                raise FileNotFoundError(f"预编译模板缺失: {item['name']}")
+            templates.append((item["name"], compiled))
+        return templates
+    
+    def read_chunk(self, job_id: str, chunk: int) -> Iterable[Dict]:
+        with open(self.job_dir(job_id) / "chunks" / f"{chunk:05d}.jsonl", "r", encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+    
+    # ==================== 内部 ====================
+    
+    def _write_chunk(self, job_dir: Path, chunk: int, rows: List[Dict]) -> None:
+        path = job_dir / "chunks" / f"{chunk:05d}.jsonl"
+        with open(path, "w", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False, default=str) + "\n")
+    
+    def _mark_failed(self, conn: sqlite3.Connection, job_id: str, chunk: int, error: str) -> None:
+        conn.execute(
+            "UPDATE tasks SET status = 'failed', lease_until = NULL, error = ? WHERE job_id = ? AND chunk = ?",
+            (error, job_id, chunk)
+        )
+        conn.execute("UPDATE jobs SET status = 'failed' WHERE job_id = ? AND status = 'running'", (job_id,))
+    
+    def _touch_worker(self, conn: sqlite3.Connection, worker: str, task: Optional[str]) -> None:
+        conn.execute(
+            "INSERT INTO workers(worker, heartbeat, task) VALUES (?, ?, ?) "
+            "ON CONFLICT(worker) DO UPDATE SET heartbeat = excluded.heartbeat, task = excluded.task",
+            (worker, time.time(), task)
+        )
+    
+    @contextmanager
+    def _transaction(self):
+        """写事务：开始时即取得写锁，多个 worker 同时领取时不会领到同一数据块"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+    
+    def _conn(self) -> sqlite3.Connection:
+        """每个线程一个连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+            conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+            self._local.conn = conn
+        return conn
@@ -7,34 +7,136 @@ import pandas as pd
 from io import BytesIO
 from datetime import datetime
 
+from src.models.schemas import iter_locations
+
+
+# 候选内容识别：各类型合并为一个预编译的交替正则，一次扫描完成
+# 每个分支只有一个命名分组，通过 lastgroup 判断类型；标签类分支只捕获标签后的值
+_NAME_CHARS = r'[\u4e00-\u9fff·]'
+CANDIDATE_TYPES = {
+    "party": "单位名称",
+    "person": "姓名",
+    "id_card": "身份证号",
+    "phone": "手机号",
+    "date": "日期",
+    "year": "年份",
+    "amount": "金额/数字",
+}
+CANDIDATE_PATTERN = re.compile(
+    r'(?P<label>(?:[甲乙丙]\s*方|姓\s*名|法定代表人|联系人|代理人)\s*[：:]\s*)'
+    r'(?:(?P<party>' + _NAME_CHARS + r'{2,30}?(?:有限责任公司|股份有限公司|有限公司|公司))'
+    r'|(?P<person>' + _NAME_CHARS + r'{2,4})(?!' + _NAME_CHARS + r'))'
+    r'|(?<!\d)(?P<id_card>\d{17}[\dXx]|\d{15})(?!\d)'
+    r'|(?<!\d)(?P<phone>1[3-9]\d{9})(?!\d)'
+    r'|(?<!\d)(?P<date>20\d{2}年\d{1,2}月\d{1,2}日|20\d{2}[-/.]\d{1,2}[-/.]\d{1,2})(?!\d)'
+    r'|(?<!\d)(?P<year>20\d{2})(?!\d)'
+    r'|(?<![\d.])(?P<amount>\d{4,}(?:\.\d{1,2})?)(?![\d.])'
+)
+
 
 def extract_candidates(text: str) -> List[Dict]:
-    """从文本中提取候选替换内容"""
+    """从文本中提取候选替换内容（同一文本只保留首次出现）"""
     candidates = []
     seen = set()
     
-    patterns = [
-        (r'\d{15,18}[Xx]?', "身份证号"),
-        (r'1[3-9]\d{9}', "手机号"),
-        (r'20\d{2}', "年份"),
-        (r'\d{4,}(?:\.\d{1,2})?', "金额/数字"),
-    ]
-    
-    for pattern, ptype in patterns:
-        for m in re.finditer(pattern, text):
-            val = m.group()
-            if val not in seen:
-                candidates.append({
-                    "text": val,
-                    "type": ptype,
-                    "start": m.start(),
-                    "end": m.end()
-                })
-                seen.add(val)
+    for m in CANDIDATE_PATTERN.finditer(text):
+        kind = m.lastgroup
+        val = m.group(kind)
+        if val in seen:
+            continue
+        
+        cand = {
+            "text": val,
+            "type": CANDIDATE_TYPES[kind],
+            "start": m.start(kind),
+            "end": m.end(kind),
+        }
+        if m.group("label"):
+            # 标签去空格作为建议变量名，如 "乙    方：" → "乙方"
+            cand["label"] = re.sub(r'[\s：:]', '', m.group("label"))
+        candidates.append(cand)
+        seen.add(val)
     
     return candidates
 
 
+def build_candidate_index(elements: List[Dict]) -> Dict[str, Dict]:
+    """
+    对整个文档构建候选内容索引（上传时执行一次）
+    
+    Returns:
+        {
+            "by_element": {元素ID: [候选, ...]},
+            "by_type": {类型: [{"element_id", "text", "start", "end", ...}, ...]}
+        }
+    """
+    by_element: Dict[str, List[Dict]] = {}
+    by_type: Dict[str, List[Dict]] = {}
+    
+    for elem in elements:
+        candidates = extract_candidates(elem["text"])
+        if not candidates:
+            continue
+        by_element[elem["element_id"]] = candidates
+        for cand in candidates:
+            by_type.setdefault(cand["type"], []).append(
+                dict(cand, element_id=elem["element_id"])
+            )
+    
+    return {"by_element": by_element, "by_type": by_type}
+
+
+def suggest_location_mapping(
+    candidates: List[Dict],
+    location_mapping: Dict[str, Dict]
+) -> Dict[str, Dict]:
+    """
+    为候选内容生成建议映射，跳过已映射的位置，变量名自动去重
+    
+    变量名优先使用标签（如"乙方"），否则使用类型名
+    """
+    mapped = {
+        (loc.get("element_id"), loc.get("start"))
+        for location in location_mapping.values()
+        for loc in iter_locations(location)
+    }
+    used = set(location_mapping)
+    suggestions = {}
+    
+    for cand in candidates:
+        if (cand["element_id"], cand["start"]) in mapped:
+            continue
+        base = cand.get("label") or cand["type"].split("/")[0]
+        var_name, n = base, 2
+        while var_name in used:
+            var_name, n = f"{base}{n}", n + 1
+        used.add(var_name)
+        suggestions[var_name] = {
+            "element_id": cand["element_id"],
+            "start": cand["start"],
+            "end": cand["end"],
+            "length": cand["end"] - cand["start"],
+            "original_text": cand["text"]
+        }
+    
+    return suggestions
+
+
+def build_element_var_index(location_mapping: Dict[str, Dict]) -> Dict[str, List[str]]:
+    """
+    构建 元素ID → 变量名列表 索引
+    
+    每次渲染只扫描一遍映射，避免逐元素遍历全部变量
+    """
+    index: Dict[str, List[str]] = {}
+    for var_name, location in location_mapping.items():
+        for loc in iter_locations(location):
+            vars_here = index.setdefault(loc.get("element_id"), [])
+            if var_name not in vars_here:
+                vars_here.append(var_name)
+    return index
+
+
 def generate_excel_template(mapping: Dict[str, str]) -> bytes:
     """生成Excel模板"""
     df = pd.DataFrame(columns=list(mapping.keys()))
@@ -57,6 +159,28 @@ def safe_filename(name: str, default: str = "文件") -> str:
     return safe if safe else default
 
 
+def unique_path(path: str, used: Dict[str, int]) -> str:
+    """
+    重名时在扩展名前依次加编号（张三_合同.docx、张三_合同_2.docx）
+    
+    used: 已使用的路径 → 下一个待试编号，同名很多时不必从头尝试
+    """
+    if path not in used:
+        used[path] = 2
+        return path
+    
+    stem, dot, ext = path.rpartition(".")
+    n = used[path]
+    while True:
+        candidate = f"{stem}_{n}.{ext}" if dot and "/" not in ext else f"{path}_{n}"
+        n += 1
+        if candidate not in used:
+            break
+    used[path] = n
+    used[candidate] = 2
+    return candidate
+
+
 def format_datetime(dt: datetime = None, fmt: str = "%Y%m%d_%H%M%S") -> str:
     """格式化日期时间"""
     if dt is None:
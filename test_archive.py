@@ -0,0 +1,110 @@
+"""
+测试压缩包写入
+覆盖：ZIP 不压缩 / deflate、tar.gz 流（中文路径）、按大小分卷、ZIP64 扩展、中止删除临时文件、
+流水线中多线程预压缩
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import os
+import tarfile
+import tempfile
+import zipfile
+
+from src.services.archive_writer import ArchiveWriter, prepare_member
+from src.services.generation_pipeline import GenerationPipeline
+
+
+def sample_files(count: int):
+    """可压缩的文本（deflate 有效）与不可压缩的随机字节各半"""
+    files = []
+    for i in range(count):
+        content = f"第{i}份合同 ".encode("utf-8") * 500 if i % 2 else os.urandom(5000)
+        files.append((f"张三{i}/劳动合同.docx", content))
+    return files
+
+
+def write_archive(path: Path, mode: str, files, **kwargs):
+    writer = ArchiveWriter(path, mode, **kwargs)
+    for name, content in files:
+        writer.add(prepare_member(name, content, mode))
+    return writer.close()
+
+
+def read_zip(paths):
+    members = {}
+    for path in paths:
+        with zipfile.ZipFile(path) as zf:
+            assert zf.testzip() is None
+            members.update({name: zf.read(name) for name in zf.namelist()})
+    return members
+
+
+def test_archive():
+    """测试压缩包写入"""
+    print("=" * 60)
+    print("测试压缩包写入")
+    print("=" * 60)
+    
+    files = sample_files(20)
+    expected = dict(files)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        
+        # ZIP 不压缩 / deflate
+        stored = write_archive(tmp / "stored.zip", "stored", files)
+        deflated = write_archive(tmp / "deflate.zip", "deflate", files)
+        assert read_zip(stored) == expected and read_zip(deflated) == expected
+        assert deflated[0].stat().st_size < stored[0].stat().st_size
+        with zipfile.ZipFile(stored[0]) as zf:
+            assert {info.compress_type for info in zf.infolist()} == {zipfile.ZIP_STORED}
+        print(f"[ZIP] 不压缩 {stored[0].stat().st_size} 字节，deflate {deflated[0].stat().st_size} 字节 [OK]")
+        
+        # tar.gz 流
+        tar_paths = write_archive(tmp / "out.tar.gz", "tar", files)
+        with tarfile.open(tar_paths[0], "r:gz") as tf:
+            members = {m.name: tf.extractfile(m).read() for m in tf.getmembers()}
+        assert members == expected
+        print("[tar.gz] 中文路径，多段 gzip 可直接解压 [OK]")
+        
+        # 分卷：每卷都是完整的压缩包
+        volumes = write_archive(tmp / "vol.zip", "stored", files, volume_bytes=30_000)
+        assert len(volumes) > 1
+        assert [p.name for p in volumes[:2]] == ["vol.part1.zip", "vol.part2.zip"]
+        assert all(p.stat().st_size <= 30_000 for p in volumes)
+        assert read_zip(volumes) == expected
+        tar_volumes = write_archive(tmp / "vol.tar.gz", "tar", files, volume_bytes=30_000)
+        assert tar_volumes[0].name == "vol.part1.tar.gz"
+        print(f"[分卷] {len(volumes)} 卷 [OK]")
+        
+        # ZIP64：降低阈值，使大小、偏移和结束记录都按ZIP64格式写入
+        zip64 = write_archive(tmp / "zip64.zip", "deflate", files, zip64_limit=0)
+        assert read_zip(zip64) == expected
+        with open(zip64[0], "rb") as f:
+            assert b"PK\x06\x06" in f.read()
+        print("[ZIP64] 扩展字段可读 [OK]")
+        
+        # 中止时删除临时文件
+        writer = ArchiveWriter(tmp / "aborted.zip", "stored")
+        writer.add(prepare_member("a.docx", b"x", "stored"))
+        writer.abort()
+        assert not any("aborted" in p.name for p in tmp.iterdir())
+        print("[中止] 无临时文件 [OK]")
+        
+        # 流水线：渲染线程中预先压缩
+        render = lambda data, idx: [files[idx]]
+        result = GenerationPipeline(render, renderers=3, archive_mode="deflate", volume_mb=0.03).run(
+            iter([{}] * len(files)), tmp / "pipeline.zip"
+        )
+        assert len(result.output_paths) > 1
+        assert read_zip(result.output_paths) == expected
+        print(f"[流水线] deflate 分 {len(result.output_paths)} 卷 [OK]")
+    
+    print("\n>>> 压缩包写入测试通过！")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    test_archive()
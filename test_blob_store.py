@@ -0,0 +1,88 @@
+"""
+测试内容寻址的模板文件存储：相同文件只存一份，引用归零后删除
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import tempfile
+import threading
+
+from src.services.blob_store import FileBlobStore, content_hash_of
+from src.services.template_service import TemplateService
+from src.services.template_store import JsonTemplateStore, SqliteTemplateStore
+from test_placeholder import create_placeholder_contract
+
+
+def check_dedup(service: TemplateService):
+    """同一文件保存两个版本，只保留一份内容"""
+    docx_bytes = create_placeholder_contract()
+    content_hash = content_hash_of(docx_bytes)
+    
+    v1 = service.create_location_template("版本1", "a.docx", docx_bytes, {"姓名": {"element_id": "para_1", "start": 0, "end": 1}})
+    v2 = service.create_location_template("版本2", "a.docx", docx_bytes, {"身份证号": {"element_id": "para_1", "start": 0, "end": 1}})
+    
+    assert v1.content_hash == v2.content_hash == content_hash
+    assert service.store.ref_count(content_hash) == 2
+    assert {v.template_id for v in service.find_versions(content_hash)} == {v1.template_id, v2.template_id}
+    
+    service.delete_template(v1.template_id)
+    assert service.store.ref_count(content_hash) == 1
+    assert service.get_template_bytes(v2.template_id) == docx_bytes
+    
+    service.delete_template(v2.template_id)
+    assert service.store.ref_count(content_hash) == 0
+    return content_hash
+
+
+def check_concurrent_delete(service: TemplateService):
+    """保存新模板的同时删除共用同一文件的旧模板，新模板的文件不会被删掉"""
+    docx_bytes = create_placeholder_contract()
+    mapping = {"姓名": {"element_id": "para_1", "start": 0, "end": 1}}
+    for i in range(20):
+        old = service.create_location_template(f"旧{i}", "a.docx", docx_bytes, mapping)
+        created = []
+        threads = [
+            threading.Thread(target=lambda: created.append(
+                service.create_location_template(f"新{i}", "a.docx", docx_bytes, mapping)
+            )),
+            threading.Thread(target=service.delete_template, args=(old.template_id,)),
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert service.get_template_bytes(created[0].template_id) == docx_bytes
+        service.delete_template(created[0].template_id)
+
+
+def test_blob_dedup():
+    """JSON与SQLite两种后端的去重与引用计数"""
+    print("=" * 60)
+    print("测试模板文件去重存储")
+    print("=" * 60)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        (tmp / "configs").mkdir()
+        blobs = FileBlobStore(tmp / "blobs")
+        json_service = TemplateService(store=JsonTemplateStore(tmp / "configs", tmp / "templates", blobs))
+        content_hash = check_dedup(json_service)
+        assert not blobs.exists(content_hash)
+        print("\n[JSON] 去重与引用计数 [OK]")
+        check_concurrent_delete(json_service)
+        assert not blobs.exists(content_hash)
+        print("[JSON] 并发保存与删除 [OK]")
+        
+        sqlite_service = TemplateService(store=SqliteTemplateStore(tmp / "templates.db"))
+        check_dedup(sqlite_service)
+        blob_rows = sqlite_service.store._conn().execute("SELECT COUNT(*) FROM blobs").fetchone()[0]
+        assert blob_rows == 0
+        print("[SQLite] 去重与引用计数 [OK]")
+    
+    print("\n>>> 模板文件去重测试通过！")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    test_blob_dedup()
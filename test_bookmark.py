@@ -0,0 +1,72 @@
+"""
+测试书签绑定变量位置
+覆盖：绑定后按书签替换、偏移失效仍能命中、预编译路径、重复绑定
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from io import BytesIO
+from docx import Document
+from docx.oxml.ns import qn
+
+from src.services.word_service import word_service, BOOKMARK_PREFIX
+from test_placeholder import create_placeholder_contract
+
+
+def count_bookmarks(docx_bytes: bytes) -> int:
+    doc = Document(BytesIO(docx_bytes))
+    return len(word_service._bookmark_index(doc))
+
+
+def test_bind_bookmarks():
+    """测试书签绑定与生成"""
+    print("=" * 60)
+    print("测试书签绑定")
+    print("=" * 60)
+    
+    template_bytes = create_placeholder_contract()
+    mapping = word_service.scan_placeholders(template_bytes)
+    
+    bound_bytes, bound = word_service.bind_bookmarks(template_bytes, mapping)
+    locations = [loc for var in bound.values() for loc in (var if isinstance(var, list) else [var])]
+    print(f"\n绑定书签: {[loc['bookmark'] for loc in locations]}")
+    
+    assert all(loc.get("bookmark", "").startswith(BOOKMARK_PREFIX) for loc in locations)
+    assert count_bookmarks(bound_bytes) == len(locations) == 4
+    
+    # 文本不变，原偏移依然有效
+    doc = Document(BytesIO(bound_bytes))
+    assert doc.paragraphs[1].text == Document(BytesIO(template_bytes)).paragraphs[1].text
+    
+    # 偏移全部失效，仍然按书签命中
+    for loc in locations:
+        loc["start"], loc["end"] = 999, 1001
+    
+    data = {"合同编号": "HT-001", "姓名": "张三", "身份证号": "110101199001011234"}
+    expected_body = "乙方：张三  身份证号：110101199001011234"
+    
+    result_doc = Document(BytesIO(word_service.replace_preserving_format(
+        bound_bytes, data, location_mapping=bound
+    )))
+    print(f"逐行替换: {result_doc.paragraphs[1].text!r}")
+    assert result_doc.paragraphs[1].text == expected_body
+    assert result_doc.tables[0].cell(0, 1).text == "甲方代表\n乙方：张三"
+    assert result_doc.sections[0].header.paragraphs[0].text == "合同编号：HT-001"
+    
+    compiled = word_service.compile_template(bound_bytes, location_mapping=bound)
+    compiled_doc = Document(BytesIO(compiled.render(data)))
+    print(f"预编译: {compiled_doc.paragraphs[1].text!r}")
+    assert compiled_doc.paragraphs[1].text == expected_body
+    
+    # 对已绑定的文件重新绑定，不会重复添加书签
+    rebound_bytes, _ = word_service.bind_bookmarks(bound_bytes, mapping)
+    assert count_bookmarks(rebound_bytes) == 4
+    assert len(list(Document(BytesIO(rebound_bytes)).element.body.iter(qn("w:bookmarkEnd")))) == 3
+    
+    print("\n>>> 书签绑定测试通过！")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    test_bind_bookmarks()
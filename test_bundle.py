@@ -0,0 +1,104 @@
+"""
+测试模板组合
+覆盖：组合保存与加载、同名变量合并、每行一次生成全部模板、两种目录结构、重名人员
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import tempfile
+from io import BytesIO
+from docx import Document
+
+from src.services.blob_store import FileBlobStore
+from src.services.bundle_service import BundleService
+from src.services.template_service import TemplateService
+from src.services.template_store import JsonTemplateStore
+from src.services.word_service import word_service
+from test_jinja import create_jinja_contract
+from test_placeholder import create_placeholder_contract
+
+
+def document_text(docx_bytes: bytes) -> str:
+    doc = Document(BytesIO(docx_bytes))
+    return "\n".join(element.text for _, _, element in word_service.iter_elements(doc))
+
+
+def test_bundle():
+    """测试模板组合"""
+    print("=" * 60)
+    print("测试模板组合")
+    print("=" * 60)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        (tmp / "configs").mkdir()
+        (tmp / "bundles").mkdir()
+        templates = TemplateService(store=JsonTemplateStore(tmp / "configs", tmp / "templates", FileBlobStore(tmp / "blobs")))
+        service = BundleService(tmp / "bundles", templates=templates)
+        
+        contract_bytes = create_placeholder_contract()
+        contract = templates.create_location_template(
+            "劳动合同", "a.docx", contract_bytes, word_service.scan_placeholders(contract_bytes)
+        )
+        agreement = templates.create_jinja_template("保密协议", "b.docx", create_jinja_contract())
+        
+        try:
+            service.create_bundle("入职文件", [contract.template_id])
+            assert False, "单个模板不能组成组合"
+        except ValueError:
+            pass
+        
+        bundle = service.create_bundle("入职文件", [contract.template_id, agreement.template_id])
+        assert service.load_bundle(bundle.bundle_id).template_ids == [contract.template_id, agreement.template_id]
+        assert [b.bundle_id for b in service.list_bundles()] == [bundle.bundle_id]
+        
+        members = service.get_templates(bundle)
+        merged = service.merge_variables(members)
+        print(f"\n合并变量: {merged['variables']}")
+        assert merged["variables"].count("姓名") == 1
+        assert set(merged["variables"]) == {"合同编号", "姓名", "身份证号", "公司", "备注", "性别", "数量", "金额"}
+        
+        compiled = [(t.template_name, word_service.compile_config(t, templates.get_template_bytes(t.template_id))) for t in members]
+        rows = [
+            {"合同编号": "HT-001", "姓名": "张三", "身份证号": "110101199001011234", "公司": "甲公司",
+             "性别": "男", "备注": "无", "数量": "1", "金额": "100"},
+            {"合同编号": "HT-002", "姓名": "李四", "身份证号": "110101199202021234", "公司": "甲公司",
+             "性别": "女", "备注": "无", "数量": "0", "金额": ""},
+            {"合同编号": "HT-003", "姓名": "张三", "身份证号": "110101199303031234", "公司": "甲公司",
+             "性别": "男", "备注": "无", "数量": "0", "金额": ""},
+        ]
+        
+        by_person = dict(word_service.batch_generate_bundle(compiled, rows, layout="person"))
+        assert sorted(by_person) == sorted(
+            f"{person}/{name}.docx" for person in ["张三", "李四", "张三_2"] for name in ["劳动合同", "保密协议"]
+        )
+        assert "110101199303031234" in document_text(by_person["张三_2/劳动合同.docx"])
+        assert "乙方：李四女士" in document_text(by_person["李四/保密协议.docx"])
+        
+        by_template = dict(word_service.batch_generate_bundle(compiled, rows, layout="template"))
+        assert sorted(by_template) == sorted(
+            f"{name}/{person}.docx" for person in ["张三", "李四", "张三_2"] for name in ["劳动合同", "保密协议"]
+        )
+        print("按人员 / 按模板目录结构 [OK]")
+        
+        # 加编号后的名称与已有名称相同时继续递增
+        rows.append(dict(rows[0], 姓名="张三_2", 身份证号="110101199404041234"))
+        paths = [path for path, _ in word_service.batch_generate_bundle(compiled, rows, layout="person")]
+        assert len(paths) == len(set(paths)) == 8
+        assert "110101199404041234" in document_text(
+            dict(word_service.batch_generate_bundle(compiled, rows, layout="person"))["张三_2_2/劳动合同.docx"]
+        )
+        
+        templates.delete_template(agreement.template_id)
+        assert [t.template_id for t in service.get_templates(bundle)] == [contract.template_id]
+        assert service.delete_bundle(bundle.bundle_id)
+        assert service.list_bundles() == []
+        templates.delete_template(contract.template_id)
+    
+    print("\n>>> 模板组合测试通过！")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    test_bundle()
@@ -0,0 +1,108 @@
+"""
+测试预编译模板与跨会话缓存
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import threading
+from io import BytesIO
+from docx import Document
+
+from src.services.artifact_store import artifact_store
+from src.services.template_service import template_service
+from src.services.template_cache import CompiledTemplateCache
+from src.services.word_service import word_service
+from test_placeholder import create_placeholder_contract
+
+
+def test_compiled_cache():
+    """预编译结果与逐行替换一致，缓存命中与LRU淘汰正常"""
+    print("=" * 60)
+    print("测试预编译模板缓存")
+    print("=" * 60)
+    
+    template_bytes = create_placeholder_contract()
+    mapping = word_service.scan_placeholders(template_bytes)
+    config = template_service.create_location_template(
+        template_name="缓存测试模板",
+        original_filename="cache_test.docx",
+        docx_bytes=template_bytes,
+        location_mapping=mapping
+    )
+    
+    try:
+        cache = CompiledTemplateCache()
+        
+        # 并发请求同一模板只编译一次
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(cache.get_compiled(config)))
+            for _ in range(8)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        
+        stats = cache.stats()
+        print(f"\n[并发] {stats}")
+        # 保存模板时已写入预编译文件，直接从磁盘加载
+        assert stats["disk_loads"] == 1 and stats["compiles"] == 0
+        assert all(r is results[0] for r in results)
+        
+        compiled = cache.get_compiled(config)
+        assert cache.stats()["hits"] >= 1
+        
+        data = {"合同编号": "A&B <1>", "姓名": " 张三 ", "身份证号": "110101199001011234"}
+        expected = Document(BytesIO(word_service.replace_preserving_format(
+            template_bytes, data, location_mapping=mapping
+        )))
+        actual = Document(BytesIO(compiled.render(data)))
+        
+        print(f"\n[渲染] {[p.text for p in actual.paragraphs]}")
+        assert [p.text for p in actual.paragraphs] == [p.text for p in expected.paragraphs]
+        assert actual.tables[0].cell(0, 1).text == expected.tables[0].cell(0, 1).text
+        assert actual.sections[0].header.paragraphs[0].text == "合同编号：A&B <1>"
+        
+        # 未提供的变量保留原文本
+        partial = Document(BytesIO(compiled.render({"姓名": "李四"})))
+        assert "【身份证号】" in partial.paragraphs[1].text
+        
+        # 预编译文件缺失时按需重新编译并写回
+        artifact_store.remove(config.template_id)
+        rebuilt = CompiledTemplateCache()
+        compiled_again = rebuilt.get_compiled(config)
+        assert rebuilt.stats()["compiles"] == 1
+        assert artifact_store.load(config.template_id, compiled_again.key) is not None
+        assert Document(BytesIO(compiled_again.render(data))).paragraphs[1].text == actual.paragraphs[1].text
+        
+        # 预编译文件被截断或索引损坏：视为失效，重新编译
+        artifact_path = artifact_store._path(config.template_id, artifact_store._digest(compiled_again.key))
+        original = artifact_path.read_bytes()
+        for damaged in (original[:5], original[:-20] + b"\xff" * 20):
+            artifact_path.unlink()  # 换新文件，不改动仍被映射的旧文件
+            artifact_path.write_bytes(damaged)
+            assert artifact_store.load(config.template_id, compiled_again.key) is None
+            recovered = CompiledTemplateCache()
+            assert recovered.get_compiled(config) is not None and recovered.stats()["compiles"] == 1
+        print("\n[损坏] 预编译文件截断或损坏时重新编译 [OK]")
+        
+        # 内存上限：只能放下一个条目，修改映射后旧条目被淘汰
+        small = CompiledTemplateCache(max_bytes=1)
+        small.get_compiled(config)
+        config.location_mapping = {"姓名": mapping["姓名"]}
+        small.get_compiled(config)
+        print(f"\n[淘汰] {small.stats()}")
+        assert small.stats()["entries"] == 1
+        assert small.stats()["evictions"] == 1
+        
+        print("\n>>> 预编译缓存测试通过！")
+    finally:
+        template_service.delete_template(config.template_id)
+    
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    test_compiled_cache()
@@ -0,0 +1,170 @@
+"""
+测试监视目录
+覆盖：按文件名匹配模板并自动匹配列、同名配置文件指定模板与列映射、找不到模板时移入 failed 并附错误说明、
+复制中的文件等稳定后才处理、收件箱未变化时不列目录、同时处理的文件数不超过工作线程数、
+再次放入同名文件时不覆盖之前的结果
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import json
+import os
+import tempfile
+import time
+import zipfile
+
+from openpyxl import Workbook
+
+from src.services.hot_folder import HotFolder
+from src.services.template_service import template_service
+from src.services.word_service import word_service
+from test_placeholder import create_placeholder_contract
+
+TEMPLATE_NAME = "监视目录测试模板"
+
+
+def write_excel(path, columns, count):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(columns)
+    for i in range(count):
+        ws.append([f"HT-{i:03d}", f"员工{i}", f"1101011990010{i:05d}"])
+    wb.save(path)
+
+
+def drain(folder, timeout=30):
+    """反复扫描直到收件箱清空，记录同时处理的最大文件数"""
+    deadline = time.monotonic() + timeout
+    peak = 0
+    while time.monotonic() < deadline:
+        folder.poll()
+        peak = max(peak, len(folder._running))
+        if not folder._running and not any(folder.inbox.iterdir()):
+            return peak
+        time.sleep(0.05)
+    raise AssertionError("收件箱未在限定时间内处理完")
+
+
+def zip_names(path):
+    with zipfile.ZipFile(path) as zf:
+        assert zf.testzip() is None
+        return zf.namelist()
+
+
+def test_hot_folder():
+    """监视目录端到端处理"""
+    print("=" * 60)
+    print("测试监视目录")
+    print("=" * 60)
+    
+    template_bytes = create_placeholder_contract()
+    config = template_service.create_location_template(
+        template_name=TEMPLATE_NAME,
+        original_filename="hot_folder_test.docx",
+        docx_bytes=template_bytes,
+        location_mapping=word_service.scan_placeholders(template_bytes)
+    )
+    
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            folder = HotFolder(Path(tmp), workers=2, settle_seconds=0.3)
+            try:
+                # 文件名匹配模板，列名与变量同名
+                write_excel(folder.inbox / f"{TEMPLATE_NAME}__0901.xlsx", ["合同编号", "姓名", "身份证号"], 5)
+                # 同名配置文件指定模板与列映射
+                write_excel(folder.inbox / "九月入职.xlsx", ["编号", "员工", "证件"], 3)
+                (folder.inbox / "九月入职.xlsx.json").write_text(json.dumps({
+                    "template": TEMPLATE_NAME,
+                    "column_mapping": {"合同编号": "编号", "姓名": "员工", "身份证号": "证件"},
+                }, ensure_ascii=False), encoding="utf-8")
+                # 找不到模板
+                write_excel(folder.inbox / "不存在的模板.xlsx", ["姓名"], 1)
+                # 锁文件不处理
+                (folder.inbox / f"~${TEMPLATE_NAME}.xlsx").write_bytes(b"lock")
+                
+                # 刚放入的文件要等稳定后才处理
+                assert folder.poll() == []
+                time.sleep(0.1)
+                (folder.inbox / f"~${TEMPLATE_NAME}.xlsx").unlink()
+                drain(folder)
+                folder.wait()
+                print(f"\n统计: {folder.stats}")
+                assert folder.stats["done"] == 2 and folder.stats["failed"] == 1
+                
+                names = zip_names(folder.outbox / f"{TEMPLATE_NAME}__0901.zip")
+                assert len(names) == 5
+                summary = json.loads((folder.outbox / f"{TEMPLATE_NAME}__0901.result.json").read_text(encoding="utf-8"))
+                assert summary["source"] == TEMPLATE_NAME
+                assert summary["documents"] == 5 and summary["failed"] == 0
+                assert summary["column_mapping"] == {"合同编号": "合同编号", "姓名": "姓名", "身份证号": "身份证号"}
+                
+                assert len(zip_names(folder.outbox / "九月入职.zip")) == 3
+                summary = json.loads((folder.outbox / "九月入职.result.json").read_text(encoding="utf-8"))
+                assert summary["column_mapping"]["姓名"] == "员工"
+                
+                processed = sorted(p.name for p in folder.processed.iterdir())
+                assert processed == sorted([f"{TEMPLATE_NAME}__0901.xlsx", "九月入职.xlsx", "九月入职.xlsx.json"])
+                failed = sorted(p.name for p in folder.failed.iterdir())
+                assert failed == ["不存在的模板.xlsx", "不存在的模板.xlsx.error.txt"]
+                assert "不存在的模板" in (folder.failed / "不存在的模板.xlsx.error.txt").read_text(encoding="utf-8")
+                print("✓ 文件名匹配、配置文件、出错移入 failed 正常")
+                
+                # 再次放入同名文件：之前的结果保留，新结果加时间前缀
+                first_zip = (folder.outbox / f"{TEMPLATE_NAME}__0901.zip").read_bytes()
+                write_excel(folder.inbox / f"{TEMPLATE_NAME}__0901.xlsx", ["合同编号", "姓名", "身份证号"], 2)
+                drain(folder)
+                folder.wait()
+                assert (folder.outbox / f"{TEMPLATE_NAME}__0901.zip").read_bytes() == first_zip
+                again = [p for p in folder.outbox.glob(f"*_{TEMPLATE_NAME}__0901.zip")]
+                assert len(again) == 1 and len(zip_names(again[0])) == 2
+                assert again[0].with_name(again[0].name[:-len(".zip")] + ".result.json").exists()
+                assert len(list(folder.processed.glob(f"*{TEMPLATE_NAME}__0901.xlsx"))) == 2
+                # 同名文件同时处理（X.xlsx 与 X.xls）时占用不同的名称
+                taken = folder._reserve_stem("同时")
+                assert taken == "同时" and folder._reserve_stem("同时") != taken
+                print("✓ 同名文件不覆盖之前的结果")
+                
+                # 收件箱没有变化时只检查目录状态
+                listings = folder.stats["listings"]
+                for _ in range(5):
+                    assert folder.poll() == []
+                assert folder.stats["listings"] == listings
+                print(f"✓ 收件箱未变化时不列目录（扫描 {folder.stats['scans']} 次，列目录 {listings} 次）")
+                
+                # 复制中的文件（大小或修改时间仍在变化）不处理
+                copying = folder.inbox / f"{TEMPLATE_NAME}__copying.xlsx"
+                write_excel(copying, ["合同编号", "姓名", "身份证号"], 2)
+                for _ in range(4):
+                    folder.poll()
+                    stat = copying.stat()
+                    os.utime(copying, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+                    time.sleep(0.1)
+                assert copying.exists() and not folder._running
+                drain(folder)
+                folder.wait()
+                assert (folder.processed / copying.name).exists()
+                print("✓ 复制中的文件等稳定后才处理")
+                
+                # 一批文件同时放入：同时处理的文件数不超过工作线程数
+                for i in range(6):
+                    write_excel(folder.inbox / f"{TEMPLATE_NAME}__burst{i}.xlsx", ["合同编号", "姓名", "身份证号"], 3)
+                peak = drain(folder)
+                folder.wait()
+                print(f"✓ 6 个文件同时放入，同时处理最多 {peak} 个")
+                assert peak <= folder.workers
+                assert folder.stats["done"] == 10
+                for i in range(6):
+                    assert len(zip_names(folder.outbox / f"{TEMPLATE_NAME}__burst{i}.zip")) == 3
+            finally:
+                folder.close()
+    finally:
+        template_service.delete_template(config.template_id)
+    
+    print("\n" + "=" * 60)
+    print("✓ 测试完成")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    test_hot_folder()
@@ -0,0 +1,149 @@
+"""
+测试图片变量
+覆盖：正文和页眉插入图片、同一图片只写入一个媒体部件、按宽度等比缩放、图片缺失时留空、
+预编译文件往返、不同路径的相同图片共用一份数据、流水线按行预读且图片缓存不随行数增长
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import os
+import tempfile
+import zipfile
+from functools import partial
+from io import BytesIO
+from docx import Document
+from docx.shared import Cm
+from PIL import Image
+
+from src.services.artifact_store import ArtifactStore
+from src.services.generation_pipeline import GenerationPipeline
+from src.services.image_loader import ImageLoader
+from src.services.memory_budget import MemoryBudget
+from src.services.word_service import word_service
+
+
+def create_photo_doc():
+    """页眉有公司标志位置，正文有照片位置"""
+    doc = Document()
+    doc.sections[0].header.paragraphs[0].text = "LOGO"
+    doc.add_paragraph("姓名：陈长 照片：PHOTO 完")
+    
+    output = BytesIO()
+    doc.save(output)
+    return output.getvalue()
+
+
+def loc(element_id: str, start: int, text: str, **extra):
+    return {"element_id": element_id, "start": start, "end": start + len(text),
+            "length": len(text), "original_text": text, **extra}
+
+
+def save_image(path: Path, size, color):
+    Image.new("RGB", size, color).save(path)
+
+
+def media_parts(docx_bytes: bytes):
+    with zipfile.ZipFile(BytesIO(docx_bytes)) as zf:
+        return [name for name in zf.namelist() if name.startswith("word/media/")]
+
+
+def test_image():
+    """测试图片变量插入"""
+    print("=" * 60)
+    print("测试图片变量")
+    print("=" * 60)
+    
+    mapping = {
+        "姓名": loc("para_0", 3, "陈长"),
+        "照片": loc("para_0", 9, "PHOTO", kind="image", width_cm=2),
+        "标志": loc("header_0_0", 0, "LOGO", kind="image"),
+    }
+    compiled = word_service.compile_template(create_photo_doc(), location_mapping=mapping)
+    assert compiled.image_variables == ["照片", "标志"]
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        image_dir = Path(tmp)
+        save_image(image_dir / "a.png", (40, 20), "red")
+        save_image(image_dir / "b.png", (10, 10), "green")
+        
+        rows = [
+            {"姓名": "李四", "照片": "a.png", "标志": "a.png"},
+            {"姓名": "王五", "照片": "缺失.png", "标志": str(image_dir / "b.png")},
+        ]
+        files = word_service.batch_generate_compiled(compiled, rows, image_dir=str(image_dir))
+        assert len(files) == 2
+        
+        # 同一图片在一份文档中用了两次，只写入一个媒体部件
+        first = files[0][1]
+        assert len(media_parts(first)) == 1
+        doc = Document(BytesIO(first))
+        assert doc.paragraphs[0].text == "姓名：李四 照片： 完"
+        shape = doc.inline_shapes[0]
+        assert shape.width == Cm(2) and shape.height == Cm(1)
+        header_rels = doc.sections[0].header.part.rels
+        assert any(rel.is_external is False and "image" in rel.reltype for rel in header_rels.values())
+        print(f"[正文+页眉] 媒体部件 {media_parts(first)} [OK]")
+        
+        # 照片缺失时留空，页眉仍有图片
+        second = files[1][1]
+        doc = Document(BytesIO(second))
+        assert len(doc.inline_shapes) == 0
+        assert doc.paragraphs[0].text == "姓名：王五 照片： 完"
+        assert len(media_parts(second)) == 1
+        print("[图片缺失] 留空 [OK]")
+        
+        # 预编译文件往返后图片槽位不变
+        store = ArtifactStore(image_dir)
+        compiled.key = "k"
+        store.save("photo", compiled)
+        loaded = store.load("photo", "k")
+        assert loaded.images == compiled.images
+        data = word_service.attach_images([loaded], rows[:1], str(image_dir))[0]
+        assert loaded.render(data) == compiled.render(data)
+        print("[预编译文件] 往返一致 [OK]")
+        
+        # 不同路径的相同图片共用一份数据
+        save_image(image_dir / "a_copy.png", (40, 20), "red")
+        with ImageLoader(str(image_dir), max_workers=4) as loader:
+            loader.prefetch(["a.png", "a_copy.png", "b.png", "", None])
+            assert loader.get("a.png") is loader.get("a_copy.png")
+            assert loader.get("b.png") is not loader.get("a.png")
+            assert loader.get("") is None
+        print("[并行读取] 相同内容去重 [OK]")
+        
+        # 每人一张不同的照片：流水线读取阶段预读，缓存按字节淘汰并计入任务内存
+        count, side = 120, 60
+        for i in range(count):
+            Image.frombytes("RGB", (side, side), os.urandom(side * side * 3)).save(image_dir / f"p{i}.png")
+        size = (image_dir / "p0.png").stat().st_size
+        loader = ImageLoader(str(image_dir), variables=compiled.image_variables, max_bytes=5 * size)
+        job = MemoryBudget(limit=1 << 40).job()
+        render = partial(word_service.render_row_files, [("合同", compiled)], images=loader)
+        try:
+            result = GenerationPipeline(render, renderers=3, queue_depth=4, memory=job, images=loader).run(
+                ({"姓名": f"员工{i}", "照片": f"p{i}.png", "标志": ""} for i in range(count)),
+                image_dir / "photos.zip"
+            )
+            stats = loader.stats()
+        finally:
+            loader.close()
+        peak = result.memory["stages"]["images"]
+        print(f"[图片缓存] {count} 张照片，缓存峰值 {peak} 字节（上限 {5 * size}），{stats}")
+        assert result.documents == count
+        assert stats["loads"] == count and stats["pending"] == 0 and stats["evictions"] > 0
+        assert stats["prefetched"] == count  # 每张照片都在该行排队时已提交读取
+        assert stats["held_bytes"] <= 5 * size + size
+        # 上限之外只有排队行的预读结果（预读深度与队列长度相关）
+        assert peak <= 5 * size + 12 * size < count * size
+        assert job.held["images"] == 0 and loader.stats()["held_bytes"] == 0
+        with zipfile.ZipFile(image_dir / "photos.zip") as zf:
+            assert len(media_parts(zf.read("员工77_合同.docx"))) == 1
+        print("[图片缓存] 按行预读，缓存不随行数增长 [OK]")
+    
+    print("\n>>> 图片变量测试通过！")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    test_image()
@@ -0,0 +1,131 @@
+"""
+测试Jinja模板（docxtpl语法）预编译
+与逐行创建 DocxTemplate 渲染的结果逐元素对比：变量、条件、循环、被拆成多个run的标签、页眉、特殊字符
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import time
+from io import BytesIO
+from docx import Document
+from docxtpl import DocxTemplate
+from jinja2.exceptions import SecurityError
+
+from src.models.schemas import TemplateConfig
+from src.services.jinja_template import create_jinja_env
+from src.services.word_service import word_service
+
+
+def create_jinja_contract():
+    """含变量、条件、段落循环、表格行循环和页眉变量的合同"""
+    doc = Document()
+    doc.sections[0].header.paragraphs[0].text = "合同编号：{{ 合同编号 }}"
+    
+    p = doc.add_paragraph("甲方：")
+    p.add_run("{{ 公").bold = True
+    p.add_run("司 }}")
+    doc.add_paragraph("乙方：{{ 姓名 }}{% if 性别 == '男' %}先生{% else %}女士{% endif %}")
+    doc.add_paragraph("{%p for item in 备注.split('；') %}")
+    doc.add_paragraph("· {{ item }}")
+    doc.add_paragraph("{%p endfor %}")
+    
+    table = doc.add_table(rows=3, cols=2)
+    table.cell(0, 0).text = "{%tr for n in range(数量|int) %}"
+    table.cell(1, 0).text = "第{{ n + 1 }}期"
+    table.cell(1, 1).text = "{{ 金额 }}"
+    table.cell(2, 0).text = "{%tr endfor %}"
+    
+    output = BytesIO()
+    doc.save(output)
+    return output.getvalue()
+
+
+def document_texts(docx_bytes: bytes):
+    doc = Document(BytesIO(docx_bytes))
+    return [(elem_id, element.text) for elem_id, _, element in word_service.iter_elements(doc)]
+
+
+def render_by_docxtpl(template_bytes: bytes, data: dict) -> bytes:
+    """逐行创建 DocxTemplate 的渲染方式"""
+    tpl = DocxTemplate(BytesIO(template_bytes))
+    tpl.render(data, create_jinja_env())
+    output = BytesIO()
+    tpl.save(output)
+    return output.getvalue()
+
+
+def test_jinja_template():
+    """测试Jinja模板预编译"""
+    print("=" * 60)
+    print("测试Jinja模板预编译")
+    print("=" * 60)
+    
+    template_bytes = create_jinja_contract()
+    variables = word_service.scan_jinja_variables(template_bytes)
+    print(f"\n识别变量: {variables}")
+    assert variables == ["公司", "合同编号", "备注", "姓名", "性别", "数量", "金额"]
+    
+    plain = Document()
+    plain.add_paragraph("姓名：【姓名】")
+    output = BytesIO()
+    plain.save(output)
+    assert word_service.scan_jinja_variables(output.getvalue()) is None
+    
+    config = TemplateConfig("t1", "劳动合同", "a.docx", "t1_a.docx", jinja_variables=variables)
+    assert config.get_mapping()["type"] == "jinja"
+    assert config.get_mapping()["data"]["姓名"] == "{{ 姓名 }}"
+    assert TemplateConfig.from_dict(config.to_dict()).jinja_variables == variables
+    
+    compiled = word_service.compile_config(config, template_bytes, key="k")
+    rows = [
+        {"合同编号": "HT-001", "公司": "甲公司", "姓名": "张三", "性别": "男",
+         "备注": "试用期三个月；含五险一金", "数量": "2", "金额": "1000"},
+        {"合同编号": "HT-002", "公司": "R&D <研发> 公司", "姓名": "李四", "性别": "女",
+         "备注": "第一行\n第二行", "数量": "0", "金额": ""},
+    ]
+    for data in rows:
+        result = compiled.render(data)
+        assert document_texts(result) == document_texts(render_by_docxtpl(template_bytes, data))
+    
+    texts = dict(document_texts(compiled.render(rows[0])))
+    assert texts["header_0_0"] == "合同编号：HT-001"
+    assert texts["para_0"] == "甲方：甲公司"
+    assert texts["para_1"] == "乙方：张三先生"
+    assert [t for _, t in document_texts(compiled.render(rows[0])) if t.startswith("·")] == [
+        "· 试用期三个月", "· 含五险一金"
+    ]
+    texts = dict(document_texts(compiled.render(rows[1])))
+    assert texts["para_0"] == "甲方：R&D <研发> 公司"
+    print("变量 / 条件 / 循环 / 页眉 / 特殊字符与 DocxTemplate 一致 [OK]")
+    
+    # 上传的模板在沙箱中执行，不能通过内部属性访问任意Python对象
+    escape = Document()
+    escape.add_paragraph("{{ ''.__class__.__mro__[1].__subclasses__()|length }}")
+    output = BytesIO()
+    escape.save(output)
+    try:
+        word_service.compile_jinja_template(output.getvalue()).render({})
+    except SecurityError as e:
+        print(f"沙箱拦截: {e} [OK]")
+    else:
+        raise AssertionError("模板访问内部属性未被拦截")
+    
+    batch = rows * 25
+    start = time.perf_counter()
+    for data in batch:
+        render_by_docxtpl(template_bytes, data)
+    per_row_time = time.perf_counter() - start
+    start = time.perf_counter()
+    compiled = word_service.compile_jinja_template(template_bytes)
+    files = word_service.batch_generate_compiled(compiled, batch)
+    compiled_time = time.perf_counter() - start
+    assert len(files) == len(batch)
+    print(f"{len(batch)} 份: 逐行 DocxTemplate {per_row_time:.2f}s，预编译 {compiled_time:.2f}s")
+    
+    print("\n>>> Jinja模板测试通过！")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    test_jinja_template()
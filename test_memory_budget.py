@@ -0,0 +1,91 @@
+"""
+测试生成任务内存预算
+覆盖：任务预算限流（暂存量不超过预算 + 一份文档）、全局预算超出时写入临时文件、
+中止后删除临时文件、各阶段峰值与进程峰值内存统计、任务结束后注销
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import tempfile
+import time
+import zipfile
+
+from src.services.generation_pipeline import GenerationPipeline
+from src.services.memory_budget import MemoryBudget, process_rss
+
+DOC_SIZE = 100_000
+
+
+def rows(count: int):
+    for i in range(count):
+        yield {"姓名": f"员工{i}"}
+
+
+def render(data, idx):
+    return [(f"{data['姓名']}.docx", bytes([idx % 256]) * DOC_SIZE)]
+
+
+def test_memory_budget():
+    """测试内存预算"""
+    print("=" * 60)
+    print("测试内存预算")
+    print("=" * 60)
+    
+    assert process_rss() > 0
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        
+        # 任务预算只够暂存3份文档：渲染阶段等待归档释放
+        budget = MemoryBudget(limit=1 << 40)
+        job = budget.job(limit=3 * DOC_SIZE)
+        assert budget.stats()["jobs"] == 1
+        result = GenerationPipeline(render, renderers=4, queue_depth=50, memory=job).run(rows(200), tmp / "a.zip")
+        assert result.documents == 200
+        assert result.memory["stages"]["renderer"] <= 3 * DOC_SIZE + DOC_SIZE
+        assert result.memory["peak_total"] > 0 and result.memory["spilled"] == 0
+        assert result.memory["peak_rss"] > 0
+        assert budget.stats()["jobs"] == 0
+        with zipfile.ZipFile(tmp / "a.zip") as zf:
+            assert zf.read("员工7.docx") == bytes([7]) * DOC_SIZE
+        print(f"[任务预算] 文档暂存峰值 {result.memory['stages']['renderer']} 字节 [OK]")
+        
+        # 进程内存超出全局预算：文档先写入临时文件，归档后删除
+        budget = MemoryBudget(limit=1)
+        result = GenerationPipeline(render, renderers=2, memory=budget.job()).run(rows(20), tmp / "b.zip")
+        assert result.memory["spilled"] == 20
+        assert result.memory["spilled_bytes"] == 20 * DOC_SIZE
+        with zipfile.ZipFile(tmp / "b.zip") as zf:
+            assert len(zf.namelist()) == 20
+            assert zf.read("员工3.docx") == bytes([3]) * DOC_SIZE
+        assert not list(tmp.glob(".spill_*"))
+        print(f"[全局预算] 写入临时文件 {result.memory['spilled']} 份 [OK]")
+        
+        # 中止后不留下临时文件
+        def broken_rows():
+            yield from rows(10)
+            time.sleep(0.3)
+            raise IOError("disk error")
+        
+        def stuck_render(data, idx):
+            if idx >= 5:
+                time.sleep(0.05)
+            return render(data, idx)
+        
+        try:
+            GenerationPipeline(stuck_render, renderers=2, memory=MemoryBudget(limit=1).job()).run(
+                broken_rows(), tmp / "c.zip"
+            )
+            assert False, "应当抛出异常"
+        except IOError:
+            pass
+        assert not list(tmp.glob(".spill_*")) and not (tmp / "c.zip").exists()
+        print("[出错中止] 无临时文件残留 [OK]")
+    
+    print("\n>>> 内存预算测试通过！")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    test_memory_budget()
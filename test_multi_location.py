@@ -0,0 +1,91 @@
+"""
+测试同一变量多处出现
+覆盖：同一段落中多处位置（替换值长度不同）、页眉与正文、表格单元格、追加位置，逐行替换/预编译/流式编译结果一致
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import tempfile
+from io import BytesIO
+from docx import Document
+
+from src.models.schemas import add_location, group_locations
+from src.services.artifact_store import ArtifactStore
+from src.services.streaming_compiler import StreamingCompiler
+from src.services.word_service import word_service
+
+
+def create_repeated_name_doc():
+    """姓名在页眉、同一段落两次、签字栏单元格中出现，同一段落还有日期"""
+    doc = Document()
+    doc.sections[0].header.paragraphs[0].text = "员工：陈长"
+    p = doc.add_paragraph("乙方陈长同意，")
+    p.add_run("由陈长本人于2024年1月1日签字。").bold = True
+    table = doc.add_table(rows=1, cols=2)
+    table.cell(0, 1).text = "签字：\n陈长"
+    
+    output = BytesIO()
+    doc.save(output)
+    return output.getvalue()
+
+
+def loc(element_id: str, start: int, text: str):
+    return {"element_id": element_id, "start": start, "end": start + len(text),
+            "length": len(text), "original_text": text}
+
+
+def result_texts(docx_bytes: bytes):
+    doc = Document(BytesIO(docx_bytes))
+    return {elem_id: element.text for elem_id, _, element in word_service.iter_elements(doc)}
+
+
+def test_multi_location():
+    """测试同一变量多处位置一次替换"""
+    print("=" * 60)
+    print("测试同一变量多处出现")
+    print("=" * 60)
+    
+    template_bytes = create_repeated_name_doc()
+    mapping = {}
+    add_location(mapping, "姓名", loc("para_0", 2, "陈长"))
+    add_location(mapping, "日期", loc("para_0", 12, "2024年1月1日"))
+    add_location(mapping, "姓名", loc("para_0", 8, "陈长"))
+    add_location(mapping, "姓名", loc("para_0", 8, "陈长"))
+    add_location(mapping, "姓名", loc("header_0_0", 3, "陈长"))
+    add_location(mapping, "姓名", loc("cell_0_0_1", 4, "陈长"))
+    assert len(mapping["姓名"]) == 4
+    
+    groups = group_locations(mapping)
+    assert [item[1]["start"] for item in groups["para_0"]] == [12, 8, 2]
+    
+    compiled = word_service.compile_template(template_bytes, location_mapping=mapping)
+    assert len(compiled.slots) == 5
+    with tempfile.TemporaryDirectory() as tmp:
+        compiler = StreamingCompiler(store=ArtifactStore(Path(tmp)), min_bytes=0)
+        streamed = compiler.compile_to_artifact("multi", template_bytes, mapping, key="k")
+        
+        # 替换值包含原文本时，按原文本重新查找会命中已替换的内容，只能依赖从后往前的偏移
+        for name in ["欧阳娜娜", "陈长明"]:
+            data = {"姓名": name, "日期": "2025年12月31日"}
+            expected = {
+                "header_0_0": f"员工：{name}",
+                "para_0": f"乙方{name}同意，由{name}本人于2025年12月31日签字。",
+                "cell_0_0_1": f"签字：\n{name}",
+            }
+            for label, docx_bytes in [
+                ("逐行替换", word_service.replace_preserving_format(template_bytes, data, location_mapping=mapping)),
+                ("预编译", compiled.render(data)),
+                ("流式编译", streamed.render(data)),
+            ]:
+                texts = result_texts(docx_bytes)
+                for elem_id, text in expected.items():
+                    assert texts[elem_id] == text, (label, texts[elem_id])
+                print(f"[{label}] {texts['para_0']} [OK]")
+    
+    print("\n>>> 多处位置测试通过！")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    test_multi_location()
@@ -0,0 +1,80 @@
+"""
+测试模板规范化（合并碎片run）
+覆盖：rsid/拼写标记清理、格式不同的run不合并、映射保持可用
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from io import BytesIO
+from docx import Document
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+
+from src.services.word_service import word_service
+
+
+def create_fragmented_contract():
+    """创建被Word切碎的合同：同格式文本拆成多个run，夹杂rsid和拼写标记"""
+    doc = Document()
+    para = doc.add_paragraph()
+    for i, text in enumerate(["乙方", "：", "陈", "长", "  电话：", "138", "0013", "8000"]):
+        run = para.add_run(text)
+        run._r.set(qn("w:rsidR"), f"00A1B2C{i}")
+        run._r.set(qn("w:rsidRPr"), "00FFEE01")
+        if text == "陈":
+            para._p.insert(list(para._p).index(run._r), OxmlElement("w:proofErr"))
+    
+    # 加粗的run格式不同，不能被合并
+    para.add_run("（签字）").bold = True
+    
+    output = BytesIO()
+    doc.save(output)
+    return output.getvalue()
+
+
+def test_normalize_template():
+    """测试规范化结果与生成"""
+    print("=" * 60)
+    print("测试模板规范化")
+    print("=" * 60)
+    
+    template_bytes = create_fragmented_contract()
+    text = Document(BytesIO(template_bytes)).paragraphs[0].text
+    start = text.index("陈长")
+    mapping = {
+        "姓名": {
+            "element_id": "para_0", "element_type": "paragraph",
+            "start": start, "end": start + 2, "length": 2, "original_text": "陈长"
+        }
+    }
+    
+    normalized, new_mapping, stats = word_service.normalize_template(template_bytes, mapping)
+    print(f"\n统计: {stats}")
+    
+    para = Document(BytesIO(normalized)).paragraphs[0]
+    print(f"run: {[r.text for r in para.runs]}")
+    
+    assert para.text == text
+    assert [r.text for r in para.runs] == ["乙方：陈长  电话：13800138000", "（签字）"]
+    assert para.runs[1].bold
+    assert stats["proof_marks"] == 1 and stats["rsid_attrs"] > 0
+    assert b"rsidR=" not in normalized and new_mapping == mapping
+    
+    result_bytes = word_service.replace_preserving_format(
+        normalized, {"姓名": "张三"}, location_mapping=new_mapping
+    )
+    result_text = Document(BytesIO(result_bytes)).paragraphs[0].text
+    print(f"生成结果: {result_text!r}")
+    assert result_text == "乙方：张三  电话：13800138000（签字）"
+    
+    # 偏移失效的映射按原文本重新定位
+    stale = {"姓名": dict(mapping["姓名"], start=0, end=2)}
+    assert word_service.rebase_location_mapping(normalized, stale) == mapping
+    
+    print("\n>>> 模板规范化测试通过！")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    test_normalize_template()
@@ -0,0 +1,128 @@
+"""
+测试批量生成流水线
+覆盖：逐行读取Excel、生成结果写入压缩包、重名编号、背压（读取不会远超归档进度）、
+单行失败跳过、读取出错时中止且不留下输出文件、各阶段计数
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import datetime
+from io import BytesIO
+from docx import Document
+from openpyxl import Workbook
+
+from src.services.excel_service import excel_service
+from src.services.generation_pipeline import GenerationPipeline
+from src.services.word_service import word_service
+from src.utils import unique_path
+
+
+def create_template():
+    doc = Document()
+    doc.add_paragraph("乙方：陈长，入职日期：2024-01-01")
+    output = BytesIO()
+    doc.save(output)
+    return output.getvalue()
+
+
+def create_excel(path: Path, rows: int):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["员工姓名", "入职日期"])
+    for i in range(rows):
+        ws.append([f"员工{i % 7}", datetime(2025, 1, 1 + i % 28)])
+        if i == 3:
+            ws.append([None, None])  # 空行跳过
+    wb.save(path)
+
+
+def test_pipeline():
+    """测试批量生成流水线"""
+    print("=" * 60)
+    print("测试批量生成流水线")
+    print("=" * 60)
+    
+    mapping = {
+        "姓名": {"element_id": "para_0", "start": 3, "end": 5, "length": 2, "original_text": "陈长"},
+        "日期": {"element_id": "para_0", "start": 11, "end": 21, "length": 10, "original_text": "2024-01-01"},
+    }
+    compiled = word_service.compile_template(create_template(), location_mapping=mapping)
+    columns = {"姓名": "员工姓名", "日期": "入职日期"}
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        
+        # 逐行读取Excel
+        create_excel(tmp / "data.xlsx", 40)
+        records = list(excel_service.iter_records(tmp / "data.xlsx"))
+        assert len(records) == 40
+        assert records[1] == {"员工姓名": "员工1", "入职日期": "2025-01-02"}
+        print("[逐行读取] 40 行，空行跳过，日期格式化 [OK]")
+        
+        # 读取 → 渲染 → 归档
+        rows = ({var: record[col] for var, col in columns.items()} for record in records)
+        render = lambda data, idx: word_service.render_row_files([("合同", compiled)], data, idx)
+        result = GenerationPipeline(render, renderers=3, queue_depth=4).run(rows, tmp / "out.zip")
+        assert result.rows == 40 and result.documents == 40 and result.failed == 0
+        with zipfile.ZipFile(tmp / "out.zip") as zf:
+            names = zf.namelist()
+            assert len(set(names)) == 40
+            assert "员工1_合同.docx" in names and "员工1_合同_2.docx" in names
+            doc = Document(BytesIO(zf.read("员工1_合同.docx")))
+            assert doc.paragraphs[0].text == "乙方：员工1，入职日期：2025-01-02"
+        assert set(result.stages) == {"reader", "renderer", "archiver"}
+        assert result.bottleneck in result.stages
+        print(f"[流水线] {result.documents} 份，瓶颈 {result.bottleneck} [OK]")
+        
+        # 背压：渲染慢时读取阶段阻塞等待，领先的行数不超过队列深度 + 渲染线程数
+        archived = {"count": 0}
+        lead = []
+        
+        def source():
+            for i in range(60):
+                lead.append(i - archived["count"])
+                yield {"姓名": f"员工{i}"}
+        
+        def slow_render(data, idx):
+            time.sleep(0.002)
+            archived["count"] += 1
+            if idx == 5:
+                raise ValueError("bad row")
+            return [(f"{idx}.txt", b"x")]
+        
+        pipeline = GenerationPipeline(slow_render, renderers=2, queue_depth=3)
+        result = pipeline.run(source(), tmp / "slow.zip")
+        assert max(lead) <= 3 + 2 + 2
+        assert result.stages["reader"]["blocked"] > 0
+        assert result.failed == 1 and result.documents == 59
+        print(f"[背压] 读取最多领先 {max(lead)} 行，失败行跳过 [OK]")
+        
+        # 读取出错时中止，不留下输出文件
+        def broken_source():
+            yield {"姓名": "张三"}
+            raise IOError("disk error")
+        
+        try:
+            GenerationPipeline(render, renderers=2).run(broken_source(), tmp / "broken.zip")
+            assert False, "应当抛出异常"
+        except IOError:
+            pass
+        assert not any("broken" in p.name for p in tmp.iterdir())
+        assert threading.active_count() < 10
+        print("[出错中止] 无输出文件 [OK]")
+    
+    used = {}
+    assert [unique_path(p, used) for p in ["a.docx", "a.docx", "a_2.docx", "a.docx", "张三/合同"]] == \
+        ["a.docx", "a_2.docx", "a_2_2.docx", "a_3.docx", "张三/合同"]
+    
+    print("\n>>> 流水线测试通过！")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    test_pipeline()
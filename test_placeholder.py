@@ -0,0 +1,82 @@
+"""
+测试【变量名】占位符自动识别
+覆盖：跨run拆分、重复出现、表格单元格、页眉
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent))
+
+from io import BytesIO
+from docx import Document
+
+from src.services.word_service import word_service
+
+
+def create_placeholder_contract():
+    """创建带占位符的合同，部分占位符被拆分到多个run"""
+    doc = Document()
+    doc.sections[0].header.paragraphs[0].text = "合同编号：【合同编号】"
+    
+    doc.add_paragraph("劳动合同")
+    
+    # 模拟Word把【姓名】拆成三个run
+    para = doc.add_paragraph("乙方：")
+    para.add_run("【姓")
+    para.add_run("名")
+    para.add_run("】")
+    para.add_run("  身份证号：【身份证号】")
+    
+    table = doc.add_table(rows=1, cols=2)
+    table.cell(0, 0).text = "签字"
+    cell = table.cell(0, 1)
+    cell.text = "甲方代表"
+    cell.add_paragraph("乙方：【姓名】")
+    
+    output = BytesIO()
+    doc.save(output)
+    return output.getvalue()
+
+
+def test_scan_placeholders():
+    """测试占位符扫描与生成"""
+    print("=" * 60)
+    print("测试占位符自动识别")
+    print("=" * 60)
+    
+    template_bytes = create_placeholder_contract()
+    mapping = word_service.scan_placeholders(template_bytes)
+    
+    print("\n识别结果:")
+    for var_name, loc in mapping.items():
+        print(f"  {var_name}: {loc}")
+    
+    assert set(mapping) == {"合同编号", "姓名", "身份证号"}
+    assert isinstance(mapping["姓名"], list) and len(mapping["姓名"]) == 2
+    assert mapping["合同编号"]["element_id"] == "header_0_0"
+    
+    data = {"合同编号": "HT-001", "姓名": "张三", "身份证号": "110101199001011234"}
+    result_bytes = word_service.replace_preserving_format(
+        template_bytes, data, location_mapping=mapping
+    )
+    
+    result_doc = Document(BytesIO(result_bytes))
+    body = "\n".join(p.text for p in result_doc.paragraphs)
+    cell_text = result_doc.tables[0].cell(0, 1).text
+    header = result_doc.sections[0].header.paragraphs[0].text
+    
+    print("\n生成结果:")
+    print(f"  正文: {body!r}")
+    print(f"  单元格: {cell_text!r}")
+    print(f"  页眉: {header!r}")
+    
+    assert "乙方：张三  身份证号：110101199001011234" in body
+    assert cell_text == "甲方代表\n乙方：张三"
+    assert header == "合同编号：HT-001"
+    assert "【" not in body + cell_text + header
+    
+    print("\n>>> 占位符识别测试通过！")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    test_scan_placeholders()
@@ -0,0 +1,113 @@
+"""
+测试表格循环行
+覆盖：按明细记录复制行、无明细数据保留原行、空明细删除行、明细分组关联、流式编译一致
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import tempfile
+from io import BytesIO
+import pandas as pd
+from docx import Document
+
+from src.config import DETAIL_DATA_KEY
+from src.models.schemas import split_repeat_variables
+from src.services.artifact_store import ArtifactStore
+from src.services.excel_service import excel_service
+from src.services.streaming_compiler import StreamingCompiler
+from src.services.word_service import word_service
+
+
+def create_detail_contract():
+    """合同正文 + 明细表（表头、循环行、合计行）"""
+    doc = Document()
+    doc.add_paragraph("合同编号：【合同编号】")
+    table = doc.add_table(rows=3, cols=3)
+    for c, text in enumerate(["品名", "数量", "单价"]):
+        table.cell(0, c).text = text
+    for c, text in enumerate(["【品名】", "【数量】", "【单价】"]):
+        table.cell(1, c).text = text
+    table.cell(2, 0).text = "合计：【合计】"
+    
+    output = BytesIO()
+    doc.save(output)
+    return output.getvalue()
+
+
+def table_rows(docx_bytes: bytes):
+    table = Document(BytesIO(docx_bytes)).tables[0]
+    return [[cell.text for cell in row.cells] for row in table.rows]
+
+
+def test_repeat_rows():
+    """测试循环行编译与渲染"""
+    print("=" * 60)
+    print("测试表格循环行")
+    print("=" * 60)
+    
+    template_bytes = create_detail_contract()
+    mapping = word_service.scan_placeholders(template_bytes)
+    repeat_rows = [{"name": "明细", "table_index": 0, "row_index": 1}]
+    
+    groups = split_repeat_variables(mapping, repeat_rows)
+    assert sorted(groups[""]) == ["合同编号", "合计"]
+    assert groups["明细"] == ["品名", "数量", "单价"]
+    
+    # 明细表按关联列分组，整数关联值被读成小数时仍能对上
+    master_df = pd.DataFrame({"编号": ["HT-1", "HT-2", "HT-3"], "金额": [30, 0, 5]})
+    detail_df = pd.DataFrame({
+        "合同": ["HT-1", "HT-1", "HT-3", None],
+        "商品": ["苹果", "梨", "桃", "孤立"],
+        "件数": [1, 2, 1, 9],
+        "价格": [10.5, 5, 5, 1],
+    })
+    column_mapping = {"品名": "商品", "数量": "件数", "单价": "价格"}
+    detail_groups = excel_service.group_details(detail_df, "合同", column_mapping)
+    assert sorted(detail_groups) == ["HT-1", "HT-3"]
+    assert detail_groups["HT-1"][1] == {"品名": "梨", "数量": "2", "单价": "5.0"}
+    assert excel_service.format_keys(pd.DataFrame({"k": [1.0, None]}), "k").tolist() == ["1", ""]
+    
+    rows = [{"合同编号": key, "合计": str(total)} for key, total in zip(master_df["编号"], master_df["金额"])]
+    excel_service.attach_details(rows, excel_service.format_keys(master_df, "编号").tolist(), "明细", detail_groups)
+    assert [len(row[DETAIL_DATA_KEY]["明细"]) for row in rows] == [2, 0, 1]
+    
+    compiled = word_service.compile_template(template_bytes, location_mapping=mapping, repeat_rows=repeat_rows)
+    
+    # 每条明细复制一行，表头和合计行不动
+    result = table_rows(compiled.render(rows[0]))
+    print(f"\n两条明细: {result}")
+    assert result == [
+        ["品名", "数量", "单价"],
+        ["苹果", "1", "10.5"],
+        ["梨", "2", "5.0"],
+        ["合计：30", "", ""],
+    ]
+    
+    # 明细为空时删除循环行；没有明细数据时按普通行填充一次
+    assert table_rows(compiled.render(rows[1])) == [["品名", "数量", "单价"], ["合计：0", "", ""]]
+    plain = table_rows(compiled.render({"合同编号": "HT-9", "品名": "苹果", "数量": "1", "单价": "1"}))
+    assert plain[1] == ["苹果", "1", "1"]
+    print("空明细 / 无明细数据 [OK]")
+    
+    # 保存再加载后的编译产物和流式编译结果一致
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ArtifactStore(Path(tmp))
+        store.save("repeat", compiled)
+        loaded = store.load("repeat", compiled.key)
+        compiler = StreamingCompiler(store=store, min_bytes=0)
+        streamed = compiler.compile_to_artifact(
+            "repeat_stream", template_bytes, mapping, key="stream", repeat_rows=repeat_rows
+        )
+        for row in rows:
+            expected = table_rows(compiled.render(row))
+            assert table_rows(loaded.render(row)) == expected
+            assert table_rows(streamed.render(row)) == expected
+    print("编译产物加载 / 流式编译一致 [OK]")
+    
+    print("\n>>> 表格循环行测试通过！")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    test_repeat_rows()
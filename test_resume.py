@@ -0,0 +1,186 @@
+"""
+测试中断后续跑
+覆盖：读取出错中止后保留进度日志与未完成的压缩包、日志最后一行写了一半、
+续跑只重做剩下的行且每份文档只出现一次、已写入内容损坏时从损坏处起重做、分卷与 tar.gz 续写、完成后删除任务目录、
+同一任务同时只能运行一次
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+
+from src.services.generation_pipeline import GenerationPipeline
+from src.services.job_journal import JobJournal, JobLocked, job_fingerprint
+
+ROWS = 30
+
+
+def rows(fail_at=None):
+    for i in range(ROWS):
+        if i == fail_at:
+            time.sleep(0.3)  # 等已读取的行归档
+            raise IOError("server restart")
+        yield {"姓名": f"员工{i}"}
+
+
+def make_render(rendered):
+    def render(data, idx):
+        rendered.append(idx)
+        return [(f"{data['姓名']}/合同.docx", f"{idx}".encode() * 3000), (f"{data['姓名']}/附件.docx", b"a")]
+    return render
+
+
+def expected():
+    members = {}
+    for i in range(ROWS):
+        members[f"员工{i}/合同.docx"] = f"{i}".encode() * 3000
+        members[f"员工{i}/附件.docx"] = b"a"
+    return members
+
+
+def read_zip(paths):
+    members = {}
+    for path in paths:
+        with zipfile.ZipFile(path) as zf:
+            assert zf.testzip() is None
+            names = zf.namelist()
+            assert len(names) == len(set(names))
+            members.update({name: zf.read(name) for name in names})
+    return members
+
+
+def interrupted(journal, output_path, **kwargs):
+    """运行到第20行时读取出错（模拟服务重启）"""
+    rendered = []
+    try:
+        GenerationPipeline(make_render(rendered), renderers=3, journal=journal, **kwargs).run(
+            rows(fail_at=20), output_path
+        )
+        assert False, "应当抛出异常"
+    except IOError:
+        pass
+    return rendered
+
+
+def test_resume():
+    """测试中断后续跑"""
+    print("=" * 60)
+    print("测试中断后续跑")
+    print("=" * 60)
+    
+    assert job_fingerprint({"a": 1, "b": [1, 2]}) == job_fingerprint({"b": [1, 2], "a": 1})
+    assert job_fingerprint({"a": 1}) != job_fingerprint({"a": 2})
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        
+        # 中断：保留日志与临时分卷，不产生输出文件
+        journal = JobJournal("job1", jobs_dir=tmp / "jobs")
+        interrupted(journal, tmp / "out.zip")
+        assert journal.exists() and not (tmp / "out.zip").exists()
+        done = journal.completed_rows()
+        assert len(done) == len(set(done)) and 0 < len(done) <= 20
+        assert list((tmp / "jobs" / "job1").glob("volume_*.tmp"))
+        print(f"[中断] 已完成 {len(done)} 行 [OK]")
+        
+        # 模拟写到一半被终止：压缩包末尾有未记录的数据，日志最后一行不完整
+        volume = tmp / "jobs" / "job1" / "volume_1.tmp"
+        with open(volume, "ab") as f:
+            f.write(b"PK\x03\x04partial")
+        with open(journal.journal_path, "a", encoding="utf-8") as f:
+            f.write('{"row": 99, "status": "do')
+        assert len(journal.load()) == len(done)
+        
+        # 续跑：只渲染剩下的行
+        rendered = []
+        result = GenerationPipeline(make_render(rendered), renderers=3, journal=journal).run(rows(), tmp / "out.zip")
+        assert sorted(rendered) == sorted(set(range(ROWS)) - set(done))
+        assert result.resumed == len(done) and result.documents == 2 * ROWS
+        assert read_zip(result.output_paths) == expected()
+        assert not (tmp / "jobs" / "job1").exists()
+        print(f"[续跑] 跳过 {result.resumed} 行，重做 {len(rendered)} 行，每份文档只出现一次 [OK]")
+        
+        # 已写入的内容损坏：从损坏的成员起全部重做
+        journal = JobJournal("job2", jobs_dir=tmp / "jobs")
+        interrupted(journal, tmp / "bad.zip")
+        entries = journal.load()
+        victim = entries[len(entries) // 2]["files"][0]
+        volume = tmp / "jobs" / "job2" / "volume_1.tmp"
+        data = bytearray(volume.read_bytes())
+        data[victim["end"] - 1] ^= 0xFF
+        volume.write_bytes(bytes(data))
+        
+        rendered = []
+        result = GenerationPipeline(make_render(rendered), renderers=3, journal=journal).run(rows(), tmp / "bad.zip")
+        kept = [entry["row"] for entry in entries[:len(entries) // 2]]
+        assert result.resumed == len(kept)
+        assert sorted(rendered) == sorted(set(range(ROWS)) - set(kept))
+        assert read_zip(result.output_paths) == expected()
+        print(f"[损坏] 校验不符，保留前 {len(kept)} 行，其余重做 [OK]")
+        
+        # 分卷续写：已写满的卷重新生成中央目录
+        journal = JobJournal("job3", jobs_dir=tmp / "jobs")
+        interrupted(journal, tmp / "vol.zip", volume_mb=0.02)
+        assert len(list((tmp / "jobs" / "job3").glob("volume_*.tmp"))) > 1
+        result = GenerationPipeline(make_render([]), renderers=3, journal=journal, volume_mb=0.02).run(
+            rows(), tmp / "vol.zip"
+        )
+        assert len(result.output_paths) > 1
+        assert read_zip(result.output_paths) == expected()
+        print(f"[分卷] 续写后 {len(result.output_paths)} 卷 [OK]")
+        
+        # tar.gz 续写
+        journal = JobJournal("job4", jobs_dir=tmp / "jobs")
+        interrupted(journal, tmp / "out.tar.gz", archive_mode="tar")
+        result = GenerationPipeline(make_render([]), renderers=3, journal=journal, archive_mode="tar").run(
+            rows(), tmp / "out.tar.gz"
+        )
+        with tarfile.open(result.output_paths[0], "r:gz") as tf:
+            names = tf.getnames()
+            assert len(names) == len(set(names))
+            members = {m.name: tf.extractfile(m).read() for m in tf.getmembers()}
+        assert members == expected()
+        print("[tar.gz] 续写 [OK]")
+        
+        # 同一任务同时运行两次：后来的运行不能开始，也不会删除正在写入的分卷
+        first = JobJournal("job5", jobs_dir=tmp / "jobs")
+        first.start("same.zip", ROWS)
+        second = JobJournal("job5", jobs_dir=tmp / "jobs")
+        assert second.running() and not first.running()
+        slow = threading.Event()
+        
+        def slow_render(data, idx):
+            slow.wait(2)
+            return make_render([])(data, idx)
+        
+        outcome = {}
+        runner = threading.Thread(target=lambda: outcome.update(result=GenerationPipeline(
+            slow_render, renderers=3, journal=first
+        ).run(rows(), tmp / "same.zip")))
+        runner.start()
+        for attempt in (lambda: second.start("same.zip", ROWS),
+                        lambda: GenerationPipeline(make_render([]), journal=second).run(rows(), tmp / "same.zip"),
+                        second.remove):
+            try:
+                attempt()
+                assert False, "应当抛出 JobLocked"
+            except JobLocked:
+                pass
+        slow.set()
+        runner.join()
+        assert read_zip(outcome["result"].output_paths) == expected()
+        assert not (tmp / "jobs" / "job5").exists()
+        assert not second.running()
+        print("[加锁] 同一任务同时只运行一次 [OK]")
+    
+    print("\n>>> 续跑测试通过！")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    test_resume()
@@ -0,0 +1,143 @@
+"""
+测试生成任务调度
+覆盖：同时渲染的行数不超过槽位数、交互任务优先于批量任务、按用户公平分配（不按任务数）、
+用户权重、取消排队、流水线中的调度统计、任务结束后注销
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import tempfile
+import threading
+import time
+
+from src.services.generation_pipeline import GenerationPipeline
+from src.services.job_scheduler import JobScheduler
+
+
+def run_workers(tickets, seconds: float, threads_per_ticket: int = 3, work: float = 0.002):
+    """每个任务若干线程不停申请槽位，返回各任务取得的次数与同时运行的峰值"""
+    stop = threading.Event()
+    peak = {"running": 0}
+    
+    def loop(ticket):
+        while not stop.is_set():
+            if not ticket.acquire(stop):
+                return
+            peak["running"] = max(peak["running"], ticket.scheduler.running)
+            time.sleep(work)
+            ticket.release(work)
+    
+    threads = [threading.Thread(target=loop, args=(t,)) for t in tickets for _ in range(threads_per_ticket)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return [t.acquired for t in tickets], peak["running"]
+
+
+def test_scheduler():
+    """测试任务调度"""
+    print("=" * 60)
+    print("测试任务调度")
+    print("=" * 60)
+    
+    # 同一用户两个任务，另一用户一个任务：按用户平分，不按任务数
+    scheduler = JobScheduler(workers=2)
+    a1, a2, b = scheduler.job("alice"), scheduler.job("alice"), scheduler.job("bob")
+    (n1, n2, nb), peak = run_workers([a1, a2, b], 0.6)
+    assert peak <= 2
+    assert 0.8 < (n1 + n2) / nb < 1.25, (n1, n2, nb)
+    assert scheduler.stats()["queued"] == 0 and scheduler.running == 0
+    print(f"[公平分配] alice {n1}+{n2}，bob {nb}，同时渲染最多 {peak} 行 [OK]")
+    
+    # 用户权重
+    scheduler = JobScheduler(workers=2)
+    light, heavy = scheduler.job("alice"), scheduler.job("bob", weight=2.0)
+    (nl, nh), _ = run_workers([light, heavy], 0.6)
+    assert 1.6 < nh / nl < 2.5, (nl, nh)
+    print(f"[权重] 权重1: {nl}，权重2: {nh} [OK]")
+    
+    # 交互任务优先：批量任务占满唯一槽位时，交互任务的请求排在已排队的批量请求之前
+    scheduler = JobScheduler(workers=1, interactive_rows=5)
+    bulk = scheduler.job("alice", rows=10000)
+    single = scheduler.job("bob", rows=1)
+    assert (bulk.priority, single.priority) == ("bulk", "interactive")
+    assert bulk.acquire()
+    order = []
+    
+    def request(ticket, name):
+        ticket.acquire()
+        order.append(name)
+        ticket.release(0.01)
+    
+    waiting = [threading.Thread(target=request, args=(bulk, f"bulk{i}")) for i in range(3)]
+    for thread in waiting:
+        thread.start()
+    time.sleep(0.05)
+    waiting.append(threading.Thread(target=request, args=(single, "single")))
+    waiting[-1].start()
+    time.sleep(0.05)
+    stats = scheduler.stats()
+    assert stats["queued"] == 4 and stats["running"] == 1
+    assert {u["user"]: u["queued"] for u in stats["users"]} == {"alice": 3, "bob": 1}
+    bulk.release(0.01)
+    for thread in waiting:
+        thread.join()
+    assert order[0] == "single"
+    print(f"[优先级] 顺序 {order} [OK]")
+    
+    # 取消排队
+    assert bulk.acquire()
+    cancel = threading.Event()
+    cancel.set()
+    assert not single.acquire(cancel)
+    assert scheduler.stats()["queued"] == 0
+    bulk.release(0.01)
+    bulk.close()
+    single.close()
+    assert scheduler.stats()["users"] == [] and not scheduler.usage
+    print("[取消] 放弃排队 [OK]")
+    
+    # 流水线：批量任务运行中提交单份任务，单份任务很快完成
+    scheduler = JobScheduler(workers=2)
+    
+    def render(data, idx):
+        time.sleep(0.005)
+        return [(f"{data['name']}{idx}.txt", b"x")]
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        results = {}
+        
+        def run_bulk():
+            rows = ({"name": "bulk"} for _ in range(300))
+            results["bulk"] = GenerationPipeline(render, renderers=4, ticket=scheduler.job("alice", rows=300)).run(
+                rows, tmp / "bulk.zip"
+            )
+        
+        thread = threading.Thread(target=run_bulk)
+        thread.start()
+        time.sleep(0.2)
+        start = time.perf_counter()
+        single = GenerationPipeline(render, renderers=1, ticket=scheduler.job("bob", rows=1)).run(
+            iter([{"name": "single"}]), tmp / "single.zip"
+        )
+        single_elapsed = time.perf_counter() - start
+        thread.join()
+        
+        assert single.documents == 1 and results["bulk"].documents == 300
+        assert single.scheduling["priority"] == "interactive" and single.scheduling["acquired"] == 1
+        assert single_elapsed < results["bulk"].elapsed / 5
+        assert results["bulk"].scheduling["acquired"] == 300
+        assert scheduler.stats()["users"] == []
+        print(f"[流水线] 单份 {single_elapsed:.3f} 秒（批量 {results['bulk'].elapsed:.2f} 秒） [OK]")
+    
+    print("\n>>> 任务调度测试通过！")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    test_scheduler()
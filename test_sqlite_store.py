@@ -0,0 +1,81 @@
+"""
+测试SQLite模板存储：事务化保存/删除、并发读写、使用次数
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import tempfile
+import threading
+
+from src.models.schemas import TemplateConfig
+from src.services.template_service import TemplateService
+from src.services.template_store import SqliteTemplateStore
+from test_placeholder import create_placeholder_contract
+
+
+def test_sqlite_store():
+    """多线程同时保存、列出、计数，结果一致且不出现半截数据"""
+    print("=" * 60)
+    print("测试SQLite模板存储")
+    print("=" * 60)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SqliteTemplateStore(Path(tmp) / "templates.db")
+        service = TemplateService(store=store)
+        docx_bytes = create_placeholder_contract()
+        
+        errors = []
+        
+        def writer(n):
+            try:
+                for i in range(10):
+                    config = TemplateConfig(
+                        template_id=f"t{n}_{i}",
+                        template_name=f"模板{n}_{i}",
+                        original_filename="a.docx",
+                        template_filename=f"t{n}_{i}_a.docx",
+                        location_mapping={"姓名": {"element_id": "para_1", "start": 0, "end": 1}}
+                    )
+                    store.save_template(config, docx_bytes)
+                    service.record_usage(config.template_id)
+            except Exception as e:
+                errors.append(e)
+        
+        def reader():
+            try:
+                for _ in range(30):
+                    for config in service.list_templates():
+                        assert config.location_mapping
+            except Exception as e:
+                errors.append(e)
+        
+        threads = [threading.Thread(target=writer, args=(n,)) for n in range(4)]
+        threads += [threading.Thread(target=reader) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        
+        print(f"\n[并发] 错误: {errors}")
+        assert not errors
+        assert service.count_templates() == 40
+        assert len(service.list_templates()) == 40
+        assert store.find_by_name("模板1_3")[0].template_id == "t1_3"
+        assert service.load_config("t2_5").usage_count == 1
+        assert service.get_template_bytes("t2_5") == docx_bytes
+        assert service.get_content_hash("t2_5")
+        
+        assert service.delete_template("t2_5")
+        assert service.load_config("t2_5") is None
+        assert service.get_template_bytes("t2_5") is None
+        assert service.count_templates() == 39
+        
+        print(f"  模板数量: {service.count_templates()}")
+        print("\n>>> SQLite存储测试通过！")
+    
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    test_sqlite_store()
@@ -0,0 +1,80 @@
+"""
+测试大模板流式编译
+与完整解析的预编译结果逐元素对比：正文段落、合并单元格表格、页眉、书签绑定
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import tempfile
+import zipfile
+from io import BytesIO
+from docx import Document
+
+from src.services.artifact_store import ArtifactStore
+from src.services.streaming_compiler import StreamingCompiler
+from src.services.word_service import word_service
+from test_placeholder import create_placeholder_contract
+
+
+def create_long_contract():
+    """在占位符合同后追加大量条款和一个带合并单元格的表格"""
+    doc = Document(BytesIO(create_placeholder_contract()))
+    for i in range(300):
+        doc.add_paragraph(f"第{i + 1}条 双方应遵守本合同约定。")
+    doc.add_paragraph("附件签收人：【姓名】")
+    
+    table = doc.add_table(rows=2, cols=3)
+    table.cell(0, 0).merge(table.cell(0, 1)).text = "合并表头"
+    table.cell(0, 2).text = "编号：【合同编号】"
+    table.cell(1, 2).text = "【身份证号】"
+    
+    output = BytesIO()
+    doc.save(output)
+    return output.getvalue()
+
+
+def element_texts(docx_bytes: bytes):
+    doc = Document(BytesIO(docx_bytes))
+    return [(elem_id, element.text) for elem_id, _, element in word_service.iter_elements(doc)]
+
+
+def test_streaming_compile():
+    """流式编译与完整解析结果一致"""
+    print("=" * 60)
+    print("测试流式编译")
+    print("=" * 60)
+    
+    template_bytes = create_long_contract()
+    data = {"合同编号": "HT-001", "姓名": "张三", "身份证号": "110101199001011234"}
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        compiler = StreamingCompiler(store=ArtifactStore(Path(tmp)), min_bytes=0)
+        mapping = word_service.scan_placeholders(template_bytes)
+        bound_bytes, bound = word_service.bind_bookmarks(template_bytes, mapping)
+        
+        for label, docx_bytes, location_mapping in [
+            ("偏移定位", template_bytes, mapping),
+            ("书签定位", bound_bytes, bound),
+        ]:
+            assert compiler.should_stream(docx_bytes, {"type": "location", "data": location_mapping})
+            
+            expected = word_service.compile_template(docx_bytes, location_mapping=location_mapping)
+            streamed = compiler.compile_to_artifact("stream", docx_bytes, location_mapping, key=label)
+            
+            assert sorted(streamed.slots) == sorted(expected.slots)
+            result = streamed.render(data)
+            assert element_texts(result) == element_texts(expected.render(data))
+            
+            with zipfile.ZipFile(BytesIO(result)) as zf:
+                document_xml = zf.read("word/document.xml").decode("utf-8")
+            assert document_xml.count("xmlns:w=") == 1
+            assert "【" not in "".join(text for _, text in element_texts(result))
+            print(f"\n[{label}] {len(streamed.slots)} 个槽位，与完整解析结果一致 [OK]")
+    
+    print("\n>>> 流式编译测试通过！")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    test_streaming_compile()
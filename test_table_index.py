@@ -0,0 +1,98 @@
+"""
+测试表格单元格直接索引
+覆盖：横向/纵向合并单元格的编号与 python-docx row.cells 一致、别名不重复展示、大表格性能
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import time
+from io import BytesIO
+from docx import Document
+
+from src.services.word_service import word_service
+
+
+def create_merged_table_doc(extra_rows: int = 0):
+    """3列表格：首行横向合并，首列第2~3行纵向合并"""
+    doc = Document()
+    table = doc.add_table(rows=3 + extra_rows, cols=3)
+    table.cell(0, 0).merge(table.cell(0, 1)).text = "表头"
+    table.cell(0, 2).text = "备注"
+    table.cell(1, 0).merge(table.cell(2, 0)).text = "姓名：【姓名】"
+    table.cell(1, 1).text = "A"
+    table.cell(2, 2).text = "【身份证号】"
+    for i in range(extra_rows):
+        table.cell(3 + i, 0).text = f"第{i}行"
+    
+    output = BytesIO()
+    doc.save(output)
+    return output.getvalue()
+
+
+def create_vmerge_table(rows: int):
+    """首列从头到尾纵向合并的4列表格"""
+    table = Document().add_table(rows=rows, cols=4)
+    for row_idx, tr in enumerate(table._tbl.tr_lst):
+        tr.tc_lst[0].get_or_add_tcPr().vMerge_val = "restart" if row_idx == 0 else "continue"
+    return table
+
+
+def legacy_cell_ids(table, table_idx):
+    """python-docx 逐行计算网格的编号方式"""
+    return [
+        (f"cell_{table_idx}_{r}_{c}", cell._tc)
+        for r, row in enumerate(table.rows)
+        for c, cell in enumerate(row.cells)
+    ]
+
+
+def test_table_index():
+    """测试单元格编号兼容与去重"""
+    print("=" * 60)
+    print("测试表格单元格索引")
+    print("=" * 60)
+    
+    doc = Document(BytesIO(create_merged_table_doc()))
+    table = doc.tables[0]
+    cells = list(word_service.iter_table_cells(table, 0))
+    
+    assert [(cell_id, cell._tc) for cell_id, cell, _ in cells] == legacy_cell_ids(table, 0)
+    
+    primary = [cell_id for cell_id, _, is_alias in cells if not is_alias]
+    print(f"\n主ID: {primary}")
+    assert primary == ["cell_0_0_0", "cell_0_0_2", "cell_0_1_0", "cell_0_1_1", "cell_0_1_2", "cell_0_2_1", "cell_0_2_2"]
+    
+    # 扫描占位符时合并单元格只识别一次，已有映射中的别名ID仍可替换
+    template_bytes = create_merged_table_doc()
+    mapping = word_service.scan_placeholders(template_bytes)
+    assert mapping["姓名"]["element_id"] == "cell_0_1_0"
+    mapping["姓名"] = dict(mapping["姓名"], element_id="cell_0_2_0")
+    result = Document(BytesIO(word_service.replace_preserving_format(
+        template_bytes, {"姓名": "张三", "身份证号": "110101199001011234"}, location_mapping=mapping
+    )))
+    assert result.tables[0].cell(1, 0).text == "姓名：张三"
+    assert result.tables[0].cell(2, 2).text == "110101199001011234"
+    print("合并单元格编号兼容 [OK]")
+    
+    # 首列纵向合并的长表格：row.cells 每行都向上递归查找起始单元格（平方复杂度，过长会递归溢出）
+    table = create_vmerge_table(150)
+    start = time.perf_counter()
+    fast = [(cell_id, cell._tc) for cell_id, cell, _ in word_service.iter_table_cells(table, 0)]
+    fast_time = time.perf_counter() - start
+    start = time.perf_counter()
+    assert fast == legacy_cell_ids(table, 0)
+    print(f"150行纵向合并: 直接索引 {fast_time:.3f}s，row.cells {time.perf_counter() - start:.3f}s")
+    
+    table = create_vmerge_table(3000)
+    cells = list(word_service.iter_table_cells(table, 0))
+    assert len(cells) == 3000 * 4
+    assert cells[-4][1]._tc is table._tbl.tr_lst[0].tc_lst[0] and cells[-4][2]
+    print("3000行纵向合并: 直接索引 [OK]")
+    
+    print("\n>>> 表格单元格索引测试通过！")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    test_table_index()
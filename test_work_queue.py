@@ -0,0 +1,178 @@
+"""
+测试分布式生成队列
+覆盖：提交时按行分块、多个 worker（不同队列实例，模拟多台机器）同时领取不重复、
+行号跨块连续、生成结果写回共享目录、租约过期后由其他 worker 接手且原 worker 的续约与完成无效、
+出错重试与超过次数后失败、取消任务
+"""
+import sys
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).parent))
+
+import sqlite3
+import tempfile
+import threading
+import time
+import zipfile
+from io import BytesIO
+from docx import Document
+
+from src.services.generation_pipeline import PipelineCancelled
+from src.services.queue_worker import QueueWorker
+from src.services.work_queue import WorkQueue
+from src.services.word_service import word_service
+
+
+def create_template():
+    doc = Document()
+    doc.add_paragraph("乙方：陈长")
+    output = BytesIO()
+    doc.save(output)
+    return output.getvalue()
+
+
+def test_work_queue():
+    """测试分布式生成队列"""
+    print("=" * 60)
+    print("测试分布式生成队列")
+    print("=" * 60)
+    
+    mapping = {"姓名": {"element_id": "para_0", "start": 3, "end": 5, "length": 2, "original_text": "陈长"}}
+    compiled = word_service.compile_template(create_template(), location_mapping=mapping)
+    compiled.key = "tpl:test"
+    templates = [("tpl", "合同", compiled)]
+    spec = {"layout": None, "archive_mode": "stored", "deflate_level": 6, "image_dir": ""}
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        shared = Path(tmp) / "cluster"
+        
+        # 提交：120 行按 50 行分块
+        queue = WorkQueue(shared)
+        rows = ({"姓名": f"员工{i}"} for i in range(120))
+        job_id = queue.submit("合同批次", templates, rows, spec, chunk_rows=50)
+        job = queue.job(job_id)
+        assert (job["status"], job["total_rows"], job["chunks"]) == ("running", 120, 3)
+        print("[提交] 120 行分为 3 块 [OK]")
+        
+        # 两台机器的 worker 同时处理
+        workers = [QueueWorker(WorkQueue(shared), name=f"host{i}", renderers=2) for i in range(2)]
+        threads = [threading.Thread(target=w.run_forever, kwargs={"exit_when_idle": True}) for w in workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        job = queue.job(job_id)
+        assert job["status"] == "done" and job["documents"] == 120 and job["rows_done"] == 120
+        assert sum(w.processed for w in workers) == 3
+        outputs = queue.outputs(job_id)
+        assert [p.name for p in outputs] == ["00000.1.zip", "00001.1.zip", "00002.1.zip"]
+        names = []
+        for path in outputs:
+            with zipfile.ZipFile(path) as zf:
+                names += zf.namelist()
+        assert len(names) == 120 and len(set(names)) == 120
+        with zipfile.ZipFile(outputs[2]) as zf:
+            name = next(n for n in zf.namelist() if "员工110" in n)
+            assert Document(BytesIO(zf.read(name))).paragraphs[0].text == "乙方：员工110"
+        assert queue.workers() == []
+        print(f"[生成] 2 个 worker 处理 {[w.processed for w in workers]} 块，共 {len(names)} 份 [OK]")
+        
+        # 同时领取不会领到同一块
+        job_id = queue.submit("并发领取", templates, ({"姓名": str(i)} for i in range(20)), spec, chunk_rows=1)
+        claimed = []
+        
+        def grab(name):
+            q = WorkQueue(shared)
+            while True:
+                task = q.claim(name)
+                if task is None:
+                    return
+                claimed.append((task["chunk"], task["first_row"]))
+        
+        grabbers = [threading.Thread(target=grab, args=(f"w{i}",)) for i in range(4)]
+        for thread in grabbers:
+            thread.start()
+        for thread in grabbers:
+            thread.join()
+        assert sorted(claimed) == [(i, i) for i in range(20)]
+        queue.cancel(job_id)
+        print("[并发领取] 20 块各领取一次 [OK]")
+        
+        # 租约过期：原 worker 失去数据块，由其他 worker 接手
+        queue = WorkQueue(shared, lease_seconds=0.2, max_attempts=2)
+        job_id = queue.submit("租约", templates, ({"姓名": str(i)} for i in range(5)), spec)
+        dead = queue.claim("dead")
+        assert dead["attempts"] == 1 and queue.claim("other") is None
+        time.sleep(0.3)
+        taken = queue.claim("other")
+        assert taken["chunk"] == dead["chunk"] and taken["attempts"] == 2
+        assert not queue.heartbeat(dead, "dead", 3)
+        assert not queue.complete(dead, "dead", "output/x.zip", 5, 0)
+        assert queue.heartbeat(taken, "other", 3)
+        
+        # 接手后再次过期，超过最多尝试次数：任务失败
+        time.sleep(0.3)
+        assert queue.claim("third") is None
+        job = queue.job(job_id)
+        assert job["status"] == "failed" and "租约" in job["error"]
+        print("[租约] 过期后接手，超过次数后失败 [OK]")
+        
+        # 租约过期但仍在运行的 worker 与接手的 worker 同时生成：写入不同文件，互不影响
+        job_id = queue.submit("同时生成", templates, ({"姓名": str(i)} for i in range(5)), spec)
+        stale = queue.claim("stale")
+        time.sleep(0.3)
+        fresh = queue.claim("fresh")
+        
+        def run(name, task):
+            try:
+                QueueWorker(queue, name=name, renderers=2).process(task)
+            except PipelineCancelled:
+                pass
+        
+        racers = [threading.Thread(target=run, args=args) for args in (("stale", stale), ("fresh", fresh))]
+        for thread in racers:
+            thread.start()
+        for thread in racers:
+            thread.join()
+        assert queue.job(job_id)["status"] == "done"
+        assert [p.name for p in queue.outputs(job_id)] == ["00000.2.zip"]
+        assert [p.name for p in (queue.job_dir(job_id) / "output").iterdir()] == ["00000.2.zip"]
+        with zipfile.ZipFile(queue.outputs(job_id)[0]) as zf:
+            assert zf.testzip() is None and len(zf.namelist()) == 5
+        print("[租约] 新旧 worker 同时生成互不覆盖，旧 worker 的结果已删除 [OK]")
+        
+        # 续约时数据库暂时不可用：继续生成，不中断
+        flaky = WorkQueue(shared, lease_seconds=0.003)
+        job_id = flaky.submit("续约出错", templates, ({"姓名": str(i)} for i in range(20)), spec)
+        
+        def broken_heartbeat(*args):
+            raise sqlite3.OperationalError("database is locked")
+        
+        flaky.heartbeat = broken_heartbeat
+        QueueWorker(flaky, name="flaky", renderers=2).process(flaky.claim("flaky"))
+        assert flaky.job(job_id)["status"] == "done" and flaky.job(job_id)["documents"] == 20
+        print("[续约出错] 继续生成 [OK]")
+        
+        # 出错重试：模板缺失时放回队列，次数用完后失败
+        job_id = queue.submit("出错", templates, ({"姓名": "a"} for _ in range(3)), spec)
+        for path in (queue.job_dir(job_id) / "templates").iterdir():
+            path.unlink()
+        worker = QueueWorker(queue, name="w", renderers=1)
+        assert worker.run_once()
+        assert queue.job(job_id)["status"] == "running" and "预编译模板缺失" in queue.job(job_id)["error"]
+        assert worker.run_once() and not worker.run_once()
+        assert queue.job(job_id)["status"] == "failed"
+        print("[出错] 重试后失败 [OK]")
+        
+        # 取消：未领取的数据块不再生成
+        job_id = queue.submit("取消", templates, ({"姓名": "a"} for _ in range(3)), spec)
+        queue.cancel(job_id)
+        assert queue.claim("w") is None and queue.job(job_id)["status"] == "cancelled"
+        print("[取消] [OK]")
+    
+    print("\n>>> 分布式队列测试通过！")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    test_work_queue()
@@ -0,0 +1,40 @@
+"""
+监视目录守护进程（无人值守生成）
+
+    python watcher.py --root \\\\fileserver\\hr\\contracts --workers 2
+
+把Excel放入 根目录/inbox（文件名为 模板名称.xlsx 或 模板名称__任意.xlsx，或附同名 .json 配置），
+生成的压缩包写入 outbox，处理完的文件移入 processed，出错的移入 failed（附 .error.txt）
+"""
+import sys
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+import argparse
+
+from src.config import HOT_FOLDER_DIR, WATCH_POLL_SECONDS, WATCH_SETTLE_SECONDS, WATCH_WORKERS
+from src.services.hot_folder import HotFolder
+
+
+def main():
+    parser = argparse.ArgumentParser(description="合同批量生成 - 监视目录")
+    parser.add_argument("--root", default=str(HOT_FOLDER_DIR), help="根目录（默认取环境变量 HOT_FOLDER_DIR）")
+    parser.add_argument("--workers", type=int, default=WATCH_WORKERS, help="同时处理的文件数")
+    parser.add_argument("--interval", type=float, default=WATCH_POLL_SECONDS, help="扫描间隔（秒）")
+    parser.add_argument("--settle", type=float, default=WATCH_SETTLE_SECONDS, help="文件保持不变多久后处理（秒）")
+    args = parser.parse_args()
+    
+    folder = HotFolder(Path(args.root), workers=args.workers, settle_seconds=args.settle)
+    print(f"正在监视 {folder.inbox}（Ctrl+C 退出）")
+    try:
+        folder.run_forever(interval=args.interval)
+    except KeyboardInterrupt:
+        print("正在等待处理中的文件完成...")
+        folder.close()
+    print(f"已退出：完成 {folder.stats['done']} 个，失败 {folder.stats['failed']} 个")
+
+
+if __name__ == "__main__":
+    main()
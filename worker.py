@@ -0,0 +1,42 @@
+"""
+分布式生成 worker
+
+在每台机器上运行（各机器挂载同一共享目录，模板、数据和生成结果都在其中）：
+    python worker.py --cluster-dir \\\\fileserver\\contracts\\cluster
+    python worker.py --once          # 处理完队列中的数据块后退出
+
+网页上勾选「提交到分布式队列」后，任务按行切分为数据块，由各 worker 领取生成
+"""
+import sys
+from pathlib import Path
+
+# 添加项目路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+import argparse
+
+from src.config import CLUSTER_DIR, PIPELINE_RENDERERS
+from src.services.queue_worker import QueueWorker
+from src.services.work_queue import WorkQueue
+
+
+def main():
+    parser = argparse.ArgumentParser(description="合同批量生成 worker")
+    parser.add_argument("--cluster-dir", default=str(CLUSTER_DIR), help="共享目录（默认取环境变量 CLUSTER_DIR）")
+    parser.add_argument("--name", default=None, help="worker 名称（默认 主机名:进程号）")
+    parser.add_argument("--renderers", type=int, default=PIPELINE_RENDERERS, help="渲染线程数")
+    parser.add_argument("--once", action="store_true", help="队列空闲时退出")
+    args = parser.parse_args()
+    
+    worker = QueueWorker(WorkQueue(Path(args.cluster_dir)), name=args.name, renderers=args.renderers)
+    print(f"worker {worker.name} 已启动，共享目录: {args.cluster_dir}（Ctrl+C 退出）")
+    try:
+        processed = worker.run_forever(exit_when_idle=args.once)
+    except KeyboardInterrupt:
+        print("已退出（未完成的数据块在租约过期后由其他 worker 接手）")
+        return
+    print(f"队列已空，共处理 {processed} 个数据块")
+
+
+if __name__ == "__main__":
+    main()